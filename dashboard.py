@@ -5,18 +5,77 @@ includes time series and survery data regarding power usage.
 
 Depencies:
     - os: file naviaigation
-    - pandas: CSV/Dataframe manipulation
+    - logging: reports dataset sizes on load
     - dash: Framework for the development of the app functionality
     - plotly.graph_objs: plotting framework integrated into dash app
     - sparkboard/sparkboard.plotting: custom module for the generation of plotly graphs
+    - sparkboard.schema: compact typed schema for the meter data
+    - sparkboard.storage: loads the Parquet copy of a dataset when present, else the CSV
+    - sparkboard.indexing: per-meter row index, selecting a meter is a slice and a zoomed
+      window two binary searches in its sorted times
+    - sparkboard.figure_cache: LRU cache of built figures, stats served at /admin/cache
+    - sparkboard.rollup: per-meter rollups, long time ranges are plotted from the coarsest
+      level that still resolves them
+    - sparkboard.energy: daily and monthly Kosko consumption, per meter or for the fleet
+    - sparkboard.datastore: datasets are loaded on first use, not at import, and swapped
+      for new versions of their files without a restart
+    - sparkboard.column_store: memory-mapped meter data shared between worker processes
+    - sparkboard.metrics: callback, row selection and figure building times served at /metrics
+    - sparkboard.profiling: call profiles of slow graph updates, listed at /admin/profiles
+    - sparkboard.plotting.SurveyFigures: survey column groups derived once per data
+      version, each community's figure built on its first map click
+    - pandas: zoom window bounds
+
+Environment:
+    - SPARKBOARD_COMPACT: set to 0 to keep the data types pandas infers from the CSVs
+    - SPARKBOARD_MAX_POINTS: points per time series trace, re-resolved on zoom (0 keeps all)
+    - SPARKBOARD_RENDER_MODE: 'auto' (default), 'svg' or 'webgl' time series traces
+    - SPARKBOARD_WEBGL_THRESHOLD: points drawn per figure, across all traces, above which
+      'auto' renders with WebGL (default 10000, e.g. a Kosko meter split by ON/OFF draws
+      up to 8 traces of SPARKBOARD_MAX_POINTS)
+    - SPARKBOARD_FIGURE_CACHE_MB: memory budget of the figure cache (0 disables it)
+    - SPARKBOARD_ROLLUPS: set to 0 to always plot the raw samples
+    - SPARKBOARD_WARM_UP: set to 1 to load every dataset and build the survey figures at
+      import instead of on first use
+    - SPARKBOARD_RELOAD_SECONDS: how often to check the processed files for new versions,
+      which are loaded in the background and swapped in (0 disables, see /admin/reload).
+      Every worker process starts its own watcher on its first request, importing the
+      module starts no thread, so it also works with gunicorn --preload
+    - SPARKBOARD_ADMIN_TOKEN: enables the admin actions (POST /admin/reload) and the
+      profile listing (/admin/profiles), which must send the header
+      'Authorization: Bearer <token>'. Unset, they are refused
+    - SPARKBOARD_SHARED: set to 1 to memory map the meter data and rollups from column
+      stores, so the workers of a multi-worker server share one copy (see /admin/memory)
+    - SPARKBOARD_METRICS: set to 1 to record latency histograms, rows and payload sizes of
+      the callbacks and their stages, served in the Prometheus format at /metrics. The
+      metrics are per worker unless SPARKBOARD_METRICS_DIR names a directory shared by
+      the workers, emptied at server start, where each worker keeps its metrics for
+      /metrics to add up (see sparkboard.metrics)
+    - SPARKBOARD_PROFILE: 'header' to profile the graph updates of requests sending
+      'X-Sparkboard-Profile: 1', or a share of all of them such as '0.05'. Profiles of
+      updates slower than SPARKBOARD_PROFILE_THRESHOLD_MS are kept, with their inputs, in
+      SPARKBOARD_PROFILE_DIR (see sparkboard.profiling)
+
+Multi-worker servers load the WSGI app 'server', e.g. gunicorn -w 4 dashboard:server
 """
 import os
+import hmac
+import logging
+import threading
 import pandas as pd
-from dash import Dash, html, dcc, callback, callback_context, Output, Input
+from flask import jsonify, request
+from dash import Dash, html, dcc, callback, callback_context, no_update, Output, Input
+from dash.exceptions import MissingCallbackContextException
 import dash_leaflet as dl
 import plotly.graph_objs as go
 import sparkboard as sb
 from sparkboard.plotting import plotting
+from sparkboard import schema, storage, rollup, energy, column_store, metrics, profiling
+from sparkboard.indexing import MeterIndex
+from sparkboard.figure_cache import FigureCache
+from sparkboard.datastore import DataStore
+
+logger = logging.getLogger(__name__)
 # Decimal GPS Coordinates for different communities in Kampala, Uganda
 coordinates = {
     "Kyebando Kisalosalo": (0.3561, 32.5800),
@@ -31,14 +90,193 @@ coordinates = {
     "Kanyanya": (0.3736, 32.5772)
 }
 
-# Load data from path, navigates to data directory, loads data frames
+compact_schema = os.environ.get("SPARKBOARD_COMPACT", "1") != "0"
+max_points = int(os.environ.get("SPARKBOARD_MAX_POINTS", "2000")) or None
+render_mode = os.environ.get("SPARKBOARD_RENDER_MODE", "auto")
+webgl_threshold = int(os.environ.get("SPARKBOARD_WEBGL_THRESHOLD", "10000"))
+dataset_memory = {}
+figure_cache = FigureCache(int(os.environ.get("SPARKBOARD_FIGURE_CACHE_MB", "256")) * 2**20)
+use_rollups = os.environ.get("SPARKBOARD_ROLLUPS", "1") != "0" and max_points is not None
+reload_seconds = float(os.environ.get("SPARKBOARD_RELOAD_SECONDS", "30"))
+shared_memory = os.environ.get("SPARKBOARD_SHARED", "0") != "0"
+admin_token = os.environ.get("SPARKBOARD_ADMIN_TOKEN", "")
+# Process ID -> the watcher thread it started, see start_watcher
+watchers = {}
+watchers_lock = threading.Lock()
+
+def load_dataset(path, source):
+    """
+    Load a processed dataset (Parquet when present, CSV otherwise), apply the compact
+    schema for meter data and record its in-memory size in 'dataset_memory'.
+
+    Args:
+    path (str): Path to the processed CSV, the Parquet copy shares its stem.
+    source (str): The data source ('kosko'/'a2ei'/'survey').
+
+    Returns:
+    pd.DataFrame: The loaded data.
+    """
+    df = storage.read_processed(path, source if source in schema.SCHEMAS else None)
+    if compact_schema and source in schema.SCHEMAS:
+        df = schema.compact(df, source)
+    dataset_memory[source] = schema.memory_usage(df)
+    logger.info("Loaded %s: %d rows, %s", source, len(df),
+                schema.format_bytes(dataset_memory[source]))
+    return df
+
+def log_mapped(name, df):
+    """
+    Record and log the shared (mapped) and private memory of a dataset in 'dataset_memory'.
+    """
+    memory = column_store.frame_memory(df)
+    dataset_memory[name] = memory['private']
+    logger.info("Mapped %s: %d rows, %s shared, %s private", name, len(df),
+                schema.format_bytes(memory['shared']), schema.format_bytes(memory['private']))
+
+# Paths of the processed data, datasets are loaded on first use (see 'store')
 data_path = os.path.join(sb.__path__[0], '..')
-df_kosko = pd.read_csv(os.path.join(f"{data_path}/data/", 'Kosko/Kosko_processed.csv'))
-df_a2ei = pd.read_csv(os.path.join(f"{data_path}/data/", 'A2EI/A2EI_processed.csv'))
-df_survey = pd.read_csv(os.path.join(f"{data_path}/data/", 'Survey/survey_app_data.csv'))
+kosko_path = os.path.join(f"{data_path}/data/", 'Kosko/Kosko_processed.csv')
+a2ei_path = os.path.join(f"{data_path}/data/", 'A2EI/A2EI_processed.csv')
+survey_path = os.path.join(f"{data_path}/data/", 'Survey/survey_app_data.csv')
+
+def kosko_label(i):
+    """
+    Dropdown label of a Kosko meter, e.g. '064' -> 'EM-064'.
+    """
+    return f"EM-{i}"
+
+def load_meters(path, source):
+    """
+    Load a meter dataset with its per-meter row ranges and dropdown options.
+
+    Args:
+    path (str): Path to the processed CSV.
+    source (str): The data source ('kosko'/'a2ei').
+
+    Returns:
+    dict: 'index' (MeterIndex over the data) and 'options' (dropdown options).
+    """
+    if shared_memory:
+        # Stored in MeterIndex order, so the index slices the mapped columns as they are
+        df = column_store.load(path, lambda: MeterIndex(load_dataset(path, source),
+                                                       time="TIME").df)
+        log_mapped(source, df)
+        index = MeterIndex(df, time="TIME")
+    else:
+        index = MeterIndex(load_dataset(path, source), time="TIME")
+    options = index.options(kosko_label) if source == 'kosko' else index.options()
+    return {'index': index, 'options': options}
+
+def load_rollup_indexes(path, source):
+    """
+    Load the rollups of a meter dataset, written by processing.py or built on load.
+
+    Returns:
+    dict: Per-meter row ranges (MeterIndex) of every rollup level.
+    """
+    df = store.get(source)['index'].df
+    if not shared_memory:
+        return {level: MeterIndex(r, time="TIME") for level, r in
+                rollup.load_rollups(df, path, source).items()}
+    indexes = {}
+    for level in rollup.LEVELS:
+        rdf = column_store.load(rollup.rollup_path(path, level),
+                                lambda level=level: rollup.load_rollups(df, path, source,
+                                                                        [level])[level],
+                                version=storage.data_version(path))
+        log_mapped(f"{source} rollup {level}", rdf)
+        indexes[level] = MeterIndex(rdf, time="TIME")
+    return indexes
+
+def load_consumption():
+    """
+    Load the daily and monthly Kosko consumption, written by processing.py or computed
+    on load.
+
+    Returns:
+    dict: 'daily' and 'monthly' per-meter row ranges (MeterIndex) and 'options', the
+    dropdown options (the fleet and every meter).
+    """
+    days, months = energy.load_consumption(store.get('kosko')['index'].df, kosko_path)
+    index = MeterIndex(days)
+    return {'daily': index, 'monthly': MeterIndex(months),
+            'options': [{'label': 'Fleet', 'value': 'fleet'}] + index.options(kosko_label)}
+
+def invalidate_figures(name):
+    """
+    Drop the cached figures built from a dataset that was just swapped for a new version,
+    e.g. 'kosko rollups' -> the 'kosko' figures.
+    """
+    figure_cache.invalidate(name.split()[0])
+
+def data_version(name):
+    """
+    Version of a dataset for figure cache keys, loading the dataset if needed. Read
+    before a figure is built, so a figure built during a swap is keyed by the old version.
+    """
+    store.get(name)
+    return store.version(name)
+
+# Every dataset is versioned by the processed file it is read or derived from
+versions = {path: lambda path=path: storage.data_version(path)
+            for path in [kosko_path, a2ei_path, survey_path]}
+store = DataStore()
+store.listeners.append(invalidate_figures)
+store.register('kosko', lambda: load_meters(kosko_path, 'kosko'), versions[kosko_path])
+store.register('a2ei', lambda: load_meters(a2ei_path, 'a2ei'), versions[a2ei_path])
+store.register('survey', lambda: plotting.SurveyFigures(load_dataset(survey_path, 'survey')),
+               versions[survey_path])
+store.register('consumption', load_consumption, versions[kosko_path], depends=['kosko'])
+if use_rollups:
+    store.register('kosko rollups', lambda: load_rollup_indexes(kosko_path, 'kosko'),
+                   versions[kosko_path], depends=['kosko'])
+    store.register('a2ei rollups', lambda: load_rollup_indexes(a2ei_path, 'a2ei'),
+                   versions[a2ei_path], depends=['a2ei'])
+
+def warm_up(names = None):
+    """
+    Load datasets ahead of the first request, e.g. from a server's post-fork hook.
+
+    Args:
+    names (list, optional): The datasets to load, all of them by default.
+
+    Returns:
+    dict: Dataset name -> seconds its load took.
+    """
+    seconds = store.warm_up(names)
+    if 'survey' in seconds:
+        store.get('survey').prebuild(list(coordinates))
+    return seconds
+
+def start_watcher():
+    """
+    Start this process's watcher of the processed files, once per process. Threads do
+    not survive a fork, so every worker starts its own instead of inheriting the one of
+    a preloading master.
+    """
+    if reload_seconds <= 0 or os.getpid() in watchers:
+        return
+    with watchers_lock:
+        if os.getpid() not in watchers:
+            watchers[os.getpid()] = store.watch(reload_seconds)
+
+def authorized():
+    """
+    Whether the current request may run admin actions: SPARKBOARD_ADMIN_TOKEN is set
+    and the request sends it as a bearer token.
+    """
+    sent = request.headers.get("Authorization", "")
+    return bool(admin_token) and hmac.compare_digest(sent.encode(),
+                                                     f"Bearer {admin_token}".encode())
+
+if os.environ.get("SPARKBOARD_WARM_UP", "0") != "0":
+    warm_up()
 
 # App inialization
 app = Dash(__name__)
+server = app.server
+server.before_request(start_watcher)
+metrics.instrument(app)
 
 app.layout = html.Div([
     html.H1('Spark-Board', style={'color': '#ffffff',
@@ -53,7 +291,8 @@ app.layout = html.Div([
             options=[
                 {'label': 'Kosko', 'value': 'kosko'},
                 {'label': 'A2EI', 'value': 'a2ei'},
-                {'label': 'Survey', 'value': 'survey'}
+                {'label': 'Survey', 'value': 'survey'},
+                {'label': 'Kosko Consumption', 'value': 'consumption'}
             ],
             value='kosko',
             style={'background': '#333',
@@ -91,6 +330,7 @@ app.layout = html.Div([
                                               'background': '#343a40',
                                               'padding': '10px',
                                               'margin-bottom': '10px'}),
+            # One marker per surveyed community, building the layout reads no data
             dl.Map(
                 [dl.TileLayer()] + [
                     dl.CircleMarker(center=coordinates[name],
@@ -100,7 +340,7 @@ app.layout = html.Div([
                                     fillColor='blue',
                                     fillOpacity=0.25,
                                     id=name)
-                    for name in df_survey["community_name"].unique()],
+                    for name in coordinates],
                 style={'width': '1000px',
                        'height': '600px',
                        'backgroundColor': '#343a40'},
@@ -128,6 +368,7 @@ app.layout = html.Div([
     Output('dropdown-selection', 'options'),
     [Input('data-source-selection', 'value')]
 )
+@metrics.timed("update_dropdown_options", "callback")
 def update_dropdown_options(selected_data_source):
     """
     Update dropdown options based on the selected data source.
@@ -138,18 +379,9 @@ def update_dropdown_options(selected_data_source):
     Returns:
     list: A list of options for the dropdown.
     """
-
-    if selected_data_source == 'kosko':
-        def name_logic(i):
-            if int(i) < 100:
-                i = f"0{i}"
-                return i
-            return str(i)
-        return [{'label': f"EM-{name_logic(i)}", 'value': i}
-                for i in df_kosko['ID'].unique()]
-    if selected_data_source == 'a2ei':
-        return [{'label': i, 'value': i} for i in df_a2ei['ID'].unique()]
-    return []
+    if selected_data_source not in ('kosko', 'a2ei', 'consumption'):
+        return []
+    return store.get(selected_data_source)['options']
 
 @callback(
     [Output('graph-content', 'style'),
@@ -158,6 +390,7 @@ def update_dropdown_options(selected_data_source):
      Output('device-on-off', 'style')],
     [Input('data-source-selection', 'value'),Input("location-info",'children')]
 )
+@metrics.timed("display_logic", "callback")
 def display_logic(selected_data_source,survey_selection):
     """
     Define the display logic for different components based on the selected data source 
@@ -176,57 +409,211 @@ def display_logic(selected_data_source,survey_selection):
         return {'display': 'block'}, {'display': 'None'}, {'display':'block'},{'display':'None'}
     if selected_data_source == "kosko":
         return {'display':'block'},{'background':'#333'},{'display':'None'},{'background':'#333'}
-    if selected_data_source == "a2ei":
+    if selected_data_source in ("a2ei", "consumption"):
         return {'display':'block'},{'background': 'None'},{'display':'None'},{'display':'None'}
     return {'display': 'None'},{'background': 'None'},{'display': 'None'},{'display':'None'}
 
+def zoom_window(relayout_data):
+    """
+    Extract the x-axis window from a graph's relayout event.
+
+    Args:
+    relayout_data (dict or None): The 'relayoutData' of the graph.
+
+    Returns:
+    tuple or None: (start, end) of the zoomed window, (None, None) when the
+    axes were reset, None when the event did not change the x-axis.
+    """
+    if not relayout_data:
+        return None
+    for key, value in relayout_data.items():
+        if key.startswith("xaxis") and key.endswith(".autorange"):
+            return None, None
+        if key.startswith("xaxis") and key.endswith(".range[0]"):
+            end = relayout_data.get(key.replace("[0]", "[1]"))
+            if end is not None:
+                return pd.Timestamp(value), pd.Timestamp(end)
+        if key.startswith("xaxis") and key.endswith(".range"):
+            return pd.Timestamp(value[0]), pd.Timestamp(value[1])
+    return None
+
+def zoom_triggered():
+    """
+    Whether the running callback was triggered by zooming the graph.
+    """
+    try:
+        return callback_context.triggered_id == 'graph-content'
+    except MissingCallbackContextException:
+        return False
+
 @callback(
     Output('graph-content', 'figure'),
     [Input('data-source-selection', 'value'),
      Input('dropdown-selection', 'value'),
      Input('device-on-off', 'value'),
-     Input("location-info",'children')]
+     Input("location-info",'children'),
+     Input('graph-content', 'relayoutData')]
 )
-def update_graph(selected_data_source, selected_account_id, kosko_status, survey_selection):
+@metrics.timed("update_graph", "callback")
+@profiling.profiled("update_graph")
+def update_graph(selected_data_source, selected_account_id, kosko_status, survey_selection,
+                 relayout_data=None):
     """
     Update the graph based on various inputs like data source, 
-    account ID, device status, and survey selection.
+    account ID, device status, and survey selection. Time series are downsampled
+    to 'max_points' per trace, zooming re-resolves the zoomed window at full detail.
 
     Args:
     selected_data_source (str): The selected data source.
     selected_account_id (str): Selected account ID.
     kosko_status (str): The status of the Kosko device (ON/OFF).
     survey_selection (tuple or None): The selected survey data.
+    relayout_data (dict or None): The graph's last zoom/pan event.
 
     Returns:
     object: Plotly graph object.
     """
-    if selected_data_source == 'kosko':
-        dff = df_kosko[df_kosko['ID'] == selected_account_id]
-        columns_to_exclude = ["ID", "TIME", "DEVICE STATUS"]
-        if not kosko_status == "ONOFF":
-            dff = dff[dff["DEVICE STATUS"] == kosko_status]
-    elif selected_data_source == 'a2ei':
-        dff = df_a2ei[df_a2ei['ID'] == selected_account_id]
-        columns_to_exclude = ["ID", "TIME"]
-    elif selected_data_source == 'survey':
+    window = None
+    if zoom_triggered():
+        window = zoom_window(relayout_data)
+        if (window is None or selected_data_source in ('survey', 'consumption') or
+                max_points is None):
+            return no_update
+    if selected_data_source == 'survey':
         ### GET DATA FROM MAP CLICKS
         if survey_selection is None:
             return go.Figure()
         map_input = str(survey_selection['props']['children'])
-        subplot = plotting.PlotSurvey(df_survey, map_input)
-        return subplot.dash_plot()
-    else:
+        # Built once per community and data version, held by the survey dataset itself
+        return store.get('survey').figure(map_input)
+    if selected_data_source == 'consumption':
+        key = ('consumption', selected_account_id, None, data_version('consumption'))
+        return figure_cache.get(key, lambda: consumption_figure(selected_account_id))
+    if selected_data_source not in ('kosko', 'a2ei'):
         return go.Figure()
+    if window is not None and window[0] is not None:
+        # Zoomed windows are rarely requested twice, they are not cached
+        return time_series_figure(selected_data_source, selected_account_id, kosko_status,
+                                  window)
+    mode = kosko_status if selected_data_source == 'kosko' else None
+    key = (selected_data_source, selected_account_id, mode,
+           data_version(selected_data_source))
+    return figure_cache.get(key, lambda: time_series_figure(selected_data_source,
+                                                           selected_account_id, kosko_status))
+
+def time_series_figure(selected_data_source, selected_account_id, kosko_status, window = None):
+    """
+    Build the time series figure of a meter.
+
+    Args:
+    selected_data_source (str): The selected data source ('kosko'/'a2ei').
+    selected_account_id (str): Selected account ID.
+    kosko_status (str): The status of the Kosko device (ON/OFF).
+    window (tuple or None): (start, end) of a zoomed window, None for all data.
+
+    Returns:
+    object: Plotly graph object.
+    """
+    dff = meter_rows(selected_data_source, selected_account_id, kosko_status, window)
+    columns_to_exclude = ["ID", "TIME", "DEVICE STATUS"]
+    dff = coarsen(dff, selected_data_source, selected_account_id, kosko_status, window)
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,selected_data_source,kosko_status)
-    return subplot.dash_plot()
+    subplot = plotting.PlotTimeSeries(dff,columns,selected_data_source,kosko_status,
+                                      max_points=max_points, render_mode=render_mode,
+                                      webgl_threshold=webgl_threshold)
+    fig = subplot.dash_plot()
+    # Keep the user's zoom across re-renders of the same selection
+    fig.update_layout(uirevision=f"{selected_data_source}-{selected_account_id}-{kosko_status}")
+    return fig
+
+@metrics.timed("dashboard.select")
+def meter_rows(selected_data_source, selected_account_id, kosko_status, window = None):
+    """
+    Select the samples of a meter, in its device status for Kosko, within a zoomed window.
+
+    Args:
+    selected_data_source (str): The selected data source ('kosko'/'a2ei').
+    selected_account_id (str): Selected account ID.
+    kosko_status (str): The status of the Kosko device (ON/OFF).
+    window (tuple or None): (start, end) of a zoomed window, None for all data.
+
+    Returns:
+    pd.DataFrame: The raw samples.
+    """
+    start, end = window if window is not None else (None, None)
+    return store.get(selected_data_source)['index'].query(
+        selected_account_id, start, end, status=device_status(selected_data_source,
+                                                              kosko_status))
+
+def device_status(selected_data_source, kosko_status):
+    """
+    The device status to select the samples of, None for all samples.
+    """
+    if selected_data_source == 'kosko' and not kosko_status == "ONOFF":
+        return kosko_status
+    return None
+
+def consumption_figure(selected_account_id):
+    """
+    Build the daily and monthly consumption bars of a Kosko meter or the whole fleet.
+
+    Args:
+    selected_account_id (str): Selected account ID, or 'fleet'.
+
+    Returns:
+    object: Plotly graph object.
+    """
+    if selected_account_id is None:
+        return go.Figure()
+    consumption = store.get('consumption')
+    if selected_account_id == 'fleet':
+        days = energy.fleet(consumption['daily'].df, "DATE")
+        months = energy.fleet(consumption['monthly'].df, "MONTH")
+        title = "Kosko Fleet Consumption"
+    else:
+        days = consumption['daily'].rows(selected_account_id)
+        months = consumption['monthly'].rows(selected_account_id)
+        title = f"{kosko_label(selected_account_id)} Consumption"
+    return plotting.PlotConsumption(days, months, title).dash_plot()
+
+@metrics.timed("dashboard.coarsen")
+def coarsen(dff, selected_data_source, selected_account_id, kosko_status, window = None):
+    """
+    Replace the raw samples of a meter with the min/max envelope of the coarsest rollup
+    level that still gives at least 'max_points' points for the window. The raw samples
+    are kept when they are few enough already or no level has fewer rows.
+
+    Args:
+    dff (pd.DataFrame): The raw samples of the meter within the window.
+    selected_data_source (str): The selected data source ('kosko'/'a2ei').
+    selected_account_id (str): Selected account ID.
+    kosko_status (str): The status of the Kosko device (ON/OFF).
+    window (tuple or None): (start, end) of a zoomed window, None for all data.
+
+    Returns:
+    pd.DataFrame: The samples to plot.
+    """
+    if not use_rollups or len(dff) <= max_points:
+        return dff
+    levels = store.get(f"{selected_data_source} rollups")
+    start, end = window if window is not None else (None, None)
+    status = device_status(selected_data_source, kosko_status)
+    # Buckets overlapping the window, drawn from their start
+    views = {level: index.query(selected_account_id, start, end, status=status,
+                                span=rollup.FREQUENCIES[level])
+             for level, index in levels.items()}
+    level = rollup.choose_level({level: len(rdf) for level, rdf in views.items()},
+                                max_points // 2)
+    if level is None or 2 * len(views[level]) >= len(dff):
+        return dff
+    return rollup.envelope(views[level], selected_data_source, level)
 
 @app.callback(
     Output("location-info", "children"),
     [Input(name, "n_clicks") for name in coordinates],
     prevent_initial_call=True
 )
+@metrics.timed("display_location_info", "callback")
 def display_location_info(*args):
     """
     Display location information based on user interactions with the map.
@@ -248,5 +635,49 @@ def display_location_info(*args):
 
     return out
 
+@app.server.route("/admin/cache")
+def cache_stats():
+    """
+    Serve the figure cache counters as JSON, to size SPARKBOARD_FIGURE_CACHE_MB.
+    """
+    return jsonify(figure_cache.stats())
+
+@app.server.route("/admin/memory")
+def memory_stats():
+    """
+    Serve the memory of this worker as JSON: the process totals (see
+    column_store.process_memory) and the private size of every loaded dataset, which
+    is what each additional worker costs.
+    """
+    return jsonify({'process': column_store.process_memory(),
+                    'datasets': {name: dataset_memory.get(name) for name in dataset_memory},
+                    'shared_memory': shared_memory})
+
+@app.server.route("/admin/reload", methods=["POST"])
+def reload_data():
+    """
+    Reload the datasets whose processed files changed, in the background, and serve the
+    versions being served until the swap. With '?force=1' every loaded dataset is reloaded.
+    Requires the admin token (see authorized).
+    """
+    if not authorized():
+        return jsonify({'error': 'admin token required'}), 403
+    force = request.args.get("force", "0") != "0"
+    store.refresh_in_background(force)
+    return jsonify({name: store.version(name) for name in store.data})
+
+@app.server.route("/admin/profiles")
+def profile_list():
+    """
+    Serve the summaries of the newest profiles of slow graph updates as JSON, newest
+    first. With '?count=<n>' up to n are served (default 20). The summaries hold callback
+    inputs and request bodies, so this requires the admin token (see authorized).
+    """
+    if not authorized():
+        return jsonify({'error': 'admin token required'}), 403
+    count = max(0, request.args.get("count", 20, type=int))
+    return jsonify({'enabled': profiling.enabled, 'directory': profiling.directory,
+                    'profiles': profiling.recent(count)})
+
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,343 @@
+"""
+This module load tests the dashboard: simulated analysts drive its Dash callbacks over
+HTTP, as a browser does, against a locally started server (or any running one), and
+the latency, throughput and payload size of every callback are reported per number of
+concurrent analysts.
+
+Every analyst replays sessions like the real ones, seeded for reproducibility: load the
+page (the initial callbacks), then for each data source in a random order, select it,
+select a few meters and, for Kosko, toggle the device ON/OFF filter, or click a few
+communities on the map for the survey. Requests are the ones the browser sends to
+'/_dash-update-component', built from the server's '/_dash-dependencies', and feed the
+callbacks' responses (dropdown options, the clicked community) into the next requests.
+
+The server started here is the Flask development server, threaded, with the
+environment of this process (e.g. SPARKBOARD_FIGURE_CACHE_MB=0 to load test without
+the figure cache). To load test a production setup, start it separately, e.g.
+'gunicorn -w 4 dashboard:server', and pass its URL.
+
+Usage:
+    python -m sparkboard.benchmarks.loadtest [--users 1 4 16] [--sessions 3] [--seed 0]
+                                             [--url http://127.0.0.1:8050/]
+                                             [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+import sparkboard as sb
+
+ROOT = os.path.abspath(os.path.join(sb.__path__[0], '..'))
+# Callbacks by the output string Dash identifies them with
+CALLBACKS = {"dropdown-selection.options": "update_dropdown_options",
+             "..graph-content.style...dropdown-selection.style...map-container.style..."
+             "device-on-off.style..": "display_logic",
+             "graph-content.figure": "update_graph",
+             "location-info.children": "display_location_info"}
+SOURCES = ["kosko", "a2ei", "survey"]
+SERVER = """
+import sys
+import dashboard
+dashboard.app.run(host="127.0.0.1", port=int(sys.argv[1]), debug=False, threaded=True)
+"""
+
+
+def free_port():
+    """
+    Returns a TCP port nobody listens on.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def start_server(timeout = 120):
+    """
+    Starts the dashboard in a child process and waits until it serves requests.
+
+    Returns:
+    tuple: The child process and the server's URL.
+    """
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, SPARKBOARD_RELOAD_SECONDS="0")
+    server = subprocess.Popen([sys.executable, "-c", SERVER, str(port)], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The dashboard server exited while starting")
+        try:
+            requests.get(url + "_dash-dependencies", timeout=5).raise_for_status()
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The dashboard server did not start within {timeout} s")
+
+def dependencies(url):
+    """
+    Reads the callbacks of the dashboard.
+
+    Returns:
+    dict: Callback name -> its Dash dependency (output string and inputs).
+    """
+    callbacks = requests.get(url + "_dash-dependencies", timeout=30).json()
+    return {CALLBACKS[callback["output"]]: callback for callback in callbacks
+            if callback["output"] in CALLBACKS}
+
+def outputs(output):
+    """
+    Parses a Dash output string into the 'outputs' of a request, e.g.
+    'graph-content.figure' -> {'id': 'graph-content', 'property': 'figure'}.
+    """
+    def parse(part):
+        component, prop = part.rsplit(".", 1)
+        return {"id": component, "property": prop}
+    if output.startswith(".."):
+        return [parse(part) for part in output[2:-2].split("...")]
+    return parse(output)
+
+
+class Analyst:
+    """
+    One simulated analyst, holding the state of a browser page.
+
+    __init__:
+        Constructs with the following objects:
+
+        url (str): The dashboard's URL.
+        callbacks (dict): Callback name -> Dash dependency (see 'dependencies').
+        record (callable): Called with (callback name, seconds, payload bytes, ok).
+        rng (np.random.Generator): Draws the analyst's choices.
+        values (dict): (component ID, property) -> current value on the page.
+
+    Inheritance: None
+    """
+    def __init__(self, url, callbacks, record, seed):
+        self.url = url
+        self.callbacks = callbacks
+        self.record = record
+        self.rng = np.random.default_rng(seed)
+        self.http = requests.Session()
+        self.values = {}
+
+    def call(self, name, changed):
+        """
+        Sends a callback request with the current page values, records it and returns
+        the response's outputs (None for an empty or failed response).
+
+        Args:
+            name (str): The callback name.
+            changed (list): (component ID, property) pairs that triggered it.
+        """
+        callback = self.callbacks[name]
+        body = {"output": callback["output"],
+                "outputs": outputs(callback["output"]),
+                "inputs": [{"id": i["id"], "property": i["property"],
+                            "value": self.values.get((i["id"], i["property"]))}
+                           for i in callback["inputs"]],
+                "changedPropIds": [f"{component}.{prop}" for component, prop in changed],
+                "state": []}
+        start = time.perf_counter()
+        response = self.http.post(self.url + "_dash-update-component", json=body, timeout=300)
+        seconds = time.perf_counter() - start
+        ok = response.status_code in (200, 204)
+        self.record(name, seconds, len(response.content), ok)
+        if response.status_code != 200:
+            return None
+        return response.json()["response"]
+
+    def select_source(self, source):
+        """
+        Selects a data source: the dropdown options, the layout and the graph update.
+
+        Returns:
+        list: The meter options of the source.
+        """
+        self.values[("data-source-selection", "value")] = source
+        self.values[("dropdown-selection", "value")] = None
+        changed = [("data-source-selection", "value")]
+        response = self.call("update_dropdown_options", changed)
+        self.call("display_logic", changed)
+        self.call("update_graph", changed)
+        if response is None:
+            return []
+        return response["dropdown-selection"]["options"]
+
+    def select_meter(self, meter):
+        """
+        Selects a meter in the dropdown.
+        """
+        self.values[("dropdown-selection", "value")] = meter
+        self.call("update_graph", [("dropdown-selection", "value")])
+
+    def toggle_status(self, status):
+        """
+        Selects the Kosko device ON/OFF filter.
+        """
+        self.values[("device-on-off", "value")] = status
+        self.call("update_graph", [("device-on-off", "value")])
+
+    def click_community(self, community, clicks):
+        """
+        Clicks a community on the map: the location info, then the layout and the graph
+        it triggers.
+        """
+        self.values[(community, "n_clicks")] = clicks
+        response = self.call("display_location_info", [(community, "n_clicks")])
+        if response is None:
+            return
+        self.values[("location-info", "children")] = response["location-info"]["children"]
+        changed = [("location-info", "children")]
+        self.call("display_logic", changed)
+        self.call("update_graph", changed)
+
+    def session(self, meters = 3, clicks = 3):
+        """
+        Replays one session: load the page, then visit every source in a random order.
+        """
+        self.values = {("data-source-selection", "value"): "kosko",
+                       ("device-on-off", "value"): "ONOFF"}
+        # Page load: Dash runs every callback without prevent_initial_call
+        for name in ["update_dropdown_options", "display_logic", "update_graph"]:
+            self.call(name, [])
+        for source in self.rng.permutation(SOURCES):
+            options = self.select_source(str(source))
+            if source == "survey":
+                communities = [i["id"] for i in self.callbacks["display_location_info"]["inputs"]]
+                for click in range(1, clicks + 1):
+                    self.click_community(communities[self.rng.integers(len(communities))],
+                                         click)
+                continue
+            for option in self.rng.permutation(len(options))[:meters]:
+                self.select_meter(options[option]["value"])
+                if source == "kosko":
+                    for status in ["ON", "OFF", "ONOFF"]:
+                        self.toggle_status(status)
+
+
+class Recorder:
+    """
+    Collects the requests of all analysts, thread-safe.
+
+    __init__:
+        Constructs with the following objects:
+
+        samples (dict): Callback name -> list of (seconds, payload bytes, ok).
+
+    Inheritance: None
+    """
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, name, seconds, size, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append((seconds, size, ok))
+
+    def summary(self, wall):
+        """
+        Summarizes the requests of a run that took 'wall' seconds.
+
+        Returns:
+        dict: Callback name -> requests, errors, p50/p95/p99 latency in seconds,
+        requests per second and mean payload bytes.
+        """
+        results = {}
+        for name, samples in sorted(self.samples.items()):
+            seconds = np.array([sample[0] for sample in samples])
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+            results[name] = {"requests": len(samples),
+                             "errors": sum(not sample[2] for sample in samples),
+                             "p50": p50, "p95": p95, "p99": p99,
+                             "throughput": len(samples) / wall,
+                             "bytes": float(np.mean([sample[1] for sample in samples]))}
+        return results
+
+def load(url, callbacks, users, sessions, seed = 0):
+    """
+    Runs 'users' analysts at once, each replaying 'sessions' sessions.
+
+    Returns:
+    dict: 'users', 'seconds' (wall time), 'throughput' (requests per second) and
+    'callbacks' (see Recorder.summary).
+    """
+    recorder = Recorder()
+    analysts = [Analyst(url, callbacks, recorder, [seed, user]) for user in range(users)]
+    def replay(analyst):
+        for _ in range(sessions):
+            analyst.session()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(replay, analysts))
+    wall = time.perf_counter() - start
+    summary = recorder.summary(wall)
+    return {"users": users, "seconds": wall,
+            "throughput": sum(result["requests"] for result in summary.values()) / wall,
+            "callbacks": summary}
+
+def run(users = (1, 4, 16), sessions = 3, url = None, seed = 0):
+    """
+    Load tests the dashboard at every number of concurrent users and prints the results.
+    One session is replayed first, unrecorded, so datasets and caches are warm.
+
+    Parameters:
+    users (list): Numbers of concurrent analysts.
+    sessions (int): Sessions replayed by every analyst.
+    url (str, optional): URL of a running dashboard, by default one is started.
+    seed (int): Seed of the analysts' choices.
+
+    Returns:
+    list: The results of every number of users (see 'load').
+    """
+    server = None
+    if url is None:
+        server, url = start_server()
+    try:
+        callbacks = dependencies(url)
+        Analyst(url, callbacks, lambda *sample: None, seed).session()
+        results = []
+        for count in users:
+            result = load(url, callbacks, count, sessions, seed)
+            results.append(result)
+            print(f"{count} users: {result['throughput']:.1f} requests/s")
+            for name, stats in result["callbacks"].items():
+                print(f"    {name:24s} {stats['requests']:6d} requests "
+                      f"p50 {stats['p50'] * 1e3:8.1f} ms  p95 {stats['p95'] * 1e3:8.1f} ms  "
+                      f"p99 {stats['p99'] * 1e3:8.1f} ms  {stats['throughput']:7.1f}/s  "
+                      f"{stats['bytes'] / 1024:9.1f} KiB"
+                      + (f"  {stats['errors']} errors" if stats["errors"] else ""))
+        return results
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+def main(argv = None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Load test the dashboard's callbacks")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16],
+                        help="numbers of concurrent analysts")
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per analyst")
+    parser.add_argument("--url", help="URL of a running dashboard instead of starting one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+    url = args.url if args.url is None or args.url.endswith("/") else args.url + "/"
+    results = run(args.users, args.sessions, url, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=1)
+
+if __name__ == "__main__":
+    main()
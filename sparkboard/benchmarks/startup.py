@@ -0,0 +1,106 @@
+"""
+This module benchmarks the startup of the dashboard: the time to import it, the top-level
+modules that import time goes to, and the time of the first request of every data source
+in a fresh process, i.e. including the lazy load of its datasets. Every measurement runs
+in a new interpreter, so nothing is cached between them.
+
+Importing the dashboard must not load any dataset; the benchmark fails if it does.
+
+Usage:
+    python -m sparkboard.benchmarks.startup [repeats]
+"""
+import os
+import sys
+import json
+import subprocess
+import statistics
+
+import sparkboard as sb
+
+ROOT = os.path.abspath(os.path.join(sb.__path__[0], '..'))
+SOURCES = ["kosko", "a2ei", "survey", "consumption"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import dashboard
+result = {"import": time.perf_counter() - start, "loaded": sorted(dashboard.store.data)}
+source = sys.argv[1]
+if source == "warm_up":
+    start = time.perf_counter()
+    dashboard.warm_up()
+    result["seconds"] = time.perf_counter() - start
+elif source:
+    start = time.perf_counter()
+    options = dashboard.update_dropdown_options(source)
+    account = options[0]["value"] if options else None
+    selection = {"props": {"children": next(iter(dashboard.coordinates))}}
+    dashboard.update_graph(source, account, "ONOFF", selection)
+    result["seconds"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def child(source = "", importtime = False):
+    """
+    Imports the dashboard in a new interpreter and serves the first request of a source
+    ('' for none, 'warm_up' to load every dataset instead).
+
+    Returns:
+    tuple: The measurements of the child and its stderr.
+    """
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    env = dict(os.environ, PYTHONPATH=ROOT, SPARKBOARD_WARM_UP="0",
+               SPARKBOARD_RELOAD_SECONDS="0")
+    done = subprocess.run(command + ["-c", CHILD, source], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    return json.loads(done.stdout.strip().splitlines()[-1]), done.stderr
+
+def import_breakdown(stderr, top = 8):
+    """
+    Parses the output of 'python -X importtime' into the cumulative import time of the
+    modules the dashboard imports directly.
+
+    Returns:
+    list: (module, seconds) pairs, slowest first.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Every level of nesting indents the name by two more spaces
+        if len(name) - len(name.lstrip()) == 3:
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda module: -module[1])[:top]
+
+def run(repeats = 5):
+    """
+    Times the import of the dashboard, the first request of every source and a full
+    warm-up, each the median over fresh processes, and prints them.
+
+    Returns:
+    dict: Seconds keyed by 'import', the source names and 'warm_up'.
+    """
+    imports = []
+    for _ in range(repeats):
+        result, _ = child()
+        if result["loaded"]:
+            raise AssertionError(f"Importing the dashboard loaded {result['loaded']}")
+        imports.append(result["import"])
+    results = {"import": statistics.median(imports)}
+    print(f"{'import dashboard':36s} {results['import']:8.3f} s")
+
+    _, stderr = child(importtime=True)
+    for name, seconds in import_breakdown(stderr):
+        print(f"    {name:32s} {seconds:8.3f} s")
+
+    for source in SOURCES + ["warm_up"]:
+        results[source] = statistics.median(child(source)[0]["seconds"]
+                                            for _ in range(repeats))
+        label = "warm_up (all datasets)" if source == "warm_up" else f"first {source} request"
+        print(f"{label:36s} {results[source]:8.3f} s")
+    return results
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,204 @@
+"""
+This module benchmarks the hot paths of ingestion, analytics and plotting on synthetic
+data of configurable sizes, so that performance regressions show up between runs:
+
+    kosko: Kosko() over one export per meter
+    a2ei: A2EI() over one export holding every meter
+    survey: process_data_survey() over meters x days responses
+    plot_kosko / plot_a2ei: PlotTimeSeries.dash_plot of one processed meter, downsampled
+                            to the dashboard's default of 2000 points per trace
+    plot_survey: PlotSurvey.dash_plot of one community
+
+A size is 'meters x days x sample interval in seconds', e.g. '20x14x60'. The inputs
+are generated by sparkboard.synthetic, the survey with one response per meter and day
+from one community per five meters. Every case records its wall time (the best of
+several runs), its peak memory (traced by tracemalloc in a separate run, which slows
+the code down) and the rows it processed per second. Results can be saved as JSON and compared with the results of an earlier run;
+cases slower or larger than the baseline by more than a threshold are reported as
+regressions and make the command fail.
+
+Usage:
+    python -m sparkboard.benchmarks.suite [--sizes 5x7x60 20x14x60] [--cases kosko ...]
+                                          [--repeats 3] [--output results.json]
+                                          [--compare baseline.json] [--threshold 0.2]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from ..process_kosko import Kosko
+from ..process_a2ei import A2EI
+from ..process_survey import process_data_survey
+from ..plotting import plotting
+from .. import synthetic
+
+CASES = ["kosko", "a2ei", "survey", "plot_kosko", "plot_a2ei", "plot_survey"]
+SIZES = ["5x7x60", "20x14x60"]
+
+
+def parse_size(size):
+    """
+    Parses a size, e.g. '20x14x60' -> (20, 14, 60).
+    """
+    meters, days, interval = (int(part) for part in size.lower().split("x"))
+    return meters, days, interval
+
+def cases(directory, meters, days, interval):
+    """
+    Writes the inputs of a size to 'directory' and prepares the cases.
+
+    Returns:
+    dict: Case -> (callable running it, the number of rows it processes).
+    """
+    kosko_rows = synthetic.write_kosko(directory, meters, 0, interval, days=days)
+    a2ei_rows = synthetic.write_a2ei(directory, meters, 0, interval, days=days)
+    survey_rows = synthetic.write_survey(directory, meters * days, max(1, meters // 5), 0,
+                                         days=days, meters=meters)
+    survey_path = os.path.join(directory, synthetic.SURVEY_FILE)
+    kosko = Kosko(directory=directory)
+    kosko = kosko.query(kosko.index().ids[0])
+    a2ei = A2EI(directory=directory)
+    a2ei = a2ei.query(a2ei.index().ids[0])
+    # Plot the written output, as the dashboard does
+    process_data_survey(path=survey_path, directory=directory)
+    survey = pd.read_csv(os.path.join(directory, "survey_app_data.csv"))
+    community = survey["community_name"].iloc[0]
+
+    def plot_time_series(dff, source):
+        columns = [col for col in dff.columns if col not in ["ID", "TIME", "DEVICE STATUS"]]
+        return plotting.PlotTimeSeries(dff, columns, source, "ONOFF",
+                                       max_points=2000).dash_plot()
+
+    return {"kosko": (lambda: Kosko(directory=directory), kosko_rows),
+            "a2ei": (lambda: A2EI(directory=directory), a2ei_rows),
+            "survey": (lambda: process_data_survey(write_csv=False, path=survey_path,
+                                                   directory=directory), survey_rows),
+            "plot_kosko": (lambda: plot_time_series(kosko, "kosko"), len(kosko)),
+            "plot_a2ei": (lambda: plot_time_series(a2ei, "a2ei"), len(a2ei)),
+            "plot_survey": (lambda: plotting.PlotSurvey(survey, community).dash_plot(),
+                            len(survey))}
+
+def measure(func, repeats):
+    """
+    Runs func 'repeats' times for its best wall time, then once more under tracemalloc
+    for its peak memory.
+
+    Returns:
+    tuple: (seconds, peak bytes).
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak
+
+def environment():
+    """
+    Describes where the results were measured, results from elsewhere compare poorly.
+    """
+    return {"python": platform.python_version(), "pandas": pd.__version__,
+            "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "cpus": os.cpu_count()}
+
+def run(sizes = None, names = None, repeats = 3):
+    """
+    Runs the cases at every size and prints the results.
+
+    Parameters:
+    sizes (list, optional): Sizes such as '20x14x60', SIZES by default.
+    names (list, optional): Cases to run, all of CASES by default.
+    repeats (int): Runs per case, the best wall time is kept.
+
+    Returns:
+    dict: 'environment' and 'results', a list of dicts with the case, size, rows,
+    seconds, peak_bytes and rows_per_second of every run case.
+    """
+    results = []
+    for size in sizes or SIZES:
+        meters, days, interval = parse_size(size)
+        directory = tempfile.mkdtemp(prefix="sparkboard-bench-")
+        try:
+            prepared = cases(directory, meters, days, interval)
+            for name in names or CASES:
+                func, rows = prepared[name]
+                seconds, peak = measure(func, repeats)
+                results.append({"case": name, "size": size, "rows": rows, "seconds": seconds,
+                                "peak_bytes": peak, "rows_per_second": rows / seconds})
+                print(f"{name:12s} {size:>12s} {rows:>11,} rows {seconds:9.3f} s "
+                      f"{peak / 2**20:9.1f} MB {rows / seconds:>13,.0f} rows/s")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {"environment": environment(), "results": results}
+
+def compare(results, baseline, threshold = 0.2):
+    """
+    Compares results with a baseline run, by case and size, and prints the ratios.
+
+    Parameters:
+    results (dict): Output of 'run'.
+    baseline (dict): Output of an earlier 'run'.
+    threshold (float): Relative growth of wall time or peak memory reported as a regression.
+
+    Returns:
+    list: (case, size, metric, ratio) of every regression.
+    """
+    if baseline.get("environment") != results["environment"]:
+        print("Warning: the baseline was measured in another environment")
+    before = {(result["case"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = (result["case"], result["size"])
+        if key not in before:
+            continue
+        ratios = {metric: result[metric] / before[key][metric]
+                  for metric in ["seconds", "peak_bytes"] if before[key][metric]}
+        flagged = [metric for metric, ratio in ratios.items() if ratio > 1 + threshold]
+        regressions += [(*key, metric, ratios[metric]) for metric in flagged]
+        print(f"{key[0]:12s} {key[1]:>12s} "
+              + "   ".join(f"{metric} x{ratio:.2f}" for metric, ratio in ratios.items())
+              + ("   REGRESSION" if flagged else ""))
+    return regressions
+
+def main(argv = None):
+    """
+    Command line entry point, returns the exit status (1 on regressions).
+    """
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, analytics and plotting")
+    parser.add_argument("--sizes", nargs="+", default=SIZES,
+                        help="meters x days x sample interval in seconds, e.g. 20x14x60")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown or memory growth reported as a regression")
+    args = parser.parse_args(argv)
+    results = run(args.sizes, args.cases, args.repeats)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=1)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+This module benchmarks the survey reduction against the per-community loops it replaced,
+on synthetic survey rounds of a configurable size: the rows of the real survey resampled
+over many communities, with raw names in several spellings. Both implementations must
+agree before any timing is reported.
+
+Usage:
+    python -m sparkboard.benchmarks.survey [responses] [communities]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from ..process_survey import (process_name, column_reduction, column_reduction_n,
+                              normalize_communities, data_directory)
+
+COLUMNS = ["Participant_gender", "Sensor_Type", "connection_modality", "rent_own"]
+MODES = ["electricity_payment_to/", "appliances/"]
+
+
+def legacy_column_reduction(df, column):
+    """
+    Previous entry counts: one mask per community and entry.
+    """
+    entries = df[column].unique()
+    entries = [e for e in entries if str(e) != "nan"]
+    out = []
+    for community in df["community_name"].unique():
+        community_df = df[df["community_name"] == community]
+        data = np.zeros_like(entries)
+        for e, i in zip(entries,range(len(data))):
+            data[i] = int((community_df[column] == e).sum())
+        out.append(data)
+    return entries, np.array(out)
+
+def legacy_column_reduction_n(df, mode):
+    """
+    Previous column sums: one filtered copy of the frame per community.
+    """
+    types = [c for c in df.columns if mode in c]
+    sum_list = []
+    for community in df["community_name"].unique():
+        community_df = df[df["community_name"] == community].fillna(0)
+        sum_list.append(community_df[types].sum(axis = 0).values)
+    return [process_name(c, mode = mode) for c in types], np.array(sum_list)
+
+def legacy_normalize_communities(names):
+    """
+    Previous name formatting: one masked assignment per unique name.
+    """
+    df = pd.DataFrame({"community_name": names})
+    for name in df["community_name"].unique():
+        df.loc[df["community_name"] == name, "community_name"] = process_name(name,"community")
+    return df["community_name"]
+
+def legacy_reduce(df):
+    """
+    Previous reduction of all survey columns.
+    """
+    return ([legacy_column_reduction(df, column) for column in COLUMNS] +
+            [legacy_column_reduction_n(df, mode) for mode in MODES])
+
+def reduce(df):
+    """
+    Current reduction of all survey columns.
+    """
+    return ([column_reduction(df, column) for column in COLUMNS] +
+            [column_reduction_n(df, mode) for mode in MODES])
+
+def synthetic_survey(responses, communities, seed = 0):
+    """
+    Resamples the real survey's rows into 'responses' responses from 'communities'
+    communities, each named in three raw export spellings ('village_abc', 'village abc ',
+    'village_abc_'). Names carry letters only, process_name drops digits.
+    """
+    rng = np.random.default_rng(seed)
+    survey = pd.read_csv(f"{data_directory}/Consumption Monitoring Survey_modified.csv")
+    df = survey.iloc[rng.integers(0, len(survey), responses)].reset_index(drop=True)
+    suffixes = np.array(["".join(chr(97 + n // 26**k % 26) for k in range(3))
+                         for n in range(communities)], dtype=object)
+    suffix = suffixes[rng.integers(0, communities, responses)]
+    spelling = rng.integers(0, 3, responses)
+    df["community_name"] = np.where(spelling == 0, "village_" + suffix,
+                                    np.where(spelling == 1, "village " + suffix + " ",
+                                             "village_" + suffix + "_"))
+    return df
+
+def equal(before, after):
+    """
+    Checks two reductions are identical, including the types of the counts.
+    """
+    for (names_before, data_before), (names_after, data_after) in zip(before, after):
+        if names_before != names_after or data_before.dtype != data_after.dtype:
+            return False
+        if data_before.shape != data_after.shape or not np.array_equal(data_before, data_after):
+            return False
+    return True
+
+def measure(func, argument):
+    """
+    Runs func on argument, returns the result and the seconds it took.
+    """
+    start = time.perf_counter()
+    result = func(argument)
+    return result, time.perf_counter() - start
+
+def run(responses = 100_000, communities = 500):
+    """
+    Times legacy and vectorized name formatting and reductions, checks they agree and
+    prints the seconds taken.
+
+    Returns:
+    dict: Seconds keyed by (step, 'before'/'after').
+    """
+    df = synthetic_survey(responses, communities)
+    results = {}
+    before, results[("names", "before")] = measure(legacy_normalize_communities,
+                                                   df["community_name"])
+    after, results[("names", "after")] = measure(normalize_communities, df["community_name"])
+    if not before.equals(after):
+        raise AssertionError("names: vectorized output differs from legacy output")
+    df["community_name"] = after
+    before, results[("reduction", "before")] = measure(legacy_reduce, df)
+    after, results[("reduction", "after")] = measure(reduce, df)
+    if not equal(before, after):
+        raise AssertionError("reduction: vectorized output differs from legacy output")
+    print(f"{responses:,} responses, {df['community_name'].nunique():,} communities")
+    for step in ["names", "reduction"]:
+        print(f"{step:10s} before {results[(step, 'before')]:8.3f} s   "
+              f"after {results[(step, 'after')]:8.3f} s   "
+              f"x{results[(step, 'before')] / results[(step, 'after')]:.1f}")
+    return results
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:3]))
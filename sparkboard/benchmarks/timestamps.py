@@ -0,0 +1,92 @@
+"""
+This module benchmarks the timestamp parsing of the Kosko and A2EI processing against
+the per-row implementations it replaced, on synthetic input of a configurable size.
+Both implementations must agree before any timing is reported.
+
+The A2EI export is measured twice: per column, and per export, where the previous
+processing reformatted all three time columns and now only 'measurementTime' is kept.
+
+Usage:
+    python -m sparkboard.benchmarks.timestamps [rows]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from ..process_kosko import parse_time
+from ..process_a2ei import TIME_COLUMNS, reformat, reformat_column
+
+
+def legacy_parse_time(time_column):
+    """
+    Previous Kosko conversion: prepend '20' per row with apply, then parse.
+    """
+    time_column = time_column.apply(lambda x: '20' + x)
+    return pd.to_datetime(time_column, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+
+def legacy_reformat_column(column):
+    """
+    Previous A2EI conversion: the 'reformat' helper applied per row.
+    """
+    return column.apply(reformat)
+
+def legacy_a2ei_times(frame):
+    """
+    Previous A2EI processing: all three time columns reformatted per row.
+    """
+    return frame.apply(lambda column: column.apply(reformat))["measurementTime"]
+
+def a2ei_times(frame):
+    """
+    Current A2EI processing: only the kept 'measurementTime' column, vectorized.
+    """
+    return reformat_column(frame["measurementTime"])
+
+def synthetic_times(rows, seed = 0):
+    """
+    Builds Kosko ('yy-mm-dd HH:MM:SS') and A2EI (ISO 8601 with fractional seconds)
+    timestamp columns with a sprinkle of malformed Kosko entries and missing A2EI entries.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp("2023-01-01") + pd.to_timedelta(
+        np.sort(rng.integers(0, 365 * 86400, rows)), unit="s")
+    kosko = pd.Series(times.strftime("%y-%m-%d %H:%M:%S"), dtype=object)
+    kosko[rng.random(rows) < 0.001] = "23-02-30 12:00:00"
+    a2ei = pd.Series(times.strftime("%Y-%m-%dT%H:%M:%S"), dtype=object) + ".000Z"
+    a2ei[rng.random(rows) < 0.001] = np.nan
+    return kosko, a2ei
+
+def measure(func, column):
+    """
+    Runs func on column, returns the result and the rows per second.
+    """
+    start = time.perf_counter()
+    result = func(column)
+    return result, len(column) / (time.perf_counter() - start)
+
+def run(rows = 2_000_000):
+    """
+    Times legacy and vectorized conversions, checks they agree and prints rows/second.
+
+    Returns:
+    dict: Rows per second keyed by (converter, 'before'/'after').
+    """
+    kosko, a2ei = synthetic_times(rows)
+    results = {}
+    frame = pd.DataFrame({column: a2ei for column in TIME_COLUMNS})
+    for name, legacy, vectorized, column in [
+            ("Kosko parse_time", legacy_parse_time, parse_time, kosko),
+            ("A2EI reformat (per column)", legacy_reformat_column, reformat_column, a2ei),
+            ("A2EI times (per export)", legacy_a2ei_times, a2ei_times, frame)]:
+        before, results[(name, "before")] = measure(legacy, column)
+        after, results[(name, "after")] = measure(vectorized, column)
+        if not before.equals(after):
+            raise AssertionError(f"{name}: vectorized output differs from legacy output")
+        print(f"{name:28s} before {results[(name, 'before')]:>12,.0f} rows/s   "
+              f"after {results[(name, 'after')]:>12,.0f} rows/s   "
+              f"x{results[(name, 'after')] / results[(name, 'before')]:.1f}")
+    return results
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
@@ -0,0 +1,84 @@
+"""
+This module benchmarks the memory of several dashboard workers holding the processed
+Kosko data, each loading a private copy versus all mapping one column store (see
+sparkboard.column_store). The workers run side by side as separate processes, read every
+column, and report their proportional set size (PSS), which divides shared pages among
+the workers, so the sum over the workers is their real footprint. Linux only.
+
+Usage:
+    python -m sparkboard.benchmarks.workers [workers]
+"""
+import os
+import sys
+import json
+import subprocess
+
+import sparkboard as sb
+
+ROOT = os.path.abspath(os.path.join(sb.__path__[0], '..'))
+KOSKO_PATH = os.path.join(ROOT, "data", "Kosko", "Kosko_processed.csv")
+
+CHILD = """
+import sys, json
+import pandas as pd
+from sparkboard import schema, storage, column_store
+path, mode = sys.argv[1], sys.argv[2]
+if storage.HAS_PARQUET:
+    import pyarrow.parquet # the reader's own footprint is not the data's
+baseline = column_store.process_memory()
+load = lambda: schema.compact(storage.read_processed(path), "kosko")
+df = column_store.load(path, load) if mode == "shared" else load()
+# Touch every column, as serving requests over time does
+for column in df.columns:
+    pd.util.hash_pandas_object(df[column], index=False).sum()
+print("loaded", flush=True)
+sys.stdin.readline()
+memory = column_store.process_memory()
+print(json.dumps({key: memory[key] - baseline[key] for key in memory}), flush=True)
+"""
+
+
+def measure(mode, workers):
+    """
+    Starts 'workers' processes loading the Kosko data privately or shared ('private'/
+    'shared'), and reads their memory once all of them hold the data.
+
+    Returns:
+    list: The memory growth (see column_store.process_memory) of every worker in bytes.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    children = [subprocess.Popen([sys.executable, "-c", CHILD, KOSKO_PATH, mode], cwd=ROOT,
+                                 env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 text=True) for _ in range(workers)]
+    for child in children:
+        if child.stdout.readline().strip() != "loaded":
+            raise RuntimeError(f"A {mode} worker failed to load the data")
+    results = []
+    for child in children:
+        child.stdin.write("\n")
+        child.stdin.flush()
+        results.append(json.loads(child.stdout.readline()))
+        child.wait()
+    return results
+
+def run(workers = 4):
+    """
+    Measures and prints the memory of the workers in both modes.
+
+    Returns:
+    dict: Mode -> the summed PSS growth of all workers in bytes.
+    """
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise RuntimeError("Measuring worker memory requires /proc/self/smaps_rollup (Linux)")
+    from sparkboard import schema # pylint: disable=import-outside-toplevel
+    totals = {}
+    for mode in ["private", "shared"]:
+        results = measure(mode, workers)
+        totals[mode] = sum(result["pss"] for result in results)
+        print(f"{mode:8s} {workers} workers: "
+              f"PSS {schema.format_bytes(totals[mode]):>10s} in total, "
+              f"private {schema.format_bytes(results[0]['private']):>10s} per worker")
+    return totals
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
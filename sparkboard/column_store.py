@@ -0,0 +1,217 @@
+"""
+This script stores processed meter data as a column store, i.e. one uncompressed .npy
+file per column next to the processed CSV, e.g. 'data/Kosko/Kosko_processed.columns/'.
+Categorical columns are stored as their integer codes, with the categories in the
+store's manifest.
+
+Opened memory mapped, the columns live in the operating system's page cache instead of
+the process: every dashboard worker maps the same pages read-only, so N workers hold
+one copy of the meter data instead of N, and building a DataFrame over the mapped
+columns copies nothing. Filtering or slicing a meter out of it still gives small private
+copies or views, as usual.
+
+A store is built for one version of the processed data (see storage.data_version).
+Builds write to a temporary directory that is renamed into place, so workers never map
+a partial store, and concurrent builds by several workers are harmless: the first
+rename wins. Once a newer store is in place, stores of other versions are removed if
+they have not been built within GRACE seconds: workers that just looked one of them up
+can still open it, workers still mapping one keep their pages until they reload. A
+store removed between the lookup and opening it is looked up once more.
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from sparkboard import storage
+
+MANIFEST = "manifest.json"
+# Part of the store names, raised when the stored layout (e.g. the row order the
+# dashboard stores in, or the type of the IDs) changes, so stores of an older layout
+# are rebuilt
+LAYOUT = 3
+# Seconds stores of other versions are kept after a newer one is built, longer than
+# the dashboard's reload interval
+GRACE = 300
+
+
+def store_path(csv_path):
+    """
+    Returns the directory of the column stores of a processed CSV,
+    e.g. 'x/Kosko_processed.csv' -> 'x/Kosko_processed.columns'.
+    """
+    return f"{os.path.splitext(csv_path)[0]}.columns"
+
+def version_name(version):
+    """
+    Names the store directory of a data version,
+    e.g. 'Kosko_processed.parquet-<mtime>-<size>-<layout>'.
+    """
+    name, mtime, size = version
+    return f"{name}-{mtime}-{size}-{LAYOUT}"
+
+def write(df, directory):
+    """
+    Writes a DataFrame as a column store. Object columns (e.g. strings) cannot be mapped
+    and are stored as categoricals. The index is not stored.
+
+    Parameters:
+    df (pd.DataFrame): The data.
+    directory (str): The store directory, created with its parents; it must not exist.
+    """
+    os.makedirs(directory)
+    columns = []
+    for number, column in enumerate(df.columns):
+        values = df[column]
+        if values.dtype == object:
+            values = values.astype("category")
+        entry = {"name": column, "file": f"{number}.npy"}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry["categories"] = values.cat.categories.tolist()
+            entry["ordered"] = bool(values.cat.ordered)
+            array = values.cat.codes.to_numpy()
+        else:
+            array = values.to_numpy()
+        np.save(os.path.join(directory, entry["file"]), array, allow_pickle=False)
+        columns.append(entry)
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as manifest:
+        json.dump({"rows": len(df), "columns": columns}, manifest)
+
+def read(directory, mmap = True):
+    """
+    Reads a column store.
+
+    Parameters:
+    directory (str): The store directory.
+    mmap (bool): Flag to map the columns read-only instead of reading them into memory.
+
+    Returns:
+    pd.DataFrame: The data, with a RangeIndex.
+    """
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as manifest:
+        layout = json.load(manifest)
+    data = {}
+    for entry in layout["columns"]:
+        array = np.load(os.path.join(directory, entry["file"]), mmap_mode="r" if mmap else None,
+                        allow_pickle=False)
+        if "categories" in entry:
+            dtype = pd.CategoricalDtype(entry["categories"], ordered=entry["ordered"])
+            array = pd.Categorical.from_codes(array, dtype=dtype, validate=False)
+        data[entry["name"]] = array
+    # copy=False keeps one block per column, backed by the mapping
+    return pd.DataFrame(data, copy=False)
+
+def load(csv_path, build, version = None, mmap = True):
+    """
+    Opens the column store of the current version of a processed dataset, building it
+    from 'build()' first if it does not exist yet.
+
+    Parameters:
+    csv_path (str): Path of the processed CSV the store belongs to.
+    build (callable): Returns the DataFrame to store, only called to build the store.
+    version (tuple, optional): The data version, storage.data_version(csv_path) by
+                               default. Stores derived from another dataset (e.g. its
+                               rollups) pass the version of that dataset.
+    mmap (bool): Flag to map the columns read-only instead of reading them into memory.
+
+    Returns:
+    pd.DataFrame: The data.
+
+    Raises:
+    FileNotFoundError: If the processed dataset does not exist.
+    """
+    try:
+        return read(build_store(csv_path, build, version), mmap)
+    except FileNotFoundError:
+        # A newer build removed the store in between, look up the current version
+        return read(build_store(csv_path, build, version), mmap)
+
+def build_store(csv_path, build, version = None):
+    """
+    Builds the column store of a version of a processed dataset if it does not exist
+    yet, then removes the stores of other versions built more than GRACE seconds ago.
+    See 'load' for the parameters.
+
+    Returns:
+    str: The store directory.
+    """
+    version = version or storage.data_version(csv_path)
+    if version is None:
+        raise FileNotFoundError(f"No processed data at '{csv_path}'")
+    root = store_path(csv_path)
+    directory = os.path.join(root, version_name(version))
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        os.makedirs(root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=root, prefix=".build-")
+        try:
+            write(build(), os.path.join(staging, "store"))
+            os.rename(os.path.join(staging, "store"), directory)
+        except OSError:
+            # Another worker renamed its build into place first
+            if not os.path.exists(os.path.join(directory, MANIFEST)):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name == version_name(version) or name.startswith("."):
+                continue
+            try:
+                expired = time.time() - os.path.getmtime(path) > GRACE
+            except FileNotFoundError:
+                continue
+            if expired:
+                shutil.rmtree(path, ignore_errors=True)
+    return directory
+
+def is_mapped(array):
+    """
+    Whether a numpy array is backed by a memory-mapped file.
+    """
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+def frame_memory(df):
+    """
+    Splits the memory of a DataFrame into the bytes backed by mapped files, which are
+    shared between processes, and the private bytes of this process.
+
+    Returns:
+    dict: 'shared' and 'private' size in bytes.
+    """
+    shared = 0
+    for column in df.columns:
+        values = df[column].array
+        array = values.codes if isinstance(values, pd.Categorical) else values.to_numpy()
+        if is_mapped(array):
+            shared += array.nbytes
+    total = int(df.memory_usage(deep=True).sum())
+    return {"shared": shared, "private": total - shared}
+
+def process_memory():
+    """
+    Reports the memory of this process from /proc/self/smaps_rollup (Linux only):
+    'rss' (resident), 'pss' (resident, shared pages divided among the processes mapping
+    them), 'shared' (resident pages also mapped by other processes) and 'private'.
+
+    Returns:
+    dict or None: Sizes in bytes, None where smaps_rollup is unavailable.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", encoding="utf-8") as smaps:
+            fields = {}
+            for line in smaps:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {"rss": fields.get("Rss", 0),
+            "pss": fields.get("Pss", 0),
+            "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
@@ -0,0 +1,242 @@
+"""
+This script provides lazy loading of the datasets served by the dashboard. Every dataset
+is registered with a loader and read on its first use, so a worker only pays for the
+sources its users open and starts serving requests before any data is read.
+
+Loads are thread-safe: concurrent first requests for a dataset wait for one load instead
+of each reading it. 'warm_up' loads datasets ahead of the first request.
+
+Datasets can be registered with a version (e.g. the mtime of their file). 'refresh', run
+periodically by 'watch' or triggered explicitly, loads the new version of a changed
+dataset next to the old one and swaps it in with a single assignment, so readers see
+either the old or the new dataset, never a partial one. Datasets derived from it (see
+'depends') are reloaded after it, and listeners are told about every swap, e.g. to drop
+cached figures of the old version.
+
+Example:
+    store = DataStore()
+    store.register("kosko", lambda: load_dataset(kosko_path, "kosko"),
+                   version=lambda: os.stat(kosko_path).st_mtime_ns)
+    df_kosko = store.get("kosko")
+    store.watch(30)
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DataStore:
+    """
+    Registry of lazily loaded datasets.
+
+    __init__:
+        Constructs with the following objects:
+
+        loaders (dict): Dataset name -> callable without arguments returning the dataset.
+        data (dict): Dataset name -> the loaded dataset, for loaded datasets only.
+        versions (dict): Dataset name -> version of the loaded dataset.
+        load_seconds (dict): Dataset name -> duration of its last load.
+        listeners (list): Callables called with the name of every swapped dataset.
+
+    get:
+        Returns a dataset, loading it on first use. Loaders may get other datasets, e.g.
+        a dataset derived from another one.
+
+    warm_up:
+        Loads datasets ahead of their first use.
+
+    refresh:
+        Reloads the loaded datasets whose version changed.
+
+    watch:
+        Refreshes periodically in a background thread.
+
+    Inheritance: None
+    """
+    def __init__(self):
+        self.loaders = {}
+        self.data = {}
+        self.versions = {}
+        self.load_seconds = {}
+        self.listeners = []
+        self.version_of = {}
+        self.dependents = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def register(self, name, loader, version = None, depends = ()):
+        """
+        Registers (or replaces) the loader of a dataset. A loaded copy is dropped.
+
+        Parameters:
+        name (str): The dataset name.
+        loader (callable): Returns the dataset, called without arguments.
+        version (callable, optional): Returns the current version of the dataset's
+                                      source, e.g. its file's mtime. Without it the
+                                      dataset is only reloaded when forced.
+        depends (list): Datasets this one is derived from; it is reloaded after them.
+        """
+        with self.lock:
+            self.loaders[name] = loader
+            self.locks.setdefault(name, threading.Lock())
+            self.data.pop(name, None)
+            self.versions.pop(name, None)
+            self.version_of[name] = version
+            for parent in depends:
+                self.dependents.setdefault(parent, []).append(name)
+
+    def loaded(self, name):
+        """
+        Whether a dataset has been loaded.
+        """
+        return name in self.data
+
+    def get(self, name):
+        """
+        Returns a dataset, loading it if this is its first use.
+
+        Raises:
+        KeyError: If no loader is registered under the name.
+        """
+        try:
+            return self.data[name]
+        except KeyError:
+            pass
+        if name not in self.loaders:
+            raise KeyError(f"No dataset '{name}' registered")
+        with self.locks[name]:
+            # Another thread may have loaded it while this one waited for the lock
+            if name not in self.data:
+                self.load(name)
+        return self.data[name]
+
+    def version(self, name):
+        """
+        Returns the version of a loaded dataset, None if it is not loaded or unversioned.
+        """
+        return self.versions.get(name)
+
+    def current_version(self, name):
+        """
+        Returns the current version of a dataset's source.
+        """
+        version = self.version_of.get(name)
+        return version() if version is not None else None
+
+    def load(self, name):
+        """
+        Loads a dataset and swaps it in. The caller holds the dataset's lock.
+        """
+        # Read the version first: if the source changes during the load, the next
+        # refresh sees a newer version and loads again
+        version = self.current_version(name)
+        start = time.perf_counter()
+        data = self.loaders[name]()
+        with self.lock:
+            self.data[name] = data
+            self.versions[name] = version
+        self.load_seconds[name] = time.perf_counter() - start
+        logger.info("Loaded dataset '%s' (version %s) in %.2fs", name, version,
+                    self.load_seconds[name])
+
+    def unload(self, name):
+        """
+        Drops a loaded dataset, its next use loads it again.
+        """
+        with self.locks.get(name, self.lock):
+            with self.lock:
+                self.data.pop(name, None)
+                self.versions.pop(name, None)
+
+    def reload(self, name, force = False):
+        """
+        Loads the current version of a loaded dataset and swaps it in, then reloads the
+        loaded datasets derived from it. Readers keep being served the old version
+        until the swap. Datasets that are not loaded are left to load on first use.
+
+        Parameters:
+        name (str): The dataset name.
+        force (bool): Flag to reload even if the version did not change.
+
+        Returns:
+        list: The names of the reloaded datasets.
+        """
+        if name not in self.data:
+            return []
+        with self.locks[name]:
+            if not force and self.current_version(name) == self.versions.get(name):
+                return []
+            self.load(name)
+        for listener in self.listeners:
+            listener(name)
+        reloaded = [name]
+        for dependent in self.dependents.get(name, []):
+            reloaded += self.reload(dependent, force=True)
+        return reloaded
+
+    def refresh(self, force = False):
+        """
+        Reloads every loaded dataset whose version changed (every one if forced). A
+        failed reload is logged and keeps the loaded version, the next refresh retries.
+
+        Returns:
+        list: The names of the reloaded datasets.
+        """
+        reloaded = []
+        for name in list(self.loaders):
+            if name in reloaded:
+                continue
+            try:
+                reloaded += self.reload(name, force)
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Reloading dataset '%s' failed, keeping version %s",
+                                 name, self.versions.get(name))
+        return reloaded
+
+    def refresh_in_background(self, force = False):
+        """
+        Runs 'refresh' in a new daemon thread and returns the thread.
+        """
+        thread = threading.Thread(target=self.refresh, kwargs={"force": force}, daemon=True,
+                                  name="datastore-refresh")
+        thread.start()
+        return thread
+
+    def watch(self, interval):
+        """
+        Refreshes every 'interval' seconds in a daemon thread, until 'stop' is called.
+
+        Returns:
+        threading.Thread: The watcher thread.
+        """
+        def loop():
+            while not self.stopped.wait(interval):
+                self.refresh()
+        thread = threading.Thread(target=loop, daemon=True, name="datastore-watch")
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stops the watcher thread.
+        """
+        self.stopped.set()
+
+    def warm_up(self, names = None):
+        """
+        Loads datasets ahead of their first use.
+
+        Parameters:
+        names (list, optional): The datasets to load, all registered ones by default.
+
+        Returns:
+        dict: Dataset name -> duration of its load in seconds (0 if it was loaded before).
+        """
+        names = list(self.loaders) if names is None else names
+        loaded = {name: self.loaded(name) for name in names}
+        for name in names:
+            self.get(name)
+        return {name: 0.0 if loaded[name] else self.load_seconds[name] for name in names}
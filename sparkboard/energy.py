@@ -0,0 +1,167 @@
+"""
+This script turns the cumulative KWH register of the Kosko meters into daily and
+monthly consumption per meter:
+    1) the register increase between consecutive samples of a meter, where a drop is
+       either a rollover of the register (counting on from ROLLOVER) or a reset (the
+       register restarted from zero)
+    2) the cumulative consumption, interpolated linearly at every midnight, so energy
+       used during gaps between exports is spread over the days of the gap
+    3) daily consumption as the difference between midnights, summed into months
+Days without samples of their own are marked as estimated.
+
+All steps are grouped, vectorized array operations over the whole fleet.
+"""
+import os
+import numpy as np
+import pandas as pd
+from sparkboard import schema, storage, metrics
+
+# Largest reading of the register before it wraps to zero
+ROLLOVER = 100000.0
+# Drops of at most this many kWh are read as measurement noise, not as a reset
+JITTER = 0.01
+DAILY_FILE = "Kosko_daily.csv"
+MONTHLY_FILE = "Kosko_monthly.csv"
+
+
+def register_delta(ids, kwh, rollover = ROLLOVER, jitter = JITTER):
+    """
+    Computes the consumption since the previous sample of the same meter from a
+    cumulative register. The first sample of every meter consumed nothing.
+
+    A drop of the register is a rollover if the previous reading was in the top tenth
+    of the register's range (consumption is 'rollover - previous + current'), a reset
+    otherwise (consumption is the current reading). Drops up to 'jitter' count as zero.
+
+    Parameters:
+    ids (np.ndarray): Meter IDs (or codes), rows sorted by ID and TIME.
+    kwh (np.ndarray): The register readings.
+    rollover (float): The register value at which it wraps.
+    jitter (float): The largest drop treated as noise.
+
+    Returns:
+    np.ndarray: The consumption of every sample in kWh.
+    """
+    kwh = np.nan_to_num(np.asarray(kwh, dtype=np.float64))
+    ids = np.asarray(ids)
+    delta = np.zeros(len(kwh))
+    if len(kwh) < 2:
+        return delta
+    previous, current = kwh[:-1], kwh[1:]
+    step = current - previous
+    rolled = previous >= 0.9 * rollover
+    step = np.where(step >= -jitter, np.maximum(step, 0),
+                    np.where(rolled, rollover - previous + current, current))
+    delta[1:] = np.where(ids[1:] == ids[:-1], step, 0.0)
+    return delta
+
+def daily(df, rollover = ROLLOVER, jitter = JITTER):
+    """
+    Computes the daily consumption of every meter from processed Kosko data.
+
+    Parameters:
+    df (pd.DataFrame): Processed Kosko data with ID, TIME and KWH, any row order.
+    rollover (float): The register value at which it wraps.
+    jitter (float): The largest drop treated as noise.
+
+    Returns:
+    pd.DataFrame: One row per meter and day from its first to its last sample, with the
+    columns ID, DATE, ENERGY (kWh), SAMPLES and ESTIMATED (no samples that day).
+    """
+    df = schema.parse_times(df[["ID", "TIME", "KWH"]].copy(), "kosko")
+    df = df[df["TIME"].notna() & df["KWH"].notna()]
+    df = df.sort_values(by=["ID", "TIME"], kind="mergesort")
+    codes, ids = pd.factorize(df["ID"])
+    if len(codes) == 0:
+        return pd.DataFrame({"ID": [], "DATE": pd.Series([], dtype="datetime64[ns]"),
+                             "ENERGY": [], "SAMPLES": [], "ESTIMATED": []})
+    times = df["TIME"].to_numpy().astype("datetime64[ns]")
+    energy = np.cumsum(register_delta(codes, df["KWH"].to_numpy(), rollover, jitter))
+
+    # Per meter: its first sample, every midnight up to its last sample, its last sample
+    first = np.flatnonzero(np.diff(codes, prepend=-1))
+    last = np.append(first[1:], len(codes)) - 1
+    first_day = times[first].astype("datetime64[D]")
+    last_day = times[last].astype("datetime64[D]")
+    days = (last_day - first_day).astype(np.int64) + 1
+    base = np.cumsum(days) - days
+    meter = np.repeat(np.arange(len(first)), days)
+    offset = np.arange(days.sum()) - base[meter]
+    day = np.repeat(first_day, days) + offset.astype("timedelta64[D]")
+    start = np.maximum(day.astype("datetime64[ns]"), np.repeat(times[first], days))
+    end = np.minimum((day + 1).astype("datetime64[ns]"), np.repeat(times[last], days))
+
+    # One strictly increasing axis over all meters, so one np.interp serves the fleet
+    origin = times.min()
+    span = (times.max() - origin).astype(np.int64) / 1e9 + 1
+    curve = codes * span + (times - origin).astype(np.int64) / 1e9
+    used = (np.interp(meter * span + (end - origin).astype(np.int64) / 1e9, curve, energy) -
+            np.interp(meter * span + (start - origin).astype(np.int64) / 1e9, curve, energy))
+
+    sample_day = base[codes] + (times.astype("datetime64[D]") - first_day[codes]).astype(np.int64)
+    samples = np.bincount(sample_day, minlength=len(day))
+    return pd.DataFrame({"ID": ids.take(meter),
+                         "DATE": day.astype("datetime64[ns]"),
+                         "ENERGY": used,
+                         "SAMPLES": samples,
+                         "ESTIMATED": samples == 0})
+
+def monthly(days):
+    """
+    Sums daily consumption into months.
+
+    Parameters:
+    days (pd.DataFrame): Daily consumption built by 'daily'.
+
+    Returns:
+    pd.DataFrame: One row per meter and month with the columns ID, MONTH, ENERGY (kWh),
+    SAMPLES and ESTIMATED (days without samples).
+    """
+    month = days["DATE"].dt.to_period("M").dt.start_time
+    grouped = days.groupby([days["ID"], month.rename("MONTH")], sort=False, observed=True)
+    months = grouped[["ENERGY", "SAMPLES", "ESTIMATED"]].sum().reset_index()
+    return months.sort_values(by=["ID", "MONTH"], kind="mergesort", ignore_index=True)
+
+def fleet(consumption, period = "DATE"):
+    """
+    Sums the consumption of all meters per day ('DATE') or month ('MONTH').
+    """
+    return consumption.groupby(period, sort=True)[["ENERGY", "SAMPLES", "ESTIMATED"]].sum(
+        ).reset_index()
+
+@metrics.timed("energy.write")
+def write_consumption(df, directory, write_csv = True, write_parquet = False):
+    """
+    Computes the daily and monthly consumption of processed Kosko data and writes them
+    to 'Kosko_daily' and 'Kosko_monthly' in the given directory.
+
+    Returns:
+    tuple: The daily and monthly consumption.
+    """
+    days = daily(df)
+    months = monthly(days)
+    storage.write_processed(days, os.path.join(directory, DAILY_FILE), write_csv, write_parquet)
+    storage.write_processed(months, os.path.join(directory, MONTHLY_FILE), write_csv,
+                            write_parquet)
+    return days, months
+
+@metrics.timed("energy.load")
+def load_consumption(df, csv_path):
+    """
+    Loads the daily and monthly consumption written next to a processed Kosko dataset,
+    computing them from 'df' if they are missing or older than the processed data.
+
+    Returns:
+    tuple: The daily and monthly consumption.
+    """
+    directory = os.path.dirname(csv_path)
+    version = storage.data_version(csv_path)
+    paths = [os.path.join(directory, DAILY_FILE), os.path.join(directory, MONTHLY_FILE)]
+    written = [storage.data_version(path) for path in paths]
+    if version is None or any(w is None or w[1] < version[1] for w in written):
+        days = daily(df)
+        return days, monthly(days)
+    days, months = (storage.read_processed(path, "kosko") for path in paths)
+    days["DATE"] = pd.to_datetime(days["DATE"])
+    months["MONTH"] = pd.to_datetime(months["MONTH"])
+    return days, months
@@ -0,0 +1,362 @@
+"""
+This script detects electric cooking events in processed meter data. A sample is
+active when the meter draws at least a threshold power (WATT for Kosko, POWER for A2EI)
+and, for Kosko, reports the device ON. Consecutive active samples of a meter form an
+event; events separated by less than a merge gap are joined, and events shorter than
+a minimum duration are dropped.
+
+Every sample holds until the next sample of its meter (at most 'max_hold', see
+sparkboard.rollup.hold_seconds), which gives the end and the energy of an event.
+
+Detection is one vectorized pass over the whole fleet. 'EventDetector' keeps the events
+and a per-meter watermark, so later runs only process newly ingested samples. Its state
+is saved next to the events file ('<name>_state.json', see 'update_events'), so the
+processing jobs carry on where the previous job stopped.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from sparkboard import schema, storage, metrics
+from sparkboard.rollup import hold_seconds
+
+POWER_COLUMNS = {"kosko": "WATT", "a2ei": "POWER"}
+EVENT_COLUMNS = ["ID", "START", "END", "DURATION", "ENERGY", "PEAK POWER", "SAMPLES"]
+
+THRESHOLD = 250.0 # W, well above standby draw, below any cooking appliance
+MIN_DURATION = pd.Timedelta("5min")
+MERGE_GAP = pd.Timedelta("15min")
+MAX_HOLD = pd.Timedelta("30min")
+
+
+def run_starts(codes, active, times, ends, merge_gap):
+    """
+    Marks the active samples that start a new event: the first active sample of a
+    meter (code), or one starting more than 'merge_gap' after the previous one ended.
+
+    Parameters:
+    codes (np.ndarray): Integer codes (e.g. of the meter) of the active samples.
+    active (np.ndarray): Indices of the active samples, ascending.
+    times (np.ndarray): Start time of every sample in ns.
+    ends (np.ndarray): End time of every sample in ns.
+    merge_gap (pd.Timedelta): The longest pause inside one event.
+
+    Returns:
+    np.ndarray: Boolean flag per active sample.
+    """
+    starts = np.ones(len(active), dtype=bool)
+    if len(active) > 1:
+        pause = times[active[1:]] - ends[active[:-1]]
+        starts[1:] = (codes[1:] != codes[:-1]) | (pause > merge_gap.value)
+    return starts
+
+def group_runs(codes, active, times, ends, merge_gap):
+    """
+    Groups active samples into runs, see 'run_starts'.
+
+    Parameters:
+    codes (np.ndarray): Integer codes of every sample, runs never span two codes.
+    active (np.ndarray): Indices of the active samples, ascending.
+    times (np.ndarray): Start time of every sample in ns.
+    ends (np.ndarray): End time of every sample in ns.
+    merge_gap (pd.Timedelta): The longest pause inside one run.
+
+    Returns:
+    tuple: Positions in 'active' of the first and of the last sample of every run.
+    """
+    starts = np.flatnonzero(run_starts(codes[active], active, times, ends, merge_gap))
+    return starts, np.append(starts[1:], len(active)) - 1
+
+def no_events():
+    """
+    Returns an empty events table.
+    """
+    return pd.DataFrame({"ID": pd.Series([], dtype=object),
+                         "START": pd.Series([], dtype="datetime64[ns]"),
+                         "END": pd.Series([], dtype="datetime64[ns]"),
+                         "DURATION": pd.Series([], dtype="timedelta64[ns]"),
+                         "ENERGY": pd.Series([], dtype=np.float64),
+                         "PEAK POWER": pd.Series([], dtype=np.float64),
+                         "SAMPLES": pd.Series([], dtype=np.int64)})
+
+def find_runs(df, source, threshold = THRESHOLD, merge_gap = MERGE_GAP, max_hold = MAX_HOLD):
+    """
+    Finds the runs of active samples of every meter, before dropping short runs.
+    See 'detect' for the parameters and the returned table.
+    """
+    if source not in POWER_COLUMNS:
+        raise ValueError(f"No event detection for data source '{source}'")
+    df = schema.parse_times(df.copy(), source)
+    df = df[df["TIME"].notna()].sort_values(by=["ID", "TIME"], kind="mergesort")
+    codes, ids = pd.factorize(df["ID"])
+    times = df["TIME"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+    power = np.nan_to_num(df[POWER_COLUMNS[source]].to_numpy(dtype=np.float64))
+    hold = hold_seconds(codes, df["TIME"].to_numpy(), max_hold)
+    ends = times + (hold * 1e9).astype(np.int64)
+
+    is_active = power >= threshold
+    if "DEVICE STATUS" in df:
+        is_active &= (df["DEVICE STATUS"] == "ON").to_numpy()
+    active = np.flatnonzero(is_active)
+    if len(active) == 0:
+        return no_events()
+
+    starts, last = group_runs(codes, active, times, ends, merge_gap)
+    start = times[active[starts]]
+    end = ends[active[last]]
+    return pd.DataFrame({
+        "ID": ids.take(codes[active[starts]]),
+        "START": pd.to_datetime(start),
+        "END": pd.to_datetime(end),
+        "DURATION": pd.to_timedelta(end - start),
+        "ENERGY": np.add.reduceat(power[active] * hold[active], starts) / 3.6e6,
+        "PEAK POWER": np.maximum.reduceat(power[active], starts),
+        "SAMPLES": np.diff(np.append(starts, len(active))),
+    })
+
+@metrics.timed("events.detect")
+def detect(df, source, threshold = THRESHOLD, min_duration = MIN_DURATION,
+           merge_gap = MERGE_GAP, max_hold = MAX_HOLD):
+    """
+    Detects cooking events in processed meter data.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data of one source, any row order.
+    source (str): The data source ('kosko'/'a2ei').
+    threshold (float): The lowest power in W of an active sample.
+    min_duration (pd.Timedelta): Shorter events are dropped.
+    merge_gap (pd.Timedelta): Events pausing for at most this long are joined.
+    max_hold (pd.Timedelta): The longest time a sample holds without a next sample.
+
+    Returns:
+    pd.DataFrame: One row per event with the columns of EVENT_COLUMNS, sorted by ID and
+    START. ENERGY is in kWh, PEAK POWER in W.
+
+    Raises:
+    ValueError: If the source is unknown.
+    """
+    runs = find_runs(df, source, threshold, merge_gap, max_hold)
+    return runs[runs["DURATION"] >= min_duration].reset_index(drop=True)
+
+def state_path(events_path):
+    """
+    Returns the detector state belonging to an events file,
+    e.g. 'x/Kosko_events.csv' -> 'x/Kosko_events_state.json'.
+    """
+    return f"{os.path.splitext(events_path)[0]}_state.json"
+
+def frame_state(df):
+    """
+    Converts a DataFrame to JSON compatible columns, times and durations as integer ns.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind in "mM":
+            values = values.astype(f"{values.dtype.kind}8[ns]").view(np.int64)
+        columns[column] = {"dtype": str(df[column].dtype), "values": values.tolist()}
+    return columns
+
+def state_frame(columns):
+    """
+    Rebuilds a DataFrame converted by 'frame_state'.
+    """
+    data = {}
+    for column, state in columns.items():
+        if state["dtype"].startswith(("datetime64", "timedelta64")):
+            unit = "M8[ns]" if state["dtype"].startswith("datetime64") else "m8[ns]"
+            data[column] = np.array(state["values"], dtype=np.int64).view(unit)
+        else:
+            data[column] = pd.Series(state["values"], dtype=state["dtype"])
+    return pd.DataFrame(data)
+
+
+class EventDetector:
+    """
+    Incremental cooking event detection over a growing dataset.
+
+    __init__:
+        Constructs with the following objects:
+
+        source (str): The data source ('kosko'/'a2ei').
+        runs (DataFrame): Every run of active samples so far, including short ones.
+        watermarks (dict): Time of the last processed sample of every meter.
+        tail (DataFrame): The processed samples new samples may still merge with, i.e.
+                          the last run of a meter if new samples could extend it.
+        threshold, min_duration, merge_gap, max_hold: The detection rules, see 'detect'.
+
+    update:
+        Detects the runs in newly ingested samples together with the tail, so the events
+        always equal a full 'detect' over all samples.
+
+    save / load:
+        Writes the state to a JSON file and reads it back, for the next processing job.
+
+    Inheritance: None
+    """
+    def __init__(self, source, threshold = THRESHOLD, min_duration = MIN_DURATION,
+                 merge_gap = MERGE_GAP, max_hold = MAX_HOLD):
+        if source not in POWER_COLUMNS:
+            raise ValueError(f"No event detection for data source '{source}'")
+        self.source = source
+        self.threshold = threshold
+        self.min_duration = min_duration
+        self.merge_gap = merge_gap
+        self.max_hold = max_hold
+        self.runs = no_events()
+        self.watermarks = {}
+        self.tail = None
+
+    @property
+    def events(self):
+        """
+        The detected events, i.e. the runs lasting at least 'min_duration'.
+        """
+        return self.runs[self.runs["DURATION"] >= self.min_duration].reset_index(drop=True)
+
+    def cutoffs(self, meters):
+        """
+        Returns the time from which a meter's samples are still needed: the start of its
+        last run if new samples could extend it, else its watermark.
+
+        Parameters:
+        meters (list): The meters, all with a watermark.
+
+        Returns:
+        pd.Series: The cutoff time of every meter.
+        """
+        cutoffs = pd.Series({meter: self.watermarks[meter] for meter in meters},
+                            dtype="datetime64[ns]")
+        reach = self.merge_gap + self.max_hold
+        runs = self.runs[self.runs["ID"].isin(meters)]
+        last = runs.groupby("ID", sort=False, observed=True).tail(1)
+        for meter, start, end in zip(last["ID"], last["START"], last["END"]):
+            if end + reach >= cutoffs[meter]:
+                cutoffs[meter] = min(start, cutoffs[meter])
+        return cutoffs
+
+    def update(self, df):
+        """
+        Detects events in newly ingested data.
+
+        Parameters:
+        df (pd.DataFrame): Newly ingested samples. Samples at or before the watermark of
+                           their meter are skipped, so passing the whole dataset is fine.
+
+        Returns:
+        pd.DataFrame: The events that were added or re-detected.
+        """
+        df = schema.parse_times(df.copy(), self.source)
+        watermark = df["ID"].map(pd.Series(self.watermarks, dtype="datetime64[ns]"))
+        df = df[df["TIME"].notna().to_numpy() &
+                (watermark.isna() | (df["TIME"] > watermark)).to_numpy()]
+        if len(df) == 0:
+            return no_events()
+        meters = list(pd.unique(df["ID"]))
+        if self.tail is not None:
+            touched = self.tail["ID"].isin(meters).to_numpy()
+            data = pd.concat([self.tail[touched], df], ignore_index=True)
+            tail = self.tail[~touched]
+        else:
+            data, tail = df, None
+        runs = find_runs(data, self.source, self.threshold, self.merge_gap, self.max_hold)
+
+        known = [meter for meter in meters if meter in self.watermarks]
+        if known:
+            cutoff = self.runs["ID"].map(self.cutoffs(known))
+            self.runs = self.runs[(cutoff.isna() | (self.runs["START"] < cutoff)).to_numpy()]
+        self.runs = pd.concat([frame for frame in [self.runs, runs] if len(frame)],
+                              ignore_index=True) if len(runs) else self.runs
+        self.runs = self.runs.sort_values(by=["ID", "START"], kind="mergesort",
+                                          ignore_index=True)
+        self.watermarks.update(data.groupby("ID", sort=False, observed=True)["TIME"].max())
+
+        cutoff = data["ID"].map(self.cutoffs(meters))
+        kept = data[(data["TIME"] >= cutoff).to_numpy()]
+        self.tail = kept if tail is None else pd.concat([tail, kept], ignore_index=True)
+        return runs[runs["DURATION"] >= self.min_duration].reset_index(drop=True)
+
+    def forget(self, meters):
+        """
+        Drops the runs, watermarks and tail of meters, e.g. whose past samples changed,
+        so their samples are detected again from scratch by the next 'update'.
+
+        Parameters:
+        meters (list): The meters.
+        """
+        meters = list(meters)
+        self.runs = self.runs[~self.runs["ID"].isin(meters).to_numpy()].reset_index(drop=True)
+        for meter in meters:
+            self.watermarks.pop(meter, None)
+        if self.tail is not None:
+            self.tail = self.tail[~self.tail["ID"].isin(meters).to_numpy()]
+
+    def rules(self):
+        """
+        The detection rules, saved with the state: a state is only reused by a detector
+        with the same rules.
+        """
+        return {"source": self.source, "threshold": float(self.threshold),
+                "min_duration": pd.Timedelta(self.min_duration).value,
+                "merge_gap": pd.Timedelta(self.merge_gap).value,
+                "max_hold": pd.Timedelta(self.max_hold).value}
+
+    def save(self, path):
+        """
+        Atomically replaces the state file at 'path' with the current state.
+        """
+        state = {"rules": self.rules(), "runs": frame_state(self.runs),
+                 "watermarks": [[meter, pd.Timestamp(time).value]
+                                for meter, time in self.watermarks.items()],
+                 "tail": None if self.tail is None else frame_state(self.tail)}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Restores the state saved at 'path' if it exists and was saved with the same rules.
+
+        Returns:
+        bool: Whether a state was restored.
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state["rules"] != self.rules():
+            return False
+        self.runs = state_frame(state["runs"])
+        self.watermarks = {meter: pd.Timestamp(time, unit="ns")
+                           for meter, time in state["watermarks"]}
+        self.tail = None if state["tail"] is None else state_frame(state["tail"])
+        return True
+
+def update_events(df, source, events_path, meters = None, stale = (), write_parquet = False):
+    """
+    Brings the events file of a dataset up to date, carrying on from the detector state
+    saved next to it by the previous run. Without a usable state (first run, other rules)
+    or events file, all of 'df' is detected.
+
+    Parameters:
+    df (pd.DataFrame): The processed data.
+    source (str): The data source ('kosko'/'a2ei').
+    events_path (str): The events CSV, the state is saved as '<name>_state.json'.
+    meters (list, optional): The meters with newly ingested samples, all by default.
+    stale (list): Meters whose past samples changed or were removed, detected anew.
+    write_parquet (bool): Flag to write a Parquet copy of the events along.
+
+    Returns:
+    pd.DataFrame: All events of the dataset.
+    """
+    detector = EventDetector(source)
+    resumed = detector.load(state_path(events_path)) and os.path.exists(events_path)
+    if not resumed:
+        detector = EventDetector(source)
+        meters = None
+    detector.forget(stale)
+    detector.update(df if meters is None else df[df["ID"].isin(list(meters)).to_numpy()])
+    storage.write_processed(detector.events, events_path, write_parquet = write_parquet)
+    detector.save(state_path(events_path))
+    return detector.events
@@ -0,0 +1,137 @@
+"""
+This script provides a memory-bounded least-recently-used cache for dashboard figures.
+Building a figure (subplots, one trace per column) is the slowest step of a dashboard
+callback, while analysts mostly look at the same popular meters and communities.
+
+Entries are keyed by the caller, e.g. (data source, meter ID or community, ON/OFF mode,
+data version). Including the data version in the key means reloaded data never hits a
+stale figure; clear() and invalidate() free the memory of old versions right away.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def figure_size(fig):
+    """
+    Estimates the memory held by a figure from the data arrays of its traces.
+
+    Args:
+        fig (go.Figure): The figure.
+
+    Returns:
+        int: Estimated size in bytes.
+    """
+    size = 0
+    for trace in fig.data:
+        for name in ("x", "y"):
+            values = trace[name]
+            if values is None:
+                continue
+            values = np.asarray(values)
+            # Object arrays (datetimes, strings) hold a pointer and a boxed value per point
+            size += values.nbytes * (8 if values.dtype == object else 1)
+    return size
+
+
+class FigureCache:
+    """
+    Least-recently-used figure cache bounded by the estimated size of its figures.
+
+    __init__:
+        Constructs with the following objects:
+
+        max_bytes (int): Estimated size the cached figures may take up, 0 disables caching.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that built a new figure.
+        evictions (int): Figures dropped to stay under 'max_bytes'.
+
+    Inheritance: None
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Returns the cached figure for a key, building and caching it on a miss.
+
+        Args:
+            key (tuple): Hashable key identifying the figure.
+            build (callable): Builds the figure when it is not cached.
+
+        Returns:
+            go.Figure: The figure. Callers must not modify it.
+        """
+        if self.max_bytes <= 0:
+            return build()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        fig = build()
+        self.put(key, fig)
+        return fig
+
+    def put(self, key, fig):
+        """
+        Caches a figure, evicting the least recently used figures when over budget.
+        Figures larger than the whole budget are not cached.
+        """
+        size = figure_size(fig)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (fig, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def invalidate(self, source = None):
+        """
+        Drops the cached figures of a data source (first element of the key), or all.
+        """
+        with self.lock:
+            if source is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            for key in [key for key in self.entries if key[0] == source]:
+                self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        """
+        Drops every cached figure.
+        """
+        self.invalidate()
+
+    def stats(self):
+        """
+        Returns the counters of the cache, to size 'max_bytes'.
+
+        Returns:
+            dict: hits, misses, evictions, hit rate, number of entries, bytes and max bytes.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": len(self.entries),
+                    "bytes": self.size,
+                    "max_bytes": self.max_bytes}
+
+    def __len__(self):
+        return len(self.entries)
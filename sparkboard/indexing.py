@@ -0,0 +1,231 @@
+"""
+This script provides a per-meter row index over processed meter data. Processed data
+is sorted by ID and TIME, so the rows of every meter form one contiguous block. The
+index maps each meter ID to its block once, after which selecting a meter is a slice
+instead of a boolean mask over the history of the whole fleet.
+
+Built with a time column, the times within every block are sorted too, and a time
+window of a meter is located by binary search in its block ('query'): a one-day query
+on a multi-year meter is two searches and a slice, whatever the size of the data.
+"""
+import numpy as np
+import pandas as pd
+
+# Kosko's ON/OFF state of the device, filtered by 'query'
+STATUS = "DEVICE STATUS"
+
+
+def run_starts(codes):
+    """
+    Returns the positions where a run of equal values starts in an integer array.
+    """
+    if len(codes) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.diff(codes, prepend=codes[0] - 1))
+
+def time_values(column):
+    """
+    Returns the values of a time column as datetime64, parsing strings (bad entries
+    become NaT). Datetime columns are returned without a copy.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(column):
+        column = pd.to_datetime(column, errors="coerce")
+    return column.to_numpy()
+
+def sort_keys(times):
+    """
+    Integer sort keys of datetime64 values, NaT sorting after every time.
+    """
+    keys = times.view(np.int64).copy()
+    keys[np.isnat(times)] = np.iinfo(np.int64).max
+    return keys
+
+def is_grouped(codes, starts, groups, keys = None):
+    """
+    Whether each of the 'groups' codes forms one run, with its sort keys ascending
+    within the run.
+    """
+    if len(starts) != groups:
+        return False
+    if keys is None or len(keys) == 0:
+        return True
+    descending = np.diff(keys) < 0
+    # A key below its predecessor is fine where a new run starts
+    descending[starts[1:] - 1] = False
+    return not descending.any()
+
+
+class MeterIndex:
+    """
+    Index from meter ID to the contiguous range of rows holding that meter's data.
+
+    __init__:
+        Constructs with the following objects:
+
+        df (DataFrame): Processed meter data. If the rows of a meter are not contiguous,
+                        the frame is stably sorted by ID first, in order of first
+                        appearance, which keeps the row order within every meter.
+        key (str): The meter ID column.
+        time (str, optional): The time column, for time windows in 'query'. If the
+                              rows of a meter are not sorted by time, the frame is
+                              stably sorted by ID and time, rows without a time last.
+
+    Attributes:
+        df (DataFrame): The frame the index points into.
+        ids (list): Meter IDs in row order, as plain Python values.
+        ranges (dict): Meter ID -> (start, stop) row positions in 'df'.
+        times (np.ndarray or None): The time column as datetime64 (a view of a datetime
+                                    column), None without a time column.
+        timed (dict): Meter ID -> stop of the rows with a time, which come first.
+
+    Example:
+        index = MeterIndex(df_kosko, time="TIME")
+        dff = index.rows("064")
+        day = index.query("064", "2023-06-17", "2023-06-18", columns=["TIME", "KWH"])
+    """
+    def __init__(self, df, key = "ID", time = None):
+        codes, uniques = pd.factorize(df[key])
+        starts = run_starts(codes)
+        times = keys = None
+        if time is not None:
+            times = time_values(df[time])
+            keys = sort_keys(times)
+        if not is_grouped(codes, starts, len(uniques) + bool((codes < 0).any()), keys):
+            if keys is None:
+                order = np.argsort(codes, kind="stable")
+            else:
+                order = np.lexsort((keys, codes))
+                times = times[order]
+            df = df.iloc[order]
+            codes = codes[order]
+            starts = run_starts(codes)
+        stops = np.append(starts[1:], len(codes))
+
+        self.df = df
+        self.key = key
+        self.time = time
+        self.times = times
+        self.ids = []
+        self.ranges = {}
+        self.timed = {}
+        missing = np.zeros(len(starts), dtype=np.int64)
+        if times is not None and len(starts):
+            missing = np.add.reduceat(np.isnat(times).astype(np.int64), starts)
+        for start, stop, nat in zip(starts, stops, missing):
+            if codes[start] < 0: # rows without an ID cannot be selected
+                continue
+            meter_id = uniques[codes[start]]
+            if isinstance(meter_id, np.generic):
+                meter_id = meter_id.item()
+            self.ids.append(meter_id)
+            self.ranges[meter_id] = (int(start), int(stop))
+            self.timed[meter_id] = int(stop - nat)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, meter_id):
+        return meter_id in self.ranges
+
+    def rows(self, meter_id):
+        """
+        Returns the rows of a meter as a slice of 'df', empty if the meter is unknown.
+
+        Args:
+            meter_id: The meter ID, as stored in the key column.
+
+        Returns:
+            DataFrame: The meter's rows, in their original order.
+        """
+        start, stop = self.ranges.get(meter_id, (0, 0))
+        return self.df.iloc[start:stop]
+
+    def bound(self, value):
+        """
+        Converts a window bound (anything pd.Timestamp accepts) to the unit of 'times'.
+        """
+        return pd.Timestamp(value).to_datetime64().astype(self.times.dtype)
+
+    def window(self, meter_id, start = None, end = None, span = None):
+        """
+        Locates the rows of a meter within a time window by binary search.
+
+        Args:
+            meter_id: The meter ID, as stored in the key column.
+            start, end (optional): The window, both inclusive. Without either bound all
+                                   rows of the meter are located, with either one the
+                                   rows without a time are left out.
+            span (pd.Timedelta, optional): Rows stand for [time, time + span), e.g.
+                                           rollup buckets, and are located when they
+                                           overlap the window.
+
+        Returns:
+            tuple: (start, stop) row positions in 'df', empty if the meter is unknown.
+
+        Raises:
+            ValueError: If the index was built without a time column.
+        """
+        first, stop = self.ranges.get(meter_id, (0, 0))
+        if start is None and end is None:
+            return first, stop
+        if self.times is None:
+            raise ValueError("Time windows need an index built with a time column")
+        times = self.times[first:self.timed.get(meter_id, 0)]
+        low, high = 0, len(times)
+        if start is not None and span is not None:
+            low = times.searchsorted(self.bound(pd.Timestamp(start) - span), side="right")
+        elif start is not None:
+            low = times.searchsorted(self.bound(start), side="left")
+        if end is not None:
+            high = times.searchsorted(self.bound(end), side="right")
+        return first + int(low), first + int(max(low, high))
+
+    def query(self, meter_ids, start = None, end = None, columns = None, status = None,
+              span = None):
+        """
+        Selects the rows of one or several meters within a time window.
+
+        The rows of a single meter are a slice of 'df', a view without a status or
+        column subset. Filtering the status and selecting columns copy the rows of the
+        window only, several meters are concatenated in the order given.
+
+        Args:
+            meter_ids: A meter ID, or a list of them.
+            start, end (optional): The window, both inclusive (see 'window').
+            columns (list, optional): The columns to return, all by default.
+            status (str, optional): Keep the rows with this device status only (Kosko).
+            span (pd.Timedelta, optional): Length of time every row stands for (see
+                                           'window').
+
+        Returns:
+            DataFrame: The selected rows, sorted by time within every meter.
+
+        Example:
+            index.query(["064", "065"], "2023-06-17", "2023-06-17 23:59:59",
+                        columns=["ID", "TIME", "WATT"], status="ON")
+        """
+        several = isinstance(meter_ids, (list, tuple, set, np.ndarray, pd.Index))
+        frames = []
+        for meter_id in (meter_ids if several else [meter_ids]):
+            first, stop = self.window(meter_id, start, end, span)
+            dff = self.df.iloc[first:stop]
+            if status is not None:
+                dff = dff[dff[STATUS] == status]
+            frames.append(dff)
+        if not frames:
+            frames = [self.df.iloc[0:0]]
+        dff = frames[0] if len(frames) == 1 else pd.concat(frames)
+        return dff if columns is None else dff[columns]
+
+    def options(self, label = None):
+        """
+        Builds dropdown options for all meters in row order.
+
+        Args:
+            label (callable, optional): Maps a meter ID to its display label,
+                                        by default the ID itself is the label.
+
+        Returns:
+            list: A list of {'label', 'value'} dicts.
+        """
+        return [{'label': i if label is None else label(i), 'value': i} for i in self.ids]
@@ -0,0 +1,382 @@
+"""
+This script records latency metrics of the dashboard callbacks and of the stages of the
+processing pipelines, and renders them in the Prometheus text format, e.g. for the
+dashboard's '/metrics' endpoint or a node exporter's textfile collector:
+
+    sparkboard_<family>_seconds: histogram of the duration of a callback or stage
+    sparkboard_<family>_rows_total: rows returned by a stage (DataFrames) or plotted
+    sparkboard_<family>_errors_total: calls that raised
+    sparkboard_request_seconds: histogram of whole callback requests, i.e. the callback
+        plus the JSON serialization of its output
+    sparkboard_response_bytes: histogram of the callback payloads
+
+Metrics are enabled by setting SPARKBOARD_METRICS=1 before sparkboard is imported. Code
+is instrumented by decorating functions with 'timed', which returns the function itself
+when metrics are disabled, so disabled metrics cost nothing per call. Enabled, a call
+costs two clock reads and a histogram update, about a microsecond.
+
+The registry lives in the process. Under a multi-worker server (gunicorn -w 4) every
+worker has its own, and '/metrics' shows whichever worker answered the scrape. Setting
+SPARKBOARD_METRICS_DIR to a directory shared by the workers, emptied when the server
+starts, turns on the multiprocess mode: each worker writes its registry to
+'<directory>/metrics-<pid>.json', from a background thread started by its first request
+every FLUSH_SECONDS while there are unwritten observations, and once more at exit. The
+worker answering the scrape adds up the files of all of them. Files of exited workers
+are kept, so totals never go backwards when workers are restarted.
+
+Example:
+    @metrics.timed("kosko.read")
+    def read(self, files):
+        ...
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import functools
+import threading
+import pandas as pd
+
+enabled = os.environ.get("SPARKBOARD_METRICS", "0") != "0"
+directory = os.environ.get("SPARKBOARD_METRICS_DIR") or None
+# Seconds between two writes of a worker's registry in the multiprocess mode
+FLUSH_SECONDS = 1.0
+# Process ID -> its flushing thread, see start_flusher
+flushers = {}
+flushers_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+# Upper bounds of the histogram buckets, in seconds and in bytes
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0, 300.0)
+BYTES = tuple(1024 * 4**k for k in range(10))
+HELP = {"seconds": "Duration in seconds",
+        "rows_total": "Rows returned or plotted",
+        "errors_total": "Calls that raised",
+        "bytes": "Size in bytes"}
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, as Prometheus exposes them.
+
+    __init__:
+        Constructs with the following objects:
+
+        bounds (tuple): Upper bounds of the buckets, ascending; '+Inf' is implied.
+        counts (list): Observations per bucket, the last one above every bound.
+        sum (float): Sum of the observations.
+        count (int): Number of observations.
+
+    Inheritance: None
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds an observation. The caller holds the registry lock.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Thread-safe collection of histograms and counters, keyed by metric name and label.
+
+    __init__:
+        Constructs with the following objects:
+
+        histograms (dict): (metric name, label name, label value) -> Histogram.
+        counters (dict): (metric name, label name, label value) -> total.
+        dirty (bool): Whether it changed since the last write to its file (see 'flush').
+
+    Inheritance: None
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def observe(self, name, label, value, bounds = SECONDS):
+        """
+        Adds an observation to the histogram 'name' of a label (label name, value).
+        """
+        key = (name, *label)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(bounds)
+            histogram.observe(value)
+            self.dirty = True
+
+    def increment(self, name, label, value = 1):
+        """
+        Adds to the counter 'name' of a label (label name, value).
+        """
+        key = (name, *label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def snapshot(self):
+        """
+        Returns every metric as JSON-serializable lists, see 'merge'.
+        """
+        with self.lock:
+            return {"histograms": [[*key, list(h.bounds), list(h.counts), h.sum, h.count]
+                                   for key, h in self.histograms.items()],
+                    "counters": [[*key, total] for key, total in self.counters.items()]}
+
+    def merge(self, snapshot):
+        """
+        Adds the metrics of a snapshot (see 'snapshot'), e.g. of another process.
+        Histograms of the same key must have the same bounds.
+        """
+        with self.lock:
+            for name, label, value, bounds, counts, total, count in snapshot["histograms"]:
+                key = (name, label, value)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(tuple(bounds))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            for name, label, value, total in snapshot["counters"]:
+                key = (name, label, value)
+                self.counters[key] = self.counters.get(key, 0) + total
+
+    def clear(self):
+        """
+        Drops every metric.
+        """
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format (version 0.0.4).
+
+        Returns:
+        str: The metrics, one family after the other.
+        """
+        with self.lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.bounds)
+                          for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+        lines = []
+        for name in sorted({key[0] for key in histograms}):
+            lines += [f"# HELP {name} {help_text(name)}", f"# TYPE {name} histogram"]
+            for key in sorted(key for key in histograms if key[0] == name):
+                counts, total, count, bounds = histograms[key]
+                label = f'{key[1]}="{escape(key[2])}"'
+                cumulative = 0
+                for bound, bucket in zip(list(bounds) + ["+Inf"], counts):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label}}} {total!r}")
+                lines.append(f"{name}_count{{{label}}} {count}")
+        for name in sorted({key[0] for key in counters}):
+            lines += [f"# HELP {name} {help_text(name)}", f"# TYPE {name} counter"]
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append(f'{name}{{{key[1]}="{escape(key[2])}"}} {counters[key]}')
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def help_text(name):
+    """
+    Returns the HELP text of a metric from its unit suffix.
+    """
+    for suffix, text in HELP.items():
+        if name.endswith(suffix):
+            return text
+    return name
+
+def escape(value):
+    """
+    Escapes a label value for the text format.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def snapshot_path(pid = None):
+    """
+    Returns the file of a worker's registry in the multiprocess mode.
+    """
+    return os.path.join(directory, f"metrics-{pid or os.getpid()}.json")
+
+def flush(force = False):
+    """
+    Writes this process's registry to its file in the multiprocess mode if it changed
+    since the last write, or regardless with 'force'. Does nothing without
+    SPARKBOARD_METRICS_DIR.
+    """
+    if directory is None:
+        return
+    with registry.lock:
+        if not (force or registry.dirty):
+            return
+        # Cleared before the snapshot, a concurrent observation is written next time
+        registry.dirty = False
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+def start_flusher():
+    """
+    Starts this process's thread writing its registry every FLUSH_SECONDS (see 'flush'),
+    once per process: threads do not survive a fork, so every worker of a preloading
+    server starts its own. Does nothing without SPARKBOARD_METRICS_DIR.
+    """
+    if directory is None or os.getpid() in flushers:
+        return
+    def loop():
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            try:
+                flush()
+            except OSError as error:
+                logger.warning("Could not write the metrics: %s", error)
+    with flushers_lock:
+        if os.getpid() not in flushers:
+            flushers[os.getpid()] = threading.Thread(target=loop, daemon=True,
+                                                     name="metrics-flush")
+            flushers[os.getpid()].start()
+
+def flush_at_exit():
+    """
+    Writes the observations since the last flush when a process with metrics exits.
+    """
+    try:
+        flush()
+    except OSError:
+        pass
+
+atexit.register(flush_at_exit)
+
+def collect():
+    """
+    Renders the metrics of this process or, in the multiprocess mode, of all workers.
+
+    Returns:
+    str: The metrics in the Prometheus text format.
+    """
+    if directory is None:
+        return registry.render()
+    flush(force=True)
+    merged = Registry()
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("metrics-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                merged.merge(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue
+    return merged.render()
+
+def timed(name, family = "stage", rows = None):
+    """
+    Decorates a function to record its duration in 'sparkboard_<family>_seconds', the rows
+    it returned in 'sparkboard_<family>_rows_total' and its exceptions in
+    'sparkboard_<family>_errors_total', labelled <family>=<name>. Returns the function
+    itself if metrics are disabled.
+
+    Args:
+        name (str): The label value, e.g. 'kosko.read' or 'update_graph'.
+        family (str): The metric family and label name, e.g. 'stage' or 'callback'.
+        rows (callable, optional): Called with the result and the arguments of a call,
+                                   returns the rows to count. By default the length of
+                                   a returned DataFrame is counted.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+        label = (family, name)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                registry.increment(f"sparkboard_{family}_errors_total", label)
+                raise
+            finally:
+                registry.observe(f"sparkboard_{family}_seconds", label,
+                                 time.perf_counter() - start)
+            if rows is not None:
+                registry.increment(f"sparkboard_{family}_rows_total", label,
+                                   rows(result, *args, **kwargs))
+            elif isinstance(result, pd.DataFrame):
+                registry.increment(f"sparkboard_{family}_rows_total", label, len(result))
+            return result
+        return wrapper
+    return decorator
+
+def plotted_rows(_, plot):
+    """
+    Rows of the data behind a figure, for 'timed' on the plotting classes' dash_plot.
+    """
+    return len(plot.dff)
+
+def instrument(app):
+    """
+    Records the duration and payload size of every callback request of a Dash app and
+    serves the metrics at '/metrics', of all workers in the multiprocess mode (see
+    'collect'). Does nothing if metrics are disabled.
+
+    Args:
+        app (Dash): The dashboard app.
+    """
+    if not enabled:
+        return
+    # Flask comes with Dash, processing jobs import this module without it
+    from flask import Response, g, request # pylint: disable=import-outside-toplevel
+
+    def callback_name(output):
+        callback = app.callback_map.get(output, {}).get("callback")
+        return getattr(callback, "__name__", output)
+
+    @app.server.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+
+    @app.server.after_request
+    def record_request(response):
+        if request.path.endswith("/_dash-update-component") and "metrics_start" in g:
+            body = request.get_json(silent=True) or {}
+            label = ("callback", callback_name(body.get("output", "")))
+            registry.observe("sparkboard_request_seconds", label,
+                             time.perf_counter() - g.metrics_start)
+            registry.observe("sparkboard_response_bytes", label,
+                             response.calculate_content_length() or 0, BYTES)
+        start_flusher()
+        return response
+
+    @app.server.route("/metrics")
+    def serve_metrics():
+        return Response(collect(), mimetype="text/plain; version=0.0.4")
+
+def write(path):
+    """
+    Atomically writes the metrics to a file, e.g. for a node exporter's textfile
+    collector after a batch processing run.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
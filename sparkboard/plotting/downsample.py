@@ -0,0 +1,102 @@
+"""
+This file provides server-side downsampling of time series before they are sent to
+the browser. Two methods cap the number of points of a trace:
+
+    minmax: keeps the smallest and largest sample of every bucket, so every peak
+            (e.g. a cooking event) stays visible at any zoom level
+    lttb: Largest-Triangle-Three-Buckets, keeps the visual shape of the series
+
+Both return indices into the input, so x values keep their type (datetimes or strings).
+"""
+import numpy as np
+import pandas as pd
+
+METHODS = ["minmax", "lttb"]
+
+
+def minmax_indices(y, max_points):
+    """
+    Selects the minimum and maximum of at most max_points // 2 equally sized buckets.
+
+    Args:
+        y (np.ndarray): Finite sample values.
+        max_points (int): The largest number of points to keep.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept samples.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    width = -(-n // max(max_points // 2, 1))
+    buckets = -(-n // width)
+    offsets = np.arange(buckets) * width
+    pad = buckets * width - n
+    low = np.append(y, np.full(pad, np.inf)).reshape(buckets, width).argmin(axis=1)
+    high = np.append(y, np.full(pad, -np.inf)).reshape(buckets, width).argmax(axis=1)
+    return np.unique(np.concatenate([offsets + low, offsets + high]))
+
+def lttb_indices(x, y, max_points):
+    """
+    Selects points with Largest-Triangle-Three-Buckets: the first and last sample, and in
+    each of max_points - 2 buckets the sample forming the largest triangle with the
+    previously selected point and the average of the next bucket.
+
+    Args:
+        x (np.ndarray): Numeric sample positions (e.g. nanoseconds), ascending.
+        y (np.ndarray): Finite sample values.
+        max_points (int): The number of points to keep.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept samples.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    out = np.empty(max_points, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def reduce_points(x, y, max_points, method = "minmax"):
+    """
+    Downsamples one trace to at most max_points points. Traces that are already small
+    enough are returned unchanged; otherwise samples without a time or value are dropped.
+
+    Args:
+        x (array-like): Sample times.
+        y (array-like): Sample values.
+        max_points (int): The largest number of points to keep.
+        method (str): 'minmax' or 'lttb'.
+
+    Returns:
+        tuple: The downsampled (x, y) as numpy arrays, or the inputs unchanged.
+
+    Raises:
+        ValueError: If the method is unknown.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    if len(y) <= max_points:
+        return x, y
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(y) & pd.notna(x)
+    x, y = x[valid], y[valid]
+    if method == "minmax":
+        keep = minmax_indices(y, max_points)
+    else:
+        positions = pd.to_datetime(x).asi8 if not np.issubdtype(x.dtype, np.number) else x
+        keep = lttb_indices(np.asarray(positions), y, max_points)
+    return x[keep], y[keep]
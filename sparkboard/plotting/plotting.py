@@ -1,19 +1,27 @@
 """
 This file provides an object oriented structure for the generation of plots to be embedded
-into the dashboard.py framework. Two classes are defined as such:
+into the dashboard.py framework. Three classes are defined as such:
 
     PlotTimeSeries: Class to generate time series plots
     PlotSurvey: Class to generate bar graphs of filtered survey data
+    SurveyFigures: Column groups and per-community figures of one version of the survey
+    PlotConsumption: Class to generate bar graphs of daily and monthly energy consumption
 
 
 Depencies:
     plotly.subplots: Framework to make complex multi layer figures
     plotly.graph_objs: Framework to populate subplots with either time series or bar graphs
+    downsample: Server-side downsampling of time series traces
+    sparkboard.metrics: figure building times, when metrics are enabled
+    sparkboard.profiling: call profiles of slow figure builds, when profiling is enabled
 
 For example usage see dashboard.py
 """
+import threading
 from plotly.subplots import make_subplots
 import plotly.graph_objs as go
+from sparkboard import metrics, profiling
+from .downsample import reduce_points
 
 class PlotTimeSeries:
     """
@@ -26,6 +34,11 @@ class PlotTimeSeries:
         columns (list): A list of column names from the DataFrame to be plotted.
         selected_data_source (str): A string representing the selected data source ('kosko'/'a2ei').
         kosko_logic (bool): A boolean representing specific logic for the 'kosko' data source.
+        max_points (int, optional): Caps the points of every trace by downsampling, None keeps all.
+        downsample (str): Downsampling method, 'minmax' (keeps peaks) or 'lttb'.
+        render_mode (str): 'svg', 'webgl' or 'auto' (WebGL above 'webgl_threshold').
+        webgl_threshold (int): Points drawn across all subplots above which 'auto' uses WebGL.
+        webgl (bool): Whether the traces are drawn with WebGL.
 
     __getattr__:
         String based logic on input to correctly navigate to either the generic kosko or ae2i plot
@@ -34,12 +47,24 @@ class PlotTimeSeries:
 
     Inheritance: None
     """
-    def __init__(self,dff,columns,selected_data_source, kosko_status):
+    render_modes = ["auto", "svg", "webgl"]
+
+    def __init__(self,dff,columns,selected_data_source, kosko_status, max_points = None,
+                 downsample = "minmax", render_mode = "auto", webgl_threshold = 10000):
+        if render_mode not in self.render_modes:
+            raise ValueError(f"Unknown render mode '{render_mode}'")
         self.dff = dff
         self.columns = columns
         self.selected_data_source = selected_data_source
         self.kosko_logic = kosko_status != "ONOFF"
+        self.max_points = max_points
+        self.downsample = downsample
+        self.render_mode = render_mode
+        self.webgl_threshold = webgl_threshold
+        self.webgl = self.use_webgl()
 
+    @metrics.timed("plot.time_series", rows=metrics.plotted_rows)
+    @profiling.profiled("plot.time_series")
     def dash_plot(self):
         """
         Generates a Plotly subplot for time series data.
@@ -66,6 +91,57 @@ class PlotTimeSeries:
         fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#444')
         return fig
 
+    def use_webgl(self):
+        """
+        Whether traces are drawn with WebGL. In 'auto' mode this is the case when the points
+        drawn across all traces of all subplots (after downsampling) exceed 'webgl_threshold'.
+
+        Returns:
+            bool: True for WebGL traces, False for SVG traces.
+        """
+        if self.render_mode != "auto":
+            return self.render_mode == "webgl"
+        points = self.trace_rows()
+        if self.max_points is not None:
+            points = [min(rows, self.max_points) for rows in points]
+        return sum(points) > self.webgl_threshold
+
+    def trace_rows(self):
+        """
+        Counts the samples of every trace 'dash_plot' draws, before downsampling: one
+        trace per column, or one per device status and column for Kosko in ONOFF mode.
+
+        Returns:
+            list: The samples of every trace.
+        """
+        if self.selected_data_source == "kosko" and not self.kosko_logic:
+            status = self.dff["DEVICE STATUS"]
+            counts = [int((status == "OFF").sum()), int((status == "ON").sum())]
+            return counts * len(self.columns)
+        if self.selected_data_source == "a2ei":
+            return [int((self.dff[col] != 0).sum()) if col == "POWER FACTOR" else len(self.dff)
+                    for col in self.columns]
+        return [len(self.dff)] * len(self.columns)
+
+    def scatter(self, x, y, name):
+        """
+        Builds a line trace, downsampled to 'max_points' points when set. The trace is a
+        go.Scattergl when the figure renders with WebGL, with the same styling.
+
+        Args:
+            x (Series): The sample times.
+            y (Series): The sample values.
+            name (str): The trace name.
+
+        Returns:
+            go.Scatter or go.Scattergl: The trace.
+        """
+        if self.max_points is not None:
+            x, y = reduce_points(x, y, self.max_points, self.downsample)
+        trace = go.Scattergl if self.webgl else go.Scatter
+        return trace(x=x, y=y, mode='lines', name=name,
+                     line={"width": 2}, marker={"size": 1})
+
     def kosko(self, fig, col, i):
         """
         Adds time series traces specific to the 'kosko' data source to the provided figure.
@@ -80,23 +156,20 @@ class PlotTimeSeries:
         """
         if self.kosko_logic:
             fig.add_trace(
-                go.Scatter(x=self.dff["TIME"], y=self.dff[col], mode='lines', name=col,
-                        line={"width": 2}, marker={"size": 1}),
+                self.scatter(self.dff["TIME"], self.dff[col], col),
                 row=i, col=1
             )
         else:
             t_on = self.dff["TIME"][self.dff["DEVICE STATUS"] == "OFF"]
             y_on = self.dff[col][self.dff["DEVICE STATUS"] == "OFF"]
             fig.add_trace(
-                go.Scatter(x=t_on, y=y_on, mode='lines', name=f"{col} OFF",
-                        line={"width": 2}, marker={"size": 1}),
+                self.scatter(t_on, y_on, f"{col} OFF"),
                 row=i, col=1
             )
             t_off = self.dff["TIME"][self.dff["DEVICE STATUS"] == "ON"]
             y_off = self.dff[col][self.dff["DEVICE STATUS"] == "ON"]
             fig.add_trace(
-                go.Scatter(x=t_off, y=y_off, mode='lines', name=f"{col} ON",
-                        line={"width": 2}, marker={"size": 1}),
+                self.scatter(t_off, y_off, f"{col} ON"),
                 row=i, col=1
             )
         return fig
@@ -115,16 +188,14 @@ class PlotTimeSeries:
         """
         if col != "POWER FACTOR":
             fig.add_trace(
-                go.Scatter(x=self.dff["TIME"], y=self.dff[col], mode='lines', name=col,
-                        line={"width": 2}, marker={"size": 1}),
+                self.scatter(self.dff["TIME"], self.dff[col], col),
                 row=i, col=1
             )
         else:
             t_data = self.dff["TIME"][self.dff[col] != 0]
             y_data = self.dff[col][self.dff[col] != 0]
             fig.add_trace(
-                go.Scatter(x=t_data, y=y_data, mode='lines', name=col,
-                        line={"width": 2}, marker={"size": 1}),
+                self.scatter(t_data, y_data, col),
                 row=i, col=1
             )
         return fig
@@ -150,15 +221,19 @@ class PlotSurvey:
         dff (DataFrame): The pandas DataFrame containing the survey data.
         groups (list): A list of groups/categories identified in the survey data.
         grouped_data (dict): A dictionary grouping the survey data by categories.
+
+    The column groups can be passed in (see survey_groups) when they are derived once
+    for many figures, e.g. by SurveyFigures.
     """
-    def __init__(self, dff, survey_selection):
+    def __init__(self, dff, survey_selection, column_groups = None):
         self.dff = dff[dff["community_name"] == survey_selection]
-        self.groups = sorted(set(col.split("/")[0] for col in self.dff.columns if "/" in col))
-        columns = self.dff.columns
-        def column_func(group):
-            return [col for col in columns if col.startswith(group + "/")]
-        self.grouped_data = {group: self.dff[column_func(group)] for group in self.groups}
+        if column_groups is None:
+            column_groups = survey_groups(self.dff.columns)
+        self.groups = list(column_groups)
+        self.grouped_data = {group: self.dff[columns] for group, columns in column_groups.items()}
 
+    @metrics.timed("plot.survey", rows=metrics.plotted_rows)
+    @profiling.profiled("plot.survey")
     def dash_plot(self):
         """
         Generates a Plotly subplot for survey data.
@@ -214,3 +289,131 @@ class PlotSurvey:
                         row=i, col=1
                         )
         return fig
+
+def survey_groups(columns):
+    """
+    Groups the 'group/entry' columns of the processed survey data by group.
+
+    Args:
+        columns (list): The column names, e.g. ['community_name', 'gender/female', ...].
+
+    Returns:
+        dict: Group -> its columns in their original order, groups sorted by name.
+    """
+    grouped = {}
+    for col in columns:
+        if "/" in col:
+            grouped.setdefault(col.split("/")[0], []).append(col)
+    return {group: grouped[group] for group in sorted(grouped)}
+
+class SurveyFigures:
+    """
+    This class holds the survey figures of one version of the processed survey data, so
+    selecting a community on the map recomputes nothing after its first selection.
+
+    __init__:
+        Constructs with the following objects:
+
+        dff (DataFrame): The processed survey data, one row per community.
+        column_groups (dict): Group -> columns, derived once (see survey_groups).
+        communities (set): The communities in the data.
+        figures (dict): Community -> its figure, built on its first selection.
+
+    Example:
+        survey = SurveyFigures(df_survey)
+        fig = survey.figure("Makerere")
+    """
+    def __init__(self, dff):
+        self.dff = dff
+        self.column_groups = survey_groups(dff.columns)
+        self.communities = set(dff["community_name"])
+        self.figures = {}
+        self.lock = threading.Lock()
+
+    def figure(self, survey_selection):
+        """
+        Returns the figure of a community, building it on first use. Selections come
+        from the client, so only communities in the data are kept: any other selection
+        gets an empty figure.
+
+        Args:
+            survey_selection (str): The community name.
+
+        Returns:
+            go.Figure: The figure. Callers must not modify it.
+        """
+        if survey_selection not in self.communities:
+            return go.Figure()
+        fig = self.figures.get(survey_selection)
+        if fig is None:
+            fig = PlotSurvey(self.dff, survey_selection, self.column_groups).dash_plot()
+            with self.lock:
+                # Keep the figure of a concurrent first selection, both are identical
+                fig = self.figures.setdefault(survey_selection, fig)
+        return fig
+
+    def prebuild(self, communities = None):
+        """
+        Builds the figures of communities ahead of their first selection.
+
+        Args:
+            communities (list, optional): The communities, all in the data by default.
+        """
+        if communities is None:
+            communities = self.dff["community_name"].unique()
+        for community in communities:
+            self.figure(community)
+
+class PlotConsumption:
+    """
+    This class is designed for creating energy consumption bar graphs using Plotly.
+
+    __init__:
+        Constructs with the following objects:
+
+        daily (DataFrame): Daily consumption with DATE, ENERGY and ESTIMATED columns.
+        monthly (DataFrame): Monthly consumption with MONTH and ENERGY columns.
+        title (str): The figure title, e.g. the meter label.
+    """
+    def __init__(self, daily, monthly, title):
+        self.daily = daily
+        self.monthly = monthly
+        self.title = title
+
+    @metrics.timed("plot.consumption", rows=lambda _, plot: len(plot.daily))
+    @profiling.profiled("plot.consumption")
+    def dash_plot(self):
+        """
+        Generates a Plotly subplot with daily and monthly consumption bars. Days whose
+        consumption was estimated across a gap in the data are drawn in a lighter color.
+
+        Returns:
+            go.Figure: A Plotly figure object containing the daily and monthly bars.
+        """
+        fig = make_subplots(rows=2, cols=1,
+                            subplot_titles=["Daily Consumption (kWh)",
+                                            "Monthly Consumption (kWh)"])
+        background_color = '#282828'
+        paper_color = '#343a40'
+        estimated = self.daily["ESTIMATED"].to_numpy() > 0
+        fig.add_trace(
+            go.Bar(x=self.daily["DATE"], y=self.daily["ENERGY"], name="Daily",
+                   marker={"color": ['#9ecae1' if e else '#3182bd' for e in estimated]}),
+            row=1, col=1
+        )
+        fig.add_trace(
+            go.Bar(x=self.monthly["MONTH"], y=self.monthly["ENERGY"], name="Monthly",
+                   marker={"color": '#3182bd'}),
+            row=2, col=1
+        )
+        fig.update_layout(
+            title_text=self.title,
+            height=600,
+            showlegend=False,
+            plot_bgcolor=background_color,
+            paper_bgcolor=paper_color,
+            font={'color':'white'}
+        )
+        fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#444')
+        fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#444')
+        return fig
@@ -0,0 +1,227 @@
+"""
+This script provides power-quality analytics of processed meter data:
+    1) rolling-window statistics of VOLTAGE and FREQUENCY per meter
+    2) detection of disturbances against configurable nominal values:
+         INTERRUPTION: voltage below 10% of nominal
+         SAG: voltage below 90% of the reference voltage
+         SWELL: voltage above 110% of the reference voltage
+         FREQUENCY: frequency further than a tolerance from nominal (A2EI only)
+    3) counts, durations and worst values of the disturbances per meter or per day
+
+The reference voltage depends on the source (see REFERENCES). A2EI meters measure the
+grid and are held against the nominal voltage. Kosko meters sit behind long, loaded
+household connections where 200 V is routine (median 225 V, a quarter of the samples
+below 206 V, some meters' medians near 165 V), so their sags and swells are measured
+against the meter's own trailing median voltage over a day ('baseline') instead.
+
+Consecutive samples of a meter with the same disturbance form one disturbance, which
+lasts until the next sample of the meter (see sparkboard.events). Every step is a
+vectorized pass over the whole fleet.
+"""
+import numpy as np
+import pandas as pd
+from sparkboard import schema
+from sparkboard.rollup import hold_seconds
+from sparkboard.events import group_runs, MAX_HOLD
+
+# Uganda's grid
+NOMINAL_VOLTAGE = 240.0
+NOMINAL_FREQUENCY = 50.0
+# Fractions of the nominal voltage and Hz off nominal frequency, as in EN 50160
+INTERRUPTION = 0.1
+SAG = 0.9
+SWELL = 1.1
+FREQUENCY_TOLERANCE = 0.5
+# Reference voltage of sags and swells per source: 'nominal' or the meter's 'median'
+REFERENCES = {"kosko": "median", "a2ei": "nominal"}
+BASELINE_WINDOW = "1D"
+
+KINDS = ["INTERRUPTION", "SAG", "SWELL", "FREQUENCY"]
+DISTURBANCE_COLUMNS = ["ID", "KIND", "START", "END", "DURATION", "WORST", "DEVIATION",
+                       "SAMPLES"]
+ROLLING_COLUMNS = ["VOLTAGE", "FREQUENCY"]
+
+
+def prepare(df, source):
+    """
+    Parses the times of processed meter data, drops samples without a time and sorts
+    the rest by ID and TIME.
+    """
+    df = schema.parse_times(df.copy(), source)
+    return df[df["TIME"].notna()].sort_values(by=["ID", "TIME"], kind="mergesort")
+
+def rolling_stats(df, source, window = "10min"):
+    """
+    Computes rolling statistics of VOLTAGE and FREQUENCY over a trailing time window
+    per meter.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data, any row order.
+    source (str): The data source ('kosko'/'a2ei').
+    window (str): The length of the trailing window, e.g. '10min'.
+
+    Returns:
+    pd.DataFrame: ID, TIME and '<column> MEAN/STD/MIN/MAX' for every available column,
+    sorted by ID and TIME.
+    """
+    df = prepare(df, source)
+    columns = [column for column in ROLLING_COLUMNS if column in df]
+    frame = df[["ID", "TIME"] + columns].reset_index(drop=True)
+    rolling = frame.groupby("ID", sort=False, observed=True).rolling(window, on="TIME")
+    stats = frame[["ID", "TIME"]].copy()
+    for stat in ["mean", "std", "min", "max"]:
+        # Groups come out in order of appearance, which is the sorted row order
+        values = getattr(rolling[columns], stat)()
+        for column in columns:
+            stats[f"{column} {stat.upper()}"] = values[column].to_numpy()
+    return stats
+
+def baseline(df, nominal_voltage = NOMINAL_VOLTAGE, window = BASELINE_WINDOW):
+    """
+    Computes the trailing median voltage of every meter, the reference of its sags and
+    swells. Interrupted samples are left out, samples without any reference yet fall
+    back to the nominal voltage.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data prepared by 'prepare' (sorted by ID and TIME).
+    nominal_voltage (float): The nominal voltage in V.
+    window (str): The length of the trailing window, e.g. '1D'.
+
+    Returns:
+    np.ndarray: The reference voltage of every sample.
+    """
+    voltage = df["VOLTAGE"].to_numpy(dtype=np.float64)
+    frame = pd.DataFrame({"ID": df["ID"].to_numpy(), "TIME": df["TIME"].to_numpy(),
+                          "VOLTAGE": np.where(voltage < INTERRUPTION * nominal_voltage,
+                                              np.nan, voltage)})
+    rolling = frame.groupby("ID", sort=False, observed=True).rolling(window, on="TIME")
+    # Groups come out in order of appearance, which is the sorted row order
+    median = rolling["VOLTAGE"].median().to_numpy()
+    return np.where(np.isnan(median), nominal_voltage, median)
+
+def classify(voltage, frequency = None, nominal_voltage = NOMINAL_VOLTAGE,
+             nominal_frequency = NOMINAL_FREQUENCY, frequency_tolerance = FREQUENCY_TOLERANCE,
+             reference = None):
+    """
+    Classifies every sample into a voltage disturbance (INTERRUPTION, SAG, SWELL) and,
+    separately, a frequency excursion. Interruptions are measured against the nominal
+    voltage, sags and swells against 'reference' (a voltage or one per sample), which
+    is the nominal voltage by default.
+
+    Returns:
+    tuple: Index into KINDS of the voltage disturbance, or -1, and a boolean frequency
+    excursion flag per sample.
+    """
+    voltage = np.asarray(voltage, dtype=np.float64)
+    reference = nominal_voltage if reference is None else np.asarray(reference)
+    kind = np.full(len(voltage), -1)
+    kind[voltage > SWELL * reference] = KINDS.index("SWELL")
+    kind[voltage < SAG * reference] = KINDS.index("SAG")
+    kind[voltage < INTERRUPTION * nominal_voltage] = KINDS.index("INTERRUPTION")
+    if frequency is None:
+        return kind, np.zeros(len(voltage), dtype=bool)
+    frequency = np.asarray(frequency, dtype=np.float64)
+    return kind, np.abs(frequency - nominal_frequency) > frequency_tolerance
+
+def detect(df, source, nominal_voltage = NOMINAL_VOLTAGE, nominal_frequency = NOMINAL_FREQUENCY,
+           frequency_tolerance = FREQUENCY_TOLERANCE, window = None, max_hold = MAX_HOLD,
+           reference = None):
+    """
+    Detects power-quality disturbances in processed meter data.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data, any row order.
+    source (str): The data source ('kosko'/'a2ei').
+    nominal_voltage (float): The nominal voltage in V.
+    reference (str, optional): Measure sags and swells against the 'nominal' voltage or
+                               each meter's trailing 'median' (see 'baseline'), by
+                               default as REFERENCES sets for the source.
+    nominal_frequency (float): The nominal frequency in Hz.
+    frequency_tolerance (float): The largest accepted deviation from nominal in Hz.
+    window (str, optional): Classify the rolling mean over this window (e.g. '5min')
+                            instead of the samples, which ignores single-sample glitches.
+    max_hold (pd.Timedelta): The longest time a sample holds without a next sample.
+
+    Returns:
+    pd.DataFrame: One row per disturbance with the columns of DISTURBANCE_COLUMNS, sorted
+    by ID and START. WORST is the value furthest from its reference, DEVIATION its
+    relative distance from the reference.
+
+    Raises:
+    ValueError: If the reference is unknown.
+    """
+    reference = REFERENCES.get(source, "nominal") if reference is None else reference
+    if reference not in ("nominal", "median"):
+        raise ValueError(f"Unknown reference voltage '{reference}'")
+    df = prepare(df, source)
+    voltage_reference = np.full(len(df), nominal_voltage)
+    if reference == "median":
+        voltage_reference = baseline(df, nominal_voltage)
+    if window is not None:
+        stats = rolling_stats(df, source, window)
+        voltage = stats["VOLTAGE MEAN"].to_numpy()
+        frequency = stats["FREQUENCY MEAN"].to_numpy() if "FREQUENCY" in df else None
+    else:
+        voltage = df["VOLTAGE"].to_numpy(dtype=np.float64)
+        frequency = df["FREQUENCY"].to_numpy(dtype=np.float64) if "FREQUENCY" in df else None
+    kind, excursion = classify(voltage, frequency, nominal_voltage, nominal_frequency,
+                               frequency_tolerance, voltage_reference)
+
+    meters, ids = pd.factorize(df["ID"])
+    times = df["TIME"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+    hold = hold_seconds(meters, df["TIME"].to_numpy(), max_hold)
+    ends = times + (hold * 1e9).astype(np.int64)
+    frames = []
+    for flagged, values, nominal in [(kind, voltage, voltage_reference),
+                                     (np.where(excursion, KINDS.index("FREQUENCY"), -1),
+                                      frequency, np.full(len(df), nominal_frequency))]:
+        active = np.flatnonzero(flagged >= 0)
+        if len(active) == 0:
+            continue
+        codes = meters * len(KINDS) + flagged
+        starts, last = group_runs(codes, active, times, ends, pd.Timedelta(0))
+        deviation = np.abs(values[active] - nominal[active]) / nominal[active]
+        worst = np.maximum.reduceat(deviation, starts)
+        # Position of the worst sample of every run
+        order = np.lexsort((-deviation, np.repeat(np.arange(len(starts)),
+                                                  np.diff(np.append(starts, len(active))))))
+        worst_at = active[order[starts]]
+        start, end = times[active[starts]], ends[active[last]]
+        frames.append(pd.DataFrame({
+            "ID": ids.take(meters[active[starts]]),
+            "KIND": np.array(KINDS)[flagged[active[starts]]],
+            "START": pd.to_datetime(start),
+            "END": pd.to_datetime(end),
+            "DURATION": pd.to_timedelta(end - start),
+            "WORST": values[worst_at],
+            "DEVIATION": worst,
+            "SAMPLES": last - starts + 1,
+        }))
+    if not frames:
+        return pd.DataFrame({column: [] for column in DISTURBANCE_COLUMNS})
+    disturbances = pd.concat(frames, ignore_index=True)
+    return disturbances.sort_values(by=["ID", "START"], kind="mergesort", ignore_index=True)
+
+def summarize(disturbances, daily = True):
+    """
+    Reports the disturbances per meter and kind, and per day when 'daily' is set.
+
+    Parameters:
+    disturbances (pd.DataFrame): Disturbances built by 'detect'.
+    daily (bool): Flag to report every day separately.
+
+    Returns:
+    pd.DataFrame: ID, (DATE,) KIND, COUNT, DURATION (total), LONGEST, WORST and DEVIATION
+    (of the worst disturbance).
+    """
+    frame = disturbances.copy()
+    keys = ["ID", "KIND"]
+    if daily:
+        frame["DATE"] = frame["START"].dt.floor("D")
+        keys = ["ID", "DATE", "KIND"]
+    grouped = frame.groupby(keys, sort=True, observed=True)
+    summary = grouped.agg(COUNT=("START", "size"), DURATION=("DURATION", "sum"),
+                          LONGEST=("DURATION", "max"))
+    worst = frame.sort_values("DEVIATION", ascending=False, kind="mergesort")
+    worst = worst.groupby(keys, sort=True, observed=True)[["WORST", "DEVIATION"]].first()
+    return summary.join(worst).reset_index()
@@ -2,10 +2,25 @@
     1) convert dates to time series
     3) replace missing data with zeros
     4) Append new data sets/csvs to this master list
+    5) optionally, process chunks of the raw export in parallel with a process pool
+    6) optionally, apply the compact typed schema (see sparkboard.schema)
+    7) write the processed data as CSV and/or Parquet (see sparkboard.storage)
+    8) optionally, write per-meter rollups at several resolutions (see sparkboard.rollup)
+    9) query meters within time windows by binary search (see sparkboard.indexing)
 """
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import sparkboard.plotting
+from sparkboard import schema, storage, rollup, metrics
+from sparkboard.indexing import MeterIndex
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
 ## Navigate to Kosko
 plotting_path = os.path.abspath(sparkboard.plotting.__file__)
 package_root_path = os.path.dirname(plotting_path)
@@ -13,6 +28,73 @@ parent_directory = os.path.dirname(package_root_path)
 ecook = os.path.dirname(parent_directory)
 data_directory = os.path.join(ecook, 'data/A2EI')
 
+TIME_COLUMNS = ['measurementTime', 'sourceCreatedAt', 'createdOn']
+
+
+def reformat(data_string):
+    """
+    reformat - Helper function to replace strings with format ready for conversion.
+    Handles various formats of date-time strings using base Python string methods.
+    """
+    if isinstance(data_string, str):
+        # Replace 'T' with a space
+        data_string = data_string.replace("T", " ")
+
+        if '.' in data_string: # Extract data after "."
+            data_string = data_string[:data_string.index('.')]
+
+        return data_string
+    return data_string
+
+def reformat_column(column):
+    """
+    Vectorized 'reformat' of a whole column: replaces 'T' with a space and drops
+    everything from the first '.' on, using pyarrow compute kernels over all entries
+    at once. Missing values are kept. Without pyarrow, or for columns holding anything
+    other than strings, falls back to 'reformat' per entry.
+    """
+    values = column.to_numpy()
+    if pc is None or pd.api.types.infer_dtype(values, skipna=True) != "string":
+        return column.apply(reformat)
+    strings = pa.array(values, type=pa.string(), from_pandas=True)
+    strings = pc.replace_substring(strings, "T", " ")
+    strings = pc.list_element(pc.split_pattern(strings, ".", max_splits=1), 0)
+    out = strings.to_numpy(zero_copy_only=False)
+    missing = pd.isna(values)
+    out[missing] = values[missing]
+    return pd.Series(out, index=column.index, name=column.name)
+
+def select_columns(df):
+    """
+    Maps a processed raw export onto the columns used by the dashboard.
+    """
+    data = {}
+    data['TIME'] = df['measurementTime'].values
+    data['VOLTAGE'] = df['meteredVoltageA'].values.astype(float)
+    data['CURRENT'] = df['currentA'].values.astype(float)
+    data['FREQUENCY'] = df['frequency'].values.astype(float)
+    data['POWER'] = df['meteredPower'].values.astype(float)
+    data['POWER FACTOR'] = df['powerFactorA'].values.astype(float)
+    data['ID'] = df['account_id'].values.astype(int)
+    return pd.DataFrame(data)
+
+@metrics.timed("a2ei.read")
+def read_export(path):
+    """
+    Reads a raw A2EI export.
+    """
+    return pd.read_csv(path)
+
+@metrics.timed("a2ei.process_chunk")
+def process_chunk(df):
+    """
+    Runs the processing steps on one chunk of the raw export and selects the dashboard
+    columns. Only 'measurementTime' is kept, so the other time columns are not reformatted.
+    Module level so it can be used as a process pool worker.
+    """
+    df['measurementTime'] = reformat_column(df['measurementTime'])
+    return select_columns(df.fillna(0))
+
 
 class A2EI:
     """
@@ -23,42 +105,72 @@ class A2EI:
 
     Constructors: None
     """
-    def __init__(self,write_csv = False):
-        self.df = pd.read_csv(f"{data_directory}/A2EI.csv")
-        self.process()
-        data = {}
-        data['TIME'] = self.df['measurementTime'].values
-        data['VOLTAGE'] = self.df['meteredVoltageA'].values.astype(float)
-        data['CURRENT'] = self.df['currentA'].values.astype(float)
-        data['FREQUENCY'] = self.df['frequency'].values.astype(float)
-        data['POWER'] = self.df['meteredPower'].values.astype(float)
-        data['POWER FACTOR'] = self.df['powerFactorA'].values.astype(float)
-        data['ID'] = self.df['account_id'].values.astype(int)
-        self.df = pd.DataFrame(data)
-        if write_csv:
-            self.df.to_csv(f"{data_directory}/A2EI_processed.csv", index=False)
+    def __init__(self, write_csv = False, directory = None, workers = None, chunksize = 100000,
+                 compact = False, write_parquet = False, rollups = False):
+        """
+        Reads 'A2EI.csv' from '../data/A2EI' (or 'directory') and processes it.
+
+        With 'workers' greater than one, the export is read in chunks of 'chunksize' rows
+        and each chunk is processed in a pool of that many processes. The result is
+        identical to the serial path.
+
+        With 'compact' set, 'TIME' becomes datetime64, 'ID' a categorical and the
+        measurements float32 where their precision allows.
+
+        'write_csv' and 'write_parquet' write 'A2EI_processed.csv'/'.parquet' next to the export.
+        With 'rollups' set, the rollups of every level ('A2EI_rollup_<level>') are written
+        along in the same formats.
+        """
+        self.directory = data_directory if directory is None else directory
+        self.meter_index = None
+        path = f"{self.directory}/A2EI.csv"
+        if workers is None or workers <= 1:
+            self.df = process_chunk(read_export(path))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunks = pool.map(process_chunk, pd.read_csv(path, chunksize=chunksize))
+                self.df = pd.concat(list(chunks), axis=0, ignore_index=True)
+        if compact:
+            self.df = schema.compact(self.df, "a2ei")
+        processed_path = f"{self.directory}/A2EI_processed.csv"
+        storage.write_processed(self.df, processed_path, write_csv, write_parquet, "a2ei")
+        if rollups:
+            rollup.write_rollups(self.df, processed_path, "a2ei", write_csv, write_parquet)
+
+    def memory_usage(self):
+        """
+        Returns the in-memory size of the processed data in bytes.
+        """
+        return schema.memory_usage(self.df)
+
+    def index(self):
+        """
+        Returns the per-meter index of the processed data, rebuilt after 'df' changed.
+        The export is not sorted by time, so the index holds a copy sorted by ID and TIME.
+        """
+        if self.meter_index is None or self.meter_index[0] is not self.df:
+            self.meter_index = (self.df, MeterIndex(self.df, time="TIME"))
+        return self.meter_index[1]
+
+    def query(self, meters, start = None, end = None, columns = None):
+        """
+        Selects the data of one or several meters within a time window by binary search
+        over their sorted times (see MeterIndex.query).
+
+        input: meters - An account ID (e.g. 1930), or a list of them
+               start, end - The window, both inclusive, e.g. '2023-06-17' (optional)
+               columns - The columns to return, all by default
+
+        output: DataFrame of the selected samples, sorted by time within every meter
+        """
+        return self.index().query(meters, start, end, columns)
 
     def convert_date_time(self):
         """
         convert string values to datatime object
         """
-        def reformat(data_string):
-            """
-            reformat - Local helper function to replace strings with format ready for conversion.
-            Handles various formats of date-time strings using base Python string methods.
-            """
-            if isinstance(data_string, str):
-                # Replace 'T' with a space
-                data_string = data_string.replace("T", " ")
-
-                if '.' in data_string: # Extract data after "."
-                    data_string = data_string[:data_string.index('.')]
-
-                return data_string
-            return data_string
-        self.df['measurementTime'] = self.df['measurementTime'].apply(reformat)
-        self.df['sourceCreatedAt'] = self.df['sourceCreatedAt'].apply(reformat)
-        self.df['createdOn'] = self.df['createdOn'].apply(reformat)
+        for column in TIME_COLUMNS:
+            self.df[column] = reformat_column(self.df[column])
 
     def pad_zeros(self):
         """
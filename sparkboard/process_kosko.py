@@ -2,12 +2,24 @@
 This script serves to process data for the Kosko sensor:
     1) convert dates to time series
     2) appends multiple CSV files into a master list
+    3) optionally, incrementally merges new or changed exports into an existing processed store
+    4) optionally, parses the meter exports in parallel with a process pool
+    5) optionally, applies the compact typed schema (see sparkboard.schema)
+    6) writes the processed data as CSV and/or Parquet (see sparkboard.storage)
+    7) optionally, writes per-meter rollups at several resolutions (see sparkboard.rollup)
+    8) optionally, writes daily and monthly consumption per meter (see sparkboard.energy)
+    9) queries meters within time windows by binary search (see sparkboard.indexing)
 Class can later be used to import into main functinality as a tool to easiliy access processed data
 """
 import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import sparkboard.plotting
+from sparkboard import schema, storage, rollup, energy, metrics
+from sparkboard.indexing import MeterIndex
 
 
 ## Navigate to Kosko
@@ -17,6 +29,107 @@ parent_directory = os.path.dirname(package_root_path)
 ecook = os.path.dirname(parent_directory)
 data_directory = os.path.join(ecook, 'data/Kosko')
 
+PROCESSED_FILE = "Kosko_processed.csv"
+MANIFEST_FILE = "Kosko_manifest.json"
+
+
+def meter_files(directory):
+    """
+    Lists the compliant meter exports (EM_<id>_<date>.csv) in a directory, sorted by name.
+    """
+    return [f for f in sorted(os.listdir(directory)) if ".csv" in f and "EM" in f]
+
+def meter_id(filename):
+    """
+    Extracts the meter ID from an export file name, e.g. 'EM_064_2023-06-17.csv' -> '064'.
+    """
+    return str(filename.split("_")[1])
+
+def file_signature(path):
+    """
+    Returns the cheap part of a manifest entry (size and modification time) for a file.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 content hash of a file, reading it in chunks.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+TIME_WIDTH = 17 # characters in 'yy-mm-dd HH:MM:SS'
+TIME_DIGITS = [0, 1, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16]
+TIME_SEPARATORS = {2: "-", 5: "-", 8: " ", 11: ":", 14: ":"}
+# Days since the epoch at the start of, and length of, every month from 2000-01 to 2099-12
+MONTHS = np.arange("2000-01", "2100-02", dtype="datetime64[M]").astype("datetime64[D]")
+MONTH_START = MONTHS[:-1].astype(np.int64)
+MONTH_LENGTH = np.diff(MONTHS.astype(np.int64))
+
+
+def parse_time(time):
+    """
+    Converts Kosko 'yy-mm-dd HH:MM:SS' strings to datetimes in the year 20yy, coercing
+    bad entries to NaT.
+
+    Entries are decoded all at once from their ASCII codes. Anything that is not
+    exactly in this format or not a valid date (other lengths, separators, out of
+    range fields, missing values) goes through pd.to_datetime, so the result matches
+    prefixing '20' and parsing each string.
+    """
+    values = time.to_numpy()
+    try:
+        data = values.astype(f"S{TIME_WIDTH + 1}")
+    except UnicodeEncodeError:
+        data = np.zeros(len(values), dtype=f"S{TIME_WIDTH + 1}")
+    chars = data.view(np.uint8).reshape(len(data), TIME_WIDTH + 1)
+    valid, seconds = decode_time(chars)
+    out = (seconds * 1_000_000_000).view("datetime64[ns]")
+    out[~valid] = np.datetime64("NaT")
+    if not valid.all():
+        rest = pd.Series(values[~valid]).astype(str)
+        out[~valid] = pd.to_datetime("20" + rest, format='%Y-%m-%d %H:%M:%S',
+                                     errors='coerce').to_numpy()
+    return pd.Series(out, index=time.index, name=time.name)
+
+def decode_time(chars):
+    """
+    Decodes a matrix of ASCII codes, one NUL padded 'yy-mm-dd HH:MM:SS' entry per row,
+    into seconds since the epoch. Returns a mask of the rows that are well formed and
+    valid dates, and the seconds (meaningless where the mask is False).
+    """
+    valid = chars[:, TIME_WIDTH] == 0
+    for i, separator in TIME_SEPARATORS.items():
+        valid &= chars[:, i] == ord(separator)
+    digits = chars[:, TIME_DIGITS] - np.uint8(ord("0"))
+    valid &= (digits <= 9).all(axis=1)
+
+    digits = np.ascontiguousarray(digits.T).astype(np.int64)
+    year, month, day, hour, minute, second = digits[0::2] * 10 + digits[1::2]
+    month_index = np.clip(year * 12 + month - 1, 0, len(MONTH_START) - 1)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= MONTH_LENGTH[month_index])
+    valid &= (hour < 24) & (minute < 60) & (second < 60)
+
+    days = MONTH_START[month_index] + day - 1
+    return valid, days * 86400 + hour * 3600 + minute * 60 + second
+
+@metrics.timed("kosko.load_meter")
+def load_meter(path, year = 2022):
+    """
+    Reads and pre-processes a single meter export: tags rows with the meter 'ID',
+    converts 'TIME' and drops entries from the excluded year. Module level so it
+    can be used as a process pool worker.
+    """
+    df = pd.read_csv(path)
+    df["ID"] = meter_id(os.path.basename(path))
+    df["TIME"] = parse_time(df["TIME"])
+    return df[df["TIME"].dt.year != year]
+
 
 class Kosko:
     """
@@ -27,36 +140,176 @@ class Kosko:
     as a tool to easily access processed data.
     Attributes:
     - df (pd.DataFrame): Processed data stored in a Pandas DataFrame.
+    - changes (dict): Files found new, changed or removed by the last incremental run.
+    - meter_index (tuple): 'df' and its MeterIndex, built by the first 'query'.
     Note:
     - The processed data is stored in the 'df' attribute.
     Example:
     kosko_instance = Kosko()
     processed_data = kosko_instance.df
+    day = kosko_instance.query("064", "2023-06-17", "2023-06-17 23:59:59", status="ON")
     """
-    def __init__(self,write_csv = False):
+    def __init__(self, write_csv = False, incremental = False, directory = None, workers = None,
+                 compact = False, write_parquet = False, rollups = False, consumption = False):
         """
-        Initializes the Kosko class. If 'Kosko_processed.csv' does not
-        exist, it reads and processes CSV files from the '../data/Kosko' directory
-        and creates a master DataFrame. If the file already exists, it reads the
-        preprocessed data.
+        Initializes the Kosko class. Reads and processes the EM_*.csv exports in
+        the '../data/Kosko' directory (or 'directory') and creates a master DataFrame.
+
+        With 'incremental' set, a manifest of per-file size/mtime/content hash is kept
+        next to 'Kosko_processed.csv'. Only new or changed exports are parsed and merged
+        into the existing processed store, which is then written back along with the manifest.
+
+        With 'workers' greater than one, the exports are parsed and pre-processed in a pool
+        of that many processes. The result is identical to the serial path.
+
+        With 'compact' set, 'ID' and 'DEVICE STATUS' become categoricals and the
+        measurements float32 where their precision allows.
+
+        'write_csv' and 'write_parquet' write 'Kosko_processed.csv'/'.parquet' to the data directory.
+        With 'rollups' set, the rollups of every level ('Kosko_rollup_<level>') are written
+        along in the same formats. With 'consumption' set, so are the daily and monthly
+        consumption ('Kosko_daily'/'Kosko_monthly').
+        """
+        self.directory = data_directory if directory is None else directory
+        self.workers = workers
+        self.processed_path = os.path.join(self.directory, PROCESSED_FILE)
+        self.manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        self.changes = {"new": [], "changed": [], "removed": []}
+        self.meter_index = None
+
+        files = meter_files(self.directory)
+        if incremental:
+            self.update(files)
+        else:
+            self.df = self.read(files)
+            self.sort()
+        if compact:
+            self.df = schema.compact(self.df, "kosko")
+
+        storage.write_processed(self.df, self.processed_path, write_csv, write_parquet, "kosko")
+        if rollups:
+            rollup.write_rollups(self.df, self.processed_path, "kosko", write_csv, write_parquet)
+        if consumption:
+            energy.write_consumption(self.df, self.directory, write_csv, write_parquet)
+
+    def memory_usage(self):
+        """
+        Returns the in-memory size of the processed data in bytes.
+        """
+        return schema.memory_usage(self.df)
+
+    def index(self):
+        """
+        Returns the per-meter index of the processed data, rebuilt after 'df' changed.
+        """
+        if self.meter_index is None or self.meter_index[0] is not self.df:
+            self.meter_index = (self.df, MeterIndex(self.df, time="TIME"))
+        return self.meter_index[1]
+
+    def query(self, meters, start = None, end = None, columns = None, status = None):
+        """
+        Selects the data of one or several meters within a time window by binary search
+        over their sorted times (see MeterIndex.query).
+
+        Parameters:
+        meters: A meter ID (e.g. '064'), or a list of them.
+        start, end (optional): The window, both inclusive, e.g. '2023-06-17'.
+        columns (list, optional): The columns to return, all by default.
+        status (str, optional): Keep the samples with this device status only ('ON'/'OFF').
+
+        Returns:
+        pd.DataFrame: The selected samples, a view of 'df' for one meter and all columns.
         """
-        kosko_data = sorted(os.listdir(data_directory))
+        return self.index().query(meters, start, end, columns, status)
 
-        ids = []
-        data = []
-        for kd in kosko_data:
-            if ".csv" in kd and "EM" in kd: #exclude non compliant files
-                id = kd.split("_")[1]
-                ids.append(id)
-                data.append(pd.read_csv(f"{data_directory}/{kd}"))
-        for d,id in zip(data, ids):
-            d["ID"] = str(id)
+    @metrics.timed("kosko.read")
+    def read(self, files):
+        """
+        Loads a list of meter exports with 'load_meter' and concatenates them in file order.
+        Uses a process pool when more than one worker is configured.
+        """
+        paths = [os.path.join(self.directory, kd) for kd in files]
+        if self.workers is None or self.workers <= 1:
+            data = [load_meter(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                data = list(pool.map(load_meter, paths))
+        return pd.concat(data, axis=0, ignore_index=True)
+
+    @metrics.timed("kosko.update")
+    def update(self, files):
+        """
+        Incrementally refreshes the processed store.
 
-        self.df = pd.concat(data, axis=0, ignore_index=True)
-        self.process()
+        1. Compares each export against the manifest; size/mtime matches are trusted,
+           otherwise the content hash decides whether the file really changed.
+        2. New files of otherwise untouched meters are parsed and appended. Meters with a
+           changed or removed export have all of their current exports re-read, so the
+           store always matches what a full rebuild would produce.
+        3. Writes the merged store (only if anything changed) and the new manifest.
+        """
+        previous = self.read_manifest()
+        current = {}
+        for kd in files:
+            path = os.path.join(self.directory, kd)
+            signature = file_signature(path)
+            entry = previous.get(kd)
+            if entry and entry["size"] == signature["size"] and entry["mtime"] == signature["mtime"]:
+                current[kd] = entry
+                continue
+            signature["sha256"] = file_hash(path)
+            current[kd] = signature
+            if entry is None:
+                self.changes["new"].append(kd)
+            elif entry["sha256"] != signature["sha256"]:
+                self.changes["changed"].append(kd)
+        self.changes["removed"] = [kd for kd in previous if kd not in current]
+
+        if not previous or not os.path.exists(self.processed_path):
+            self.changes["new"] = list(files)
+            self.df = self.read(files)
+            self.sort()
+        else:
+            stale = {meter_id(kd) for kd in self.changes["changed"] + self.changes["removed"]}
+            reread = [kd for kd in files if meter_id(kd) in stale]
+            reread += [kd for kd in self.changes["new"] if meter_id(kd) not in stale]
+            store = self.read_store()
+            store = store[~store["ID"].isin(stale)]
+            if reread:
+                self.df = pd.concat([store, self.read(reread)], axis=0, ignore_index=True)
+                self.sort()
+            else:
+                self.df = store
 
-        if write_csv:
-            self.df.to_csv("Kosko_processed.csv", index=False)
+        if any(self.changes.values()) or not os.path.exists(self.processed_path):
+            storage.write_atomic(self.processed_path,
+                                 lambda path: self.df.to_csv(path, index=False))
+        self.write_manifest(current)
+
+    def read_store(self):
+        """
+        Reads the existing processed store with the same data types 'process' produces.
+        """
+        return pd.read_csv(self.processed_path, dtype=schema.csv_dtypes("kosko"),
+                           parse_dates=["TIME"])
+
+    def read_manifest(self):
+        """
+        Returns the per-file manifest entries, or an empty dict if there is no manifest yet.
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+
+    def write_manifest(self, files):
+        """
+        Atomically replaces the manifest with the given per-file entries.
+        """
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"processed": PROCESSED_FILE, "files": files}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
 
     def process(self):
         """
@@ -70,24 +323,32 @@ class Kosko:
 
     def convert_date_time(self):
         """
-        1. Adds '20' to the beginning of each entry in the 'TIME' column.
-        2. Converts the 'TIME' column to datetime using the specified format '%Y-%m-%d %H:%M:%S'.
-        4. Converts the resulting datetime objects to a NumPy array.
+        Converts the 'yy-mm-dd HH:MM:SS' entries of the 'TIME' column to datetimes in the
+        year 20yy with the vectorized 'parse_time', bad entries become NaT.
         """
-        self.df['TIME'] = self.df['TIME'].apply(lambda x: '20' + x)
-        self.df['TIME'] = pd.to_datetime(self.df['TIME'],
-                                         format='%Y-%m-%d %H:%M:%S',
-                                         errors='coerce')
-        self.df['TIME'] = np.array(self.df['TIME'])
+        self.df['TIME'] = parse_time(self.df['TIME'])
 
+    @metrics.timed("kosko.sort")
     def sort(self):
         """
-        Sort the DataFrame based on the 'ID' and 'TIME' columns.
+        Sort the DataFrame based on the 'ID' and 'TIME' columns. The sort is stable so rows
+        with equal keys keep their file order, whichever way the frame was assembled.
         """
-        self.df = self.df.sort_values(by=['ID', 'TIME'])
+        self.df = self.df.sort_values(by=['ID', 'TIME'], kind="mergesort")
 
     def filter_year(self,year = 2022):
         """
-        Filter the DataFrame to exclude entries from a specified year.
+        Filter the DataFrame to exclude entries from a specified year. The entries of
+        every meter are located by binary search, the data is only copied if any exist.
         """
-        self.df = self.df[self.df['TIME'].dt.year != year]
+        index = self.index()
+        end = pd.Timestamp(year + 1, 1, 1) - pd.Timedelta(1, "ns")
+        drop = [index.window(meter, pd.Timestamp(year, 1, 1), end) for meter in index.ids]
+        drop = [(start, stop) for start, stop in drop if stop > start]
+        if not drop:
+            self.df = index.df
+            return
+        keep = np.ones(len(index.df), dtype=bool)
+        for start, stop in drop:
+            keep[start:stop] = False
+        self.df = index.df[keep]
@@ -1,11 +1,17 @@
 """
 This script is utilized for the truncation of the large survey results
 into a more compact form for analysis in the dashboard application
+
+New submissions can be appended: the exact per-community counts are kept in
+'survey_state.json', and only responses submitted after the last processed one
+are read and added to them.
 """
 import os
+import json
 import pandas as pd
 import numpy as np
 import sparkboard.plotting
+from sparkboard import storage, metrics
 
 ## Navigate to Kosko
 plotting_path = os.path.abspath(sparkboard.plotting.__file__)
@@ -13,6 +19,13 @@ package_root_path = os.path.dirname(plotting_path)
 parent_directory = os.path.dirname(package_root_path)
 ecook = os.path.dirname(parent_directory)
 data_directory = os.path.join(ecook, 'data/Survey')
+STATE_FILE = "survey_state.json"
+SUBMISSION_COLUMN = "_submission_time"
+
+# Columns whose entries are counted, and columns summed, with the prefix of their output
+REDUCED_COLUMNS = {"Participant_gender": "gender", "Sensor_Type": "sensor",
+                   "connection_modality": "modality", "rent_own": "ownership"}
+SUMMED_COLUMNS = {"electricity_payment_to/": "payment", "appliances/": "appliance"}
 
 
 def process_name(string_in, mode):
@@ -58,6 +71,22 @@ def process_name(string_in, mode):
         return string_in
     return None
 
+def count_entries(df, column):
+    """
+    Counts unique entries in a specified column per community, see 'column_reduction'.
+
+    Returns:
+    tuple: The unique entries and an integer array of counts, one row per community.
+    """
+    entries = df[column].unique()
+    entries = [e for e in entries if str(e) != "nan"]
+    communities, community_codes, present = community_groups(df)
+    entry_codes = pd.Index(entries, dtype=object).get_indexer(df[column])
+    counted = (entry_codes >= 0) & present
+    counts = np.bincount(community_codes[counted] * len(entries) + entry_codes[counted],
+                         minlength=len(communities) * len(entries))
+    return entries, counts.reshape(len(communities), len(entries))
+
 def column_reduction(df, column):
     """
     Counts unique entries in a specified column of a DataFrame and returns 
@@ -72,16 +101,10 @@ def column_reduction(df, column):
            - A list of unique entries in the specified column.
            - A numpy array with counts of each unique entry per community.
     """
-    entries = df[column].unique()
-    entries = [e for e in entries if str(e) != "nan"]
-    out = []
-    for community in df["community_name"].unique():
-        community_df = df[df["community_name"] == community]
-        data = np.zeros_like(entries)
-        for e, i in zip(entries,range(len(data))):
-            data[i] = int((community_df[column] == e).sum())
-        out.append(data)
-    return entries, np.array(out)
+    entries, counts = count_entries(df, column)
+    # Counts take the type of the entries, as when they were filled into
+    # np.zeros_like(entries): text of the entries' width for string entries
+    return entries, counts.astype(np.zeros_like(entries).dtype)
 
 def column_reduction_n(df,mode):
     """
@@ -96,17 +119,49 @@ def column_reduction_n(df,mode):
            - A list of processed column names.
            - A numpy array with aggregated sums for each community
     """
-    columns = df.columns
-    types = []
-    sum_list = []
-    for c in columns:
-        if mode in c:
-            types.append(c)
+    types = [c for c in df.columns if mode in c]
+    communities, community_codes, present = community_groups(df)
+    sums = df[types][present].fillna(0).groupby(community_codes[present], sort=True).sum()
+    sums = sums.reindex(range(len(communities)), fill_value=0)
+    return [process_name(c, mode = mode) for c in types], sums.to_numpy().reshape(
+        len(communities), len(types))
+
+def community_groups(df):
+    """
+    Numbers the communities of a DataFrame in order of first appearance, the order of
+    df["community_name"].unique(). A missing name is a community of its own, but none
+    of its rows are counted: a comparison with NaN never matches.
+
+    Returns:
+    tuple: The community names, the community number of every row and a flag per row
+    marking rows with a community name.
+    """
+    community_codes, communities = pd.factorize(df["community_name"], use_na_sentinel=False)
+    return communities, community_codes, df["community_name"].notna().to_numpy()
+
+@metrics.timed("survey.normalize", rows=lambda names, _: len(names))
+def normalize_communities(names):
+    """
+    Maps every raw community name to its dashboard format (see process_name). Names are
+    replaced one unique name at a time in order of appearance, so a name that formats
+    to another raw name further down the list is formatted again as that name.
 
-    for community in df["community_name"].unique():
-        community_df = df[df["community_name"] == community].fillna(0)
-        sum_list.append(community_df[types].sum(axis = 0).values)
-    return [process_name(c, mode = mode) for c in types], np.array(sum_list)
+    Parameters:
+    names (pd.Series): The raw community names, as strings.
+
+    Returns:
+    pd.Series: The formatted community names.
+    """
+    holders = {}
+    for name in names.unique():
+        holders.setdefault(name, []).append(name)
+    for name in names.unique():
+        formatted = process_name(name, "community")
+        # Popped first, a name already in dashboard format stays its own holder
+        raws = holders.pop(name, [])
+        holders.setdefault(formatted, []).extend(raws)
+    mapping = {raw: formatted for formatted, raws in holders.items() for raw in raws}
+    return names.map(mapping)
 
 def remove_sparse_columns(df):
     """
@@ -129,53 +184,212 @@ def remove_sparse_columns(df):
     dout = df[dout]
     return dout
 
-def process_data_survey(write_csv = True):
+def submission_times(df):
     """
-    Processes survey data, reformats community names, reduces data in specified columns, 
-    and writes the output to a CSV file.
+    Returns the submission time of every response in UTC: '_submission_time' when the
+    export has it, else the time the form was completed ('end'). Unparsable times are NaT.
+    """
+    column = SUBMISSION_COLUMN if SUBMISSION_COLUMN in df else "end"
+    return pd.to_datetime(df[column], utc=True, errors="coerce", format="ISO8601")
+
+def response_keys(df):
+    """
+    Identifies every response by the times its form was started and completed.
+    """
+    return df["start"].astype(str) + "|" + df["end"].astype(str)
+
+@metrics.timed("survey.reduce", rows=lambda _, df: len(df))
+def survey_state(df):
+    """
+    Aggregates survey responses (with formatted community names) into the exact counts
+    behind survey_app_data: per community, the count of every entry of REDUCED_COLUMNS
+    and the sum of every column of SUMMED_COLUMNS, including all-zero columns.
+
+    Returns:
+    dict: The state, JSON serializable. 'watermark' is the latest submission time and
+    'at_watermark' the keys of the responses submitted at that time.
+    """
+    state = {"communities": df["community_name"].unique().tolist(),
+             "entries": {}, "counts": {}, "columns": {}, "sums": {}, "float": {}}
+    for column in REDUCED_COLUMNS:
+        entries, counts = count_entries(df, column)
+        state["entries"][column] = entries
+        state["counts"][column] = counts.tolist()
+    for mode in SUMMED_COLUMNS:
+        _, sums = column_reduction_n(df, mode)
+        state["columns"][mode] = [c for c in df.columns if mode in c]
+        state["sums"][mode] = sums.tolist()
+        state["float"][mode] = bool(sums.dtype.kind == "f")
+    times = submission_times(df)
+    watermark = times.max()
+    state["watermark"] = None if pd.isna(watermark) else str(watermark)
+    state["at_watermark"] = response_keys(df)[times == watermark].tolist()
+    return state
+
+@metrics.timed("survey.merge")
+def merge_states(state, batch):
+    """
+    Merges the state of newly submitted responses into the state of the processed ones.
+    New communities, entries and columns are appended in order of appearance, as if the
+    responses had been aggregated together; counts of a missing column are zero.
 
     Parameters:
-    path (str, optional): The file path to the survey data. If None, a default path is used.
-    write_csv (bool): Flag to determine whether to write the processed data to a CSV file.
+    state (dict): The state of the processed responses, see 'survey_state'.
+    batch (dict): The state of the new responses.
+
+    Returns:
+    dict: The merged state.
+    """
+    communities = list(state["communities"])
+    rows = {community: row for row, community in enumerate(communities)}
+    for community in batch["communities"]:
+        if community not in rows:
+            rows[community] = len(communities)
+            communities.append(community)
+    batch_rows = [rows[community] for community in batch["communities"]]
+    old_rows = list(range(len(state["communities"])))
+
+    def add(old_names, old_values, new_names, new_values):
+        known = set(old_names)
+        names = list(old_names) + [n for n in new_names if n not in known]
+        positions = {name: column for column, name in enumerate(names)}
+        merged = np.zeros((len(communities), len(names)))
+        old_values = np.reshape(old_values, (len(old_rows), len(old_names)))
+        new_values = np.reshape(new_values, (len(batch_rows), len(new_names)))
+        merged[np.ix_(old_rows, [positions[n] for n in old_names])] += old_values
+        merged[np.ix_(batch_rows, [positions[n] for n in new_names])] += new_values
+        return names, merged
+
+    merged = {"communities": communities, "entries": {}, "counts": {}, "columns": {},
+              "sums": {}, "float": {}}
+    for column in REDUCED_COLUMNS:
+        entries, counts = add(state["entries"][column], state["counts"][column],
+                              batch["entries"][column], batch["counts"][column])
+        merged["entries"][column] = entries
+        merged["counts"][column] = counts.astype(np.int64).tolist()
+    for mode in SUMMED_COLUMNS:
+        columns, sums = add(state["columns"][mode], state["sums"][mode],
+                            batch["columns"][mode], batch["sums"][mode])
+        # Aggregated together, a column missing from some responses is filled with
+        # NaN, which makes the sums of its group floats
+        missing = ((old_rows and len(columns) > len(state["columns"][mode])) or
+                   (batch_rows and len(set(batch["columns"][mode])) < len(columns)))
+        is_float = bool(state["float"][mode] or batch["float"][mode] or missing)
+        merged["columns"][mode] = columns
+        merged["sums"][mode] = (sums if is_float else sums.astype(np.int64)).tolist()
+        merged["float"][mode] = is_float
+
+    watermarks = [w for w in [state["watermark"], batch["watermark"]] if w is not None]
+    merged["watermark"] = max(watermarks, key=pd.Timestamp) if watermarks else None
+    merged["at_watermark"] = ((state["at_watermark"] if state["watermark"] == merged["watermark"]
+                               else []) +
+                              (batch["at_watermark"] if batch["watermark"] == merged["watermark"]
+                               else []))
+    return merged
+
+def new_responses(df, state):
+    """
+    Selects the responses submitted after the processed ones: later than the watermark,
+    or at the watermark but not processed yet. Responses are expected to arrive in order
+    of submission; responses without a submission time are left to a full rebuild.
+    """
+    if state["watermark"] is None:
+        return df
+    times = submission_times(df)
+    watermark = pd.Timestamp(state["watermark"])
+    seen = response_keys(df).isin(state["at_watermark"]).to_numpy()
+    return df[((times > watermark) | ((times == watermark) & ~seen)).to_numpy()]
+
+@metrics.timed("survey.output")
+def survey_output(state):
+    """
+    Builds survey_app_data from a state: per community, the entry counts (as text of the
+    entries' width, see 'column_reduction') and sums, without all-zero columns.
 
     Returns:
     pd.DataFrame: The processed DataFrame.
     """
+    df_out = pd.DataFrame({})
+    df_out["community_name"] = state["communities"]
+    shape = len(state["communities"])
+    for column, prefix in REDUCED_COLUMNS.items():
+        entries = state["entries"][column]
+        counts = np.array(state["counts"][column], dtype=np.int64).reshape(shape, len(entries))
+        df_out[[f"{prefix}/{name}" for name in entries]] = counts.astype(
+            np.zeros_like(entries).dtype)
+    for mode, prefix in SUMMED_COLUMNS.items():
+        names = [process_name(c, mode = mode) for c in state["columns"][mode]]
+        dtype = np.float64 if state["float"][mode] else np.int64
+        df_out[[f"{prefix}/{name}" for name in names]] = np.array(
+            state["sums"][mode], dtype=dtype).reshape(shape, len(names))
+    return remove_sparse_columns(df_out)
+
+def read_state(path):
+    """
+    Returns the saved survey state, or None if there is none yet.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-    df = pd.read_csv(f"{data_directory}/Consumption Monitoring Survey_modified.csv")
+def write_state(state, path):
+    """
+    Atomically replaces the saved survey state.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+@metrics.timed("survey.process")
+def process_data_survey(write_csv = True, write_parquet = False, append = False, path = None,
+                        directory = None):
+    """
+    Processes survey data, reformats community names, reduces data in specified columns, 
+    and writes the output to a CSV and/or Parquet file.
 
-    df_out = pd.DataFrame({})
+    The exact counts behind the output are saved in 'survey_state.json' whenever an
+    output is written or 'append' is set, a run writing nothing leaves the saved state
+    alone. With 'append' set, only responses submitted after the saved ones are read
+    from the export and added to the saved counts, which gives the same output as
+    processing all responses.
 
-    df["community_name"] = df["community_name"].astype(str)
-    for name in df["community_name"].unique():
-        df.loc[df["community_name"] == name, "community_name"] = process_name(name,"community")
-
-    df_out["community_name"] = df["community_name"].unique()
-
-    columns_to_reduce = ["Participant_gender","Sensor_Type","connection_modality","rent_own"]
-    columns_n_to_reduce = ["electricity_payment_to/","appliances/"]
-
-    for column in columns_to_reduce:
-        names, data = column_reduction(df,column)
-        if "modality" in column:
-            names = [f"modality/{name}" for name in names]
-        elif "gender" in column:
-            names = [f"gender/{name}" for name in names]
-        elif "rent" in column:
-            names = [f"ownership/{name}" for name in names]
-        elif "Sensor" in column:
-            names = [f"sensor/{name}" for name in names]
-        df_out[names] = data
-
-    for column in columns_n_to_reduce:
-        names, data = column_reduction_n(df,column)
-        if "appliances" in column:
-            names = [f"appliance/{name}" for name in names]
-        elif "payment" in column:
-            names = [f"payment/{name}" for name in names]
-        df_out[names] = data
-
-    df_out = remove_sparse_columns(df_out)
+    Parameters:
+    write_csv (bool): Flag to determine whether to write the processed data to a CSV file.
+    write_parquet (bool): Flag to determine whether to write the processed data to a Parquet
+                          file, with the counts stored as numbers.
+    append (bool): Flag to add new responses to the saved state instead of starting over.
+    path (str, optional): The file path to the survey data. If None, a default path is used.
+                          In append mode it may hold the new submissions only.
+    directory (str, optional): Directory of the default survey data, the outputs and the
+                               state, '../data/Survey' by default.
+
+    Returns:
+    pd.DataFrame: The processed DataFrame.
+    """
+    directory = data_directory if directory is None else directory
+    if path is None:
+        path = f"{directory}/Consumption Monitoring Survey_modified.csv"
+    df = pd.read_csv(path)
+    state_path = f"{directory}/{STATE_FILE}"
+    state = read_state(state_path) if append else None
+    if state is not None:
+        df = new_responses(df, state)
+
+    df["community_name"] = normalize_communities(df["community_name"].astype(str))
+    batch = survey_state(df)
+    state = batch if state is None else merge_states(state, batch)
+    df_out = survey_output(state)
+    if write_csv or write_parquet or append:
+        write_state(state, state_path)
+
+    csv_path = f"{directory}/survey_app_data.csv"
     if write_csv:
-        df_out.to_csv(f"{data_directory}//survey_app_data.csv", index=False)
+        storage.write_processed(df_out, csv_path)
+    if write_parquet:
+        counts = [c for c in df_out.columns if c != "community_name"]
+        typed = df_out.copy()
+        typed[counts] = typed[counts].apply(pd.to_numeric)
+        storage.write_processed(typed, csv_path, write_csv=False, write_parquet=True)
     return df_out
@@ -1,13 +1,52 @@
 """
 This script is used in the event only raw data is avaliable
 or in the event modifications to how the data is processed is selected
-this script will generate/overwrite old data
+this script will generate/overwrite old data. Parquet copies are written
+alongside the CSVs when pyarrow is installed, as are the per-meter rollups
+and the cooking events of the meter data, and the daily and monthly Kosko
+consumption.
+
+The Kosko exports are ingested incrementally: only new or changed exports are parsed,
+and the cooking events of only the meters they belong to are detected again, carrying
+on from the detector state the previous run saved (see sparkboard.events.update_events).
+
+With SPARKBOARD_METRICS=1 the stage timings of the run are written in the Prometheus
+text format to SPARKBOARD_METRICS_FILE (default: sparkboard_processing.prom).
 """
-from .process_kosko import Kosko
+import os
+from .process_kosko import Kosko, meter_id
 from .process_a2ei import A2EI
 from .process_survey import process_data_survey
+from .storage import HAS_PARQUET, write_processed
+from .events import detect, update_events
+from . import metrics
+
+
+def kosko_events(kosko, write_parquet = False):
+    """
+    Updates 'Kosko_events.csv' after an incremental ingest: the meters with new, changed
+    or removed exports are detected, those with changed or removed exports from scratch.
+
+    Parameters:
+    kosko (Kosko): The ingest, built with incremental = True.
+    write_parquet (bool): Flag to write a Parquet copy of the events along.
+
+    Returns:
+    pd.DataFrame: All Kosko events.
+    """
+    changes = kosko.changes
+    stale = {meter_id(kd) for kd in changes["changed"] + changes["removed"]}
+    meters = stale | {meter_id(kd) for kd in changes["new"]}
+    return update_events(kosko.df, "kosko", os.path.join(kosko.directory, "Kosko_events.csv"),
+                         meters, stale, write_parquet)
 
 if __name__ == "__main__":
-    A2EI(write_csv = True)
-    Kosko(write_csv = True)
-    process_data_survey(write_csv=True)
+    a2ei = A2EI(write_csv = True, write_parquet = HAS_PARQUET, rollups = True)
+    write_processed(detect(a2ei.df, "a2ei"), os.path.join(a2ei.directory, "A2EI_events.csv"),
+                    write_parquet = HAS_PARQUET)
+    kosko = Kosko(write_csv = True, incremental = True, write_parquet = HAS_PARQUET,
+                  rollups = True, consumption = True)
+    kosko_events(kosko, write_parquet = HAS_PARQUET)
+    process_data_survey(write_csv=True, write_parquet = HAS_PARQUET)
+    if metrics.enabled:
+        metrics.write(os.environ.get("SPARKBOARD_METRICS_FILE", "sparkboard_processing.prom"))
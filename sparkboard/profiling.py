@@ -0,0 +1,212 @@
+"""
+This script captures call profiles of slow dashboard requests, so hot spots can be
+diagnosed in the real workload. Functions decorated with 'profiled' (update_graph and
+the plotting classes' dash_plot) run under cProfile when profiling is requested, and
+the profile is kept only if the call took longer than a threshold:
+
+    <directory>/<time>-<pid>-<name>-<ms>ms.prof: the profile, e.g. for
+        python -m pstats <file> or snakeviz <file>
+    <directory>/<time>-<pid>-<name>-<ms>ms.json: the call's inputs, the request that
+        triggered it, its duration and the functions with the most cumulative time
+
+The directory is rotated: only the newest profiles are kept.
+
+Environment:
+    - SPARKBOARD_PROFILE: '0' (default) disables profiling, decorated functions are
+      left undecorated. 'header' profiles the requests sending the header
+      'X-Sparkboard-Profile: 1', a fraction such as '0.1' additionally profiles that
+      share of all calls, picked at random ('1' profiles every call)
+    - SPARKBOARD_PROFILE_THRESHOLD_MS: profiles of calls faster than this are dropped
+      (default 500). Durations are measured under the profiler, which slows Python
+      heavy code down
+    - SPARKBOARD_PROFILE_DIR: where profiles are written (default: sparkboard-profiles
+      in the temporary directory)
+    - SPARKBOARD_PROFILE_KEEP: number of profiles kept (default 100)
+
+Only one call per thread is profiled at a time: a decorated function called by a
+profiled one (dash_plot within update_graph) is part of the caller's profile.
+"""
+import os
+import io
+import json
+import time
+import random
+import pstats
+import cProfile
+import inspect
+import logging
+import datetime
+import tempfile
+import functools
+import threading
+import pandas as pd
+
+mode = os.environ.get("SPARKBOARD_PROFILE", "0")
+enabled = mode != "0"
+sample = float(mode) if enabled and mode != "header" else 0.0
+threshold = float(os.environ.get("SPARKBOARD_PROFILE_THRESHOLD_MS", "500")) / 1000
+directory = os.environ.get("SPARKBOARD_PROFILE_DIR",
+                           os.path.join(tempfile.gettempdir(), "sparkboard-profiles"))
+keep = int(os.environ.get("SPARKBOARD_PROFILE_KEEP", "100"))
+HEADER = "X-Sparkboard-Profile"
+# Functions listed in the JSON summary of a profile
+TOP = 25
+state = threading.local()
+logger = logging.getLogger(__name__)
+
+
+def requested():
+    """
+    Whether the current call should be profiled: its request sends the profiling
+    header, or it is drawn in the sampled share of calls.
+    """
+    # Flask comes with Dash, processing jobs import the plotting without a request
+    from flask import has_request_context, request # pylint: disable=import-outside-toplevel
+    if has_request_context() and request.headers.get(HEADER, "0") not in ("", "0"):
+        return True
+    return sample > 0 and random.random() < sample
+
+def request_info():
+    """
+    Describes the request being served: its path and, for Dash callbacks, the inputs
+    that triggered it. Empty outside of requests.
+    """
+    from flask import has_request_context, request # pylint: disable=import-outside-toplevel
+    if not has_request_context():
+        return {}
+    body = request.get_json(silent=True) or {}
+    return {"path": request.path, "output": body.get("output"),
+            "changed": body.get("changedPropIds"),
+            "header": HEADER in request.headers}
+
+def describe(value, depth = 1):
+    """
+    Describes a call input for the JSON summary: DataFrames by their shape and columns,
+    objects by their attributes (down to 'depth' levels), long values are truncated.
+    """
+    if isinstance(value, pd.DataFrame):
+        return {"rows": len(value), "columns": [str(col) for col in value.columns]}
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value[:200]
+    if isinstance(value, (list, tuple)) and len(value) <= 20:
+        return [describe(item, depth) for item in value]
+    if isinstance(value, dict) and len(value) <= 20:
+        return {str(key): describe(item, depth) for key, item in value.items()}
+    if depth > 0 and hasattr(value, "__dict__"):
+        return {"type": type(value).__name__,
+                **{key: describe(item, depth - 1) for key, item in vars(value).items()
+                   if not key.startswith("_")}}
+    return repr(value)[:200]
+
+def summary(profiler):
+    """
+    Returns the functions with the most cumulative time of a profile, as text.
+    """
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(TOP)
+    return stream.getvalue()
+
+def save(profiler, name, seconds, inputs):
+    """
+    Writes a profile and its JSON summary, then drops the oldest profiles beyond 'keep'.
+
+    Returns:
+    str: Path of the profile.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    stem = os.path.join(directory, f"{stamp}-{os.getpid()}-{name}-{seconds * 1e3:.0f}ms")
+    details = {"name": name, "seconds": seconds, "time": stamp, "pid": os.getpid(),
+               "thread": threading.current_thread().name, "inputs": inputs,
+               "request": request_info(), "summary": summary(profiler)}
+    # Written aside and renamed, listings never show partial files
+    with open(f"{stem}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(details, f, indent=1, default=repr)
+    os.replace(f"{stem}.json.tmp", f"{stem}.json")
+    profiler.dump_stats(f"{stem}.prof.tmp")
+    os.replace(f"{stem}.prof.tmp", f"{stem}.prof")
+    rotate()
+    return f"{stem}.prof"
+
+def rotate():
+    """
+    Deletes the oldest profiles (and their summaries) beyond 'keep'. Workers of a
+    multi-worker server share the directory, files may vanish in between.
+    """
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith(".prof"))
+    for name in profiles[:max(0, len(profiles) - keep)]:
+        for path in (name, name[:-len(".prof")] + ".json"):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+def recent(count = 20):
+    """
+    Reads the summaries of the newest profiles, newest first.
+
+    Returns:
+    list: The JSON summaries (see 'save') with the file name of their profile.
+    """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith(".json")),
+                   reverse=True)[:count]
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                details = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        details["profile"] = name[:-len(".json")] + ".prof"
+        profiles.append(details)
+    return profiles
+
+def profiled(name):
+    """
+    Decorates a function to run it under cProfile when profiling is requested (see
+    'requested') and keep the profile if the call took longer than 'threshold'. The
+    call's arguments are attached to the profile (see 'describe'). Returns the function
+    itself if profiling is disabled.
+
+    Args:
+        name (str): Names the profiles, e.g. 'update_graph' or 'plot.time_series'.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+        signature = inspect.signature(func)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(state, "active", False) or not requested():
+                return func(*args, **kwargs)
+            profiler = cProfile.Profile()
+            state.active = True
+            start = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler runs in this thread
+                state.active = False
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                state.active = False
+                seconds = time.perf_counter() - start
+                if seconds >= threshold:
+                    bound = signature.bind_partial(*args, **kwargs).arguments
+                    try:
+                        save(profiler, name, seconds,
+                             {key: describe(value) for key, value in bound.items()})
+                    except OSError as error:
+                        logger.warning("Could not save the profile of %s: %s", name, error)
+        return wrapper
+    return decorator
@@ -0,0 +1,212 @@
+"""
+This script builds multi-resolution rollups of processed meter data. For every meter
+and fixed resolution (1 minute, 15 minutes, 1 hour, 1 day) a rollup holds per bucket:
+    1) the mean/min/max of each measurement
+    2) the energy delta in kWh: the increase of the Kosko KWH register, or the A2EI
+       POWER integrated over time
+    3) the number of raw samples
+Kosko rollups are kept per device status, so ON/OFF views can be served from them.
+
+A view spanning months needs a few thousand buckets, not every raw sample, so the
+dashboard plots the coarsest rollup that still resolves the requested window (see
+'choose_level') as a min/max envelope (see 'envelope').
+"""
+import os
+import numpy as np
+import pandas as pd
+from sparkboard import schema, storage, metrics
+from sparkboard.energy import register_delta
+
+# Finest to coarsest
+LEVELS = ["1min", "15min", "1h", "1D"]
+FREQUENCIES = {level: pd.Timedelta(level) for level in LEVELS}
+
+MEASUREMENTS = {
+    "kosko": ["VOLTAGE", "CURRENT", "WATT", "KWH"],
+    "a2ei": ["VOLTAGE", "CURRENT", "FREQUENCY", "POWER", "POWER FACTOR"],
+}
+GROUPS = {"kosko": ["DEVICE STATUS"], "a2ei": []}
+
+# A2EI power is not integrated across gaps longer than this, e.g. meter outages
+MAX_GAP = pd.Timedelta("1h")
+
+
+def rollup_path(csv_path, level):
+    """
+    Returns the CSV path of a rollup level, e.g. 'x/Kosko_processed.csv' -> 'x/Kosko_rollup_1h.csv'.
+    """
+    directory, name = os.path.split(csv_path)
+    stem = name.split("_processed")[0]
+    return os.path.join(directory, f"{stem}_rollup_{level}.csv")
+
+def hold_seconds(ids, times, max_gap = MAX_GAP):
+    """
+    Returns how long each sample holds, i.e. the time until the next sample of the same
+    meter, at most 'max_gap'. The last sample of every meter holds zero seconds.
+
+    Parameters:
+    ids (np.ndarray): Meter IDs, rows sorted by ID and TIME.
+    times (np.ndarray): Sample times as datetime64.
+    max_gap (pd.Timedelta): The longest hold, longer gaps are treated as outages.
+
+    Returns:
+    np.ndarray: The hold of each sample in seconds.
+    """
+    same_meter = np.zeros(len(ids), dtype=bool)
+    same_meter[:-1] = ids[:-1] == ids[1:]
+    times = np.asarray(times).astype("datetime64[ns]").astype(np.int64)
+    hold = np.append(np.diff(times), 0) / 1e9
+    return np.where(same_meter, np.minimum(hold, max_gap.total_seconds()), 0.0)
+
+def energy_delta(df, source):
+    """
+    Computes the energy in kWh attributed to each sample of a frame sorted by ID and TIME.
+
+    For Kosko this is the increase of the KWH register since the previous sample of the
+    meter, counting register resets and rollovers (see sparkboard.energy). For A2EI it is POWER (W) held until
+    the next sample of the meter, for at most MAX_GAP.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data sorted by ID and TIME.
+    source (str): The data source ('kosko'/'a2ei').
+
+    Returns:
+    np.ndarray: The energy of each sample in kWh.
+    """
+    ids = pd.factorize(df["ID"])[0]
+    if source == "kosko":
+        return register_delta(ids, df["KWH"].to_numpy())
+    hold = hold_seconds(ids, df["TIME"].to_numpy())
+    power = df["POWER"].to_numpy(dtype=np.float64)
+    return np.nan_to_num(power) * hold / 3.6e6
+
+def build(df, source, level):
+    """
+    Builds one rollup level of processed meter data.
+
+    Parameters:
+    df (pd.DataFrame): Processed meter data.
+    source (str): The data source ('kosko'/'a2ei').
+    level (str): The resolution, one of LEVELS.
+
+    Returns:
+    pd.DataFrame: One row per meter (and device status) and bucket, sorted by ID and TIME,
+    with the columns ID, TIME, the group columns, '<column> MEAN/MIN/MAX' per measurement,
+    ENERGY and SAMPLES.
+
+    Raises:
+    ValueError: If the source or level is unknown.
+    """
+    if source not in MEASUREMENTS:
+        raise ValueError(f"No rollup for data source '{source}'")
+    if level not in FREQUENCIES:
+        raise ValueError(f"Unknown rollup level '{level}'")
+    df = schema.parse_times(df.copy(), source)
+    df = df[df["TIME"].notna()]
+    df = df.sort_values(by=["ID", "TIME"], kind="mergesort")
+    measurements = [column for column in MEASUREMENTS[source] if column in df]
+    keys = ["ID", "TIME"] + GROUPS[source]
+    frame = df[keys + measurements].copy()
+    frame["TIME"] = frame["TIME"].dt.floor(level)
+    frame["ENERGY"] = energy_delta(df, source)
+    grouped = frame.groupby(keys, sort=False, observed=True, dropna=False)
+    stats = grouped[measurements].agg(["mean", "min", "max"])
+    stats.columns = [f"{column} {stat.upper()}" for column, stat in stats.columns]
+    stats["ENERGY"] = grouped["ENERGY"].sum()
+    stats["SAMPLES"] = grouped.size()
+    rollup = stats.reset_index()
+    return rollup.sort_values(by=["ID", "TIME"], kind="mergesort", ignore_index=True)
+
+def build_all(df, source, levels = None):
+    """
+    Builds several rollup levels (all by default).
+
+    Returns:
+    dict: The rollup of each level.
+    """
+    return {level: build(df, source, level) for level in (levels or LEVELS)}
+
+@metrics.timed("rollup.write")
+def write_rollups(df, csv_path, source, write_csv = True, write_parquet = False, levels = None):
+    """
+    Builds the rollups of a processed dataset and writes each level next to it.
+
+    Parameters:
+    df (pd.DataFrame): The processed data.
+    csv_path (str): Path of the processed CSV, rollups are named after it (see rollup_path).
+    source (str): The data source ('kosko'/'a2ei').
+    write_csv (bool): Flag to write the rollups as CSV.
+    write_parquet (bool): Flag to write the rollups as Parquet.
+    levels (list, optional): The levels to write, all by default.
+
+    Returns:
+    dict: The rollup of each level.
+    """
+    rollups = build_all(df, source, levels)
+    for level, rollup in rollups.items():
+        storage.write_processed(rollup, rollup_path(csv_path, level), write_csv, write_parquet,
+                                source)
+    return rollups
+
+def load_rollups(df, csv_path, source, levels = None):
+    """
+    Loads the rollups of a processed dataset, building levels without a written file
+    (or older than the processed data) from 'df'.
+
+    Returns:
+    dict: The rollup of each level.
+    """
+    version = storage.data_version(csv_path)
+    rollups = {}
+    for level in levels or LEVELS:
+        path = rollup_path(csv_path, level)
+        written = storage.data_version(path)
+        if written is not None and version is not None and written[1] >= version[1]:
+            rollups[level] = schema.parse_times(storage.read_processed(path, source), source)
+        else:
+            rollups[level] = build(df, source, level)
+    return rollups
+
+def choose_level(rows, min_points):
+    """
+    Picks the coarsest level that still has at least 'min_points' buckets for a view.
+    Counting the buckets that hold data (rather than dividing the time span) keeps
+    meters with long gaps from being drawn with a handful of points.
+
+    Parameters:
+    rows (dict): The number of rollup rows in the view for each level.
+    min_points (int): The number of points the view needs.
+
+    Returns:
+    str or None: The level, or None if even the finest level has too few rows.
+    """
+    for level in reversed(LEVELS):
+        if rows.get(level, 0) >= min_points:
+            return level
+    return None
+
+def envelope(rollup, source, level):
+    """
+    Turns a rollup into a frame with the raw columns for plotting: every bucket becomes
+    its minimum at the bucket start and its maximum half a bucket later, so the plotted
+    line spans the full range of the raw samples.
+
+    Parameters:
+    rollup (pd.DataFrame): A rollup built by 'build'.
+    source (str): The data source ('kosko'/'a2ei').
+    level (str): The level of the rollup.
+
+    Returns:
+    pd.DataFrame: Rows with the TIME, measurement, group and ID columns, sorted by ID and TIME.
+    """
+    measurements = [c for c in MEASUREMENTS[source] if f"{c} MIN" in rollup]
+    keys = GROUPS[source] + ["ID"]
+    low = rollup[["TIME"] + keys].copy()
+    high = rollup[["TIME"] + keys].copy()
+    high["TIME"] = high["TIME"] + FREQUENCIES[level] / 2
+    for column in measurements:
+        low[column] = rollup[f"{column} MIN"].to_numpy()
+        high[column] = rollup[f"{column} MAX"].to_numpy()
+    frame = pd.concat([low, high], ignore_index=True)
+    frame = frame.sort_values(by=["ID", "TIME"], kind="mergesort", ignore_index=True)
+    return frame[["TIME"] + measurements + keys]
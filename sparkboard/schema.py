@@ -0,0 +1,117 @@
+"""
+This script defines the compact, typed schema for processed meter data:
+    1) IDs and device status as categoricals
+    2) measurements as float32 where the values survive the round trip
+    3) TIME as native datetime64
+Text columns are read from CSV as strings, so Kosko IDs keep their zero padding ('064')
+whether a dataset is read from its Parquet or its CSV file.
+It also reports the in-memory footprint of a dataset, so fleets can be sized
+before they are loaded into the dashboard process.
+"""
+import numpy as np
+import pandas as pd
+from sparkboard import metrics
+
+SCHEMAS = {
+    "kosko": {
+        "text": ["ID", "DEVICE STATUS"],
+        "categorical": ["ID", "DEVICE STATUS"],
+        "datetime": ["TIME"],
+        "float32": ["VOLTAGE", "CURRENT", "WATT", "KWH"],
+    },
+    "a2ei": {
+        "text": [],
+        "categorical": ["ID"],
+        "datetime": ["TIME"],
+        "float32": ["VOLTAGE", "CURRENT", "FREQUENCY", "POWER", "POWER FACTOR"],
+    },
+}
+
+# Meter exports carry three decimals, half of the last digit is the allowed error
+TOLERANCE = 5e-4
+
+
+def downcast_float(series, tolerance = TOLERANCE):
+    """
+    Casts a float column to float32 if no value moves by more than 'tolerance',
+    otherwise returns it unchanged.
+
+    Parameters:
+    series (pd.Series): The column to downcast.
+    tolerance (float): The largest absolute round trip error accepted.
+
+    Returns:
+    pd.Series: The float32 column, or the original column.
+    """
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    narrow = values.astype(np.float32)
+    error = np.abs(narrow.astype(np.float64) - values)
+    if np.nanmax(error, initial=0.0) > tolerance:
+        return series
+    return pd.Series(narrow, index=series.index, name=series.name)
+
+def csv_dtypes(source):
+    """
+    Returns the read_csv data types of a data source's text columns, e.g. Kosko IDs.
+    """
+    return {column: str for column in SCHEMAS[source]["text"]}
+
+def parse_times(df, source):
+    """
+    Converts the TIME columns of a data source to datetime64, coercing bad entries to NaT.
+
+    Parameters:
+    df (pd.DataFrame): The processed data, modified in place.
+    source (str): The data source, a key of SCHEMAS ('kosko'/'a2ei').
+
+    Returns:
+    pd.DataFrame: The same DataFrame.
+    """
+    for column in SCHEMAS[source]["datetime"]:
+        if column in df and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    return df
+
+@metrics.timed("schema.compact")
+def compact(df, source, tolerance = TOLERANCE):
+    """
+    Applies the compact schema of a data source to a processed DataFrame.
+
+    Parameters:
+    df (pd.DataFrame): The processed data.
+    source (str): The data source, a key of SCHEMAS ('kosko'/'a2ei').
+    tolerance (float): The largest absolute error accepted when narrowing to float32.
+
+    Returns:
+    pd.DataFrame: A new DataFrame using the compact data types.
+
+    Raises:
+    ValueError: If the source has no schema.
+    """
+    if source not in SCHEMAS:
+        raise ValueError(f"No schema for data source '{source}'")
+    schema = SCHEMAS[source]
+    df = parse_times(df.copy(), source)
+    for column in schema["categorical"]:
+        if column in df:
+            df[column] = df[column].astype("category")
+    for column in schema["float32"]:
+        if column in df:
+            df[column] = downcast_float(df[column], tolerance)
+    return df
+
+def memory_usage(df):
+    """
+    Returns the in-memory size of a DataFrame in bytes, including object contents.
+    """
+    return int(df.memory_usage(deep=True).sum())
+
+def format_bytes(size):
+    """
+    Formats a byte count for reporting, e.g. 1536 -> '1.5 KB'.
+    """
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
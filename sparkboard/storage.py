@@ -0,0 +1,115 @@
+"""
+This script handles reading and writing the processed datasets. Besides CSV, a
+dataset can be written as Parquet, a typed columnar binary format: categoricals,
+floats and timestamps load back with their data types, without re-parsing text.
+
+Parquet support requires pyarrow. Without it, writing Parquet raises an ImportError
+and reading always falls back to the CSV.
+"""
+import os
+import importlib.util
+import pandas as pd
+from sparkboard import schema, metrics
+
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+
+def parquet_path(csv_path):
+    """
+    Returns the Parquet path belonging to a processed CSV, e.g. 'x/Kosko_processed.parquet'.
+    """
+    return f"{os.path.splitext(csv_path)[0]}.parquet"
+
+def write_atomic(path, write):
+    """
+    Writes a file aside and renames it into place, so readers (e.g. the dashboard
+    reloading every 30 s) see either the previous or the complete new file, never a
+    partial one. A failed write leaves the previous file untouched.
+
+    Parameters:
+    path (str): Path of the output.
+    write (callable): Writes the output to the path it is given.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@metrics.timed("storage.write")
+def write_processed(df, csv_path, write_csv = True, write_parquet = False, source = None):
+    """
+    Writes a processed dataset as CSV and/or Parquet next to each other. For meter
+    data ('source' set), the Parquet copy stores TIME as timestamps. Both files are
+    replaced atomically (see 'write_atomic').
+
+    Parameters:
+    df (pd.DataFrame): The processed data.
+    csv_path (str): Path of the CSV output, the Parquet output uses the same stem.
+    write_csv (bool): Flag to write the CSV.
+    write_parquet (bool): Flag to write the Parquet file.
+    source (str, optional): The data source ('kosko'/'a2ei') of meter data.
+
+    Raises:
+    ImportError: If Parquet output is requested without pyarrow installed.
+    """
+    if write_csv:
+        write_atomic(csv_path, lambda path: df.to_csv(path, index=False))
+    if write_parquet:
+        if not HAS_PARQUET:
+            raise ImportError("Writing Parquet requires pyarrow")
+        if source is not None:
+            df = schema.parse_times(df.copy(), source)
+        write_atomic(parquet_path(csv_path),
+                     lambda path: df.to_parquet(path, engine="pyarrow", index=False))
+
+def has_fresh_parquet(csv_path):
+    """
+    Checks if a usable Parquet file exists for a CSV, i.e. pyarrow is installed and
+    the Parquet file is at least as recent as the CSV.
+    """
+    path = parquet_path(csv_path)
+    if not HAS_PARQUET or not os.path.exists(path):
+        return False
+    return not os.path.exists(csv_path) or os.path.getmtime(path) >= os.path.getmtime(csv_path)
+
+@metrics.timed("storage.read")
+def read_processed(csv_path, source = None, **csv_kwargs):
+    """
+    Reads a processed dataset, preferring its Parquet file when it is usable and
+    falling back to the CSV otherwise.
+
+    Parameters:
+    csv_path (str): Path of the processed CSV.
+    source (str, optional): The data source ('kosko'/'a2ei') of meter data, whose text
+                            columns (e.g. Kosko IDs) are read from the CSV as strings,
+                            as the Parquet file stores them.
+    csv_kwargs: Extra arguments for pd.read_csv when falling back to the CSV.
+
+    Returns:
+    pd.DataFrame: The processed data.
+    """
+    if has_fresh_parquet(csv_path):
+        return pd.read_parquet(parquet_path(csv_path))
+    if source is not None:
+        csv_kwargs["dtype"] = {**schema.csv_dtypes(source), **csv_kwargs.get("dtype", {})}
+    return pd.read_csv(csv_path, **csv_kwargs)
+
+def data_version(csv_path):
+    """
+    Identifies the version of a processed dataset: the file read_processed would load,
+    with its modification time and size. Rewriting the dataset changes the version.
+
+    Parameters:
+    csv_path (str): Path of the processed CSV.
+
+    Returns:
+    tuple: (path, modification time in ns, size in bytes), or None if no file exists.
+    """
+    path = parquet_path(csv_path) if has_fresh_parquet(csv_path) else csv_path
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (os.path.basename(path), stat.st_mtime_ns, stat.st_size)
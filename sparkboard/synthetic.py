@@ -0,0 +1,406 @@
+"""
+This script generates synthetic data in the formats of the raw exports, for load and
+scale testing without production data:
+
+    Kosko: one 'EM_<id>_<date>.csv' per meter (TIME,VOLTAGE,CURRENT,WATT,KWH,DEVICE STATUS),
+           with 'yy-mm-dd HH:MM:SS' timestamps
+    A2EI: one 'A2EI.csv' holding the readings of every meter, interleaved by time
+    Survey: 'Consumption Monitoring Survey_modified.csv', with the columns of the survey
+            export
+
+Meters cook around breakfast and dinner: the load switches ON with a probability that
+peaks at meal times, draws a few amperes and pulls the voltage down a little.
+
+Output scales to any number of meters, months and sample interval. Files are written
+in chunks of at most CHUNK_ROWS rows, so memory stays flat however large the corpus.
+With pyarrow installed, the meter exports are written by its CSV writer, about ten
+times faster than pandas.
+Every chunk draws from its own random generator, seeded by the seed and the chunk's
+position, so the same arguments always give the same bytes.
+
+The output directory is laid out like 'data/', so the processing runs on it unchanged:
+    Kosko(directory=f"{directory}/Kosko")
+    A2EI(directory=f"{directory}/A2EI")
+    process_data_survey(directory=f"{directory}/Survey")
+
+Usage:
+    python -m sparkboard.synthetic directory [--meters 10] [--months 1] [--interval 60]
+                                             [--responses 100] [--seed 0]
+                                             [--sources kosko a2ei survey]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+CHUNK_ROWS = 500_000
+START = "2023-05-01"
+SURVEY_FILE = "Consumption Monitoring Survey_modified.csv"
+A2EI_COLUMNS = ["measurementTime", "sourceCreatedAt", "createdOn", "meteredVoltageA",
+                "currentA", "frequency", "meteredPower", "powerFactorA", "account_id"]
+# Seed streams of the sources, so sources sharing a seed draw different numbers
+KOSKO_STREAM, A2EI_STREAM, SURVEY_STREAM = 1, 2, 3
+# Community names as the survey form exports them (see process_survey.process_name)
+COMMUNITIES = ["kyebando_kisalosalo", "makerere_3", "kibuye_1", "banda", "lubya", "katwe_2",
+               "nsambya_gogonya", "mengo", "bwaise_2", "kanyanya"]
+APPLIANCES = ["percolator", "hot_plate", "cooking_coils", "oven", "electric_stove", "epc",
+              "blender", "deep_fryer", "rice_cooker", "microwave", "juicer",
+              "popcorn_machine", "ice_cream_machine", "other", "none"]
+REASONS_NO_YAKA = ["meter_expensive", "electricity_expensive", "landlord_wont_allow",
+                   "someone_wont_allow", "not_my_property", "documents",
+                   "dont_understand_process", "waiting_for_connection", "dont_want_one",
+                   "other"]
+PAYMENT_TO = ["umeme", "landlord", "neighbor", "kamyufu", "other", "no_one"]
+FUEL_SOURCES = ["electricity", "charcoal", "firewood", "briquettes", "gas", "other"]
+FUEL_LIKES = ["cheap", "easy_to_get", "convenient", "good_taste", "traditional", "modern",
+              "cooks_quickly", "cooks_right_amount", "good_smell", "safe", "clean",
+              "familiarity", "sold_nearby", "right_quantities", "none", "other"]
+FUEL_DISLIKES = ["expensive", "sold_far", "poor_quality", "smoky", "not_convenient",
+                 "bad_taste", "cooks_slowly", "not_safe", "dirty", "wrong_quantities",
+                 "bad_smell", "unfamiliarity", "none", "other"]
+
+
+def sample_count(months, interval, start = START, days = 0):
+    """
+    Returns the number of samples of a meter, one every 'interval' seconds over 'months'
+    months and 'days' days from 'start'.
+    """
+    start = pd.Timestamp(start)
+    end = start + pd.DateOffset(months=months) + pd.Timedelta(days=days)
+    span = (end - start) // pd.Timedelta(seconds=1)
+    return max(0, -(-span // interval))
+
+def sample_times(first, rows, interval, start = START):
+    """
+    Returns 'rows' sample times from the 'first' sample on, every 'interval' seconds
+    from 'start'. Chunks compute their own times, a meter's timeline is never held whole.
+    """
+    offsets = np.arange(first, first + rows, dtype=np.int64) * np.timedelta64(interval, "s")
+    return np.datetime64(pd.Timestamp(start), "ms") + offsets
+
+def time_text(times, unit, separator = " ", skip = 0, suffix = ""):
+    """
+    Formats datetimes as ISO 8601 text on their bytes, a lot faster than strftime:
+    'separator' between date and time, the first 'skip' characters dropped and
+    'suffix' appended, e.g. skip=2 gives Kosko's 'yy-mm-dd HH:MM:SS'.
+    """
+    if len(times) == 0:
+        return np.array([], dtype=str)
+    text = np.datetime_as_string(times, unit=unit)
+    # The string dtype is wider than the text, all values have the width of the first
+    width = len(text[0])
+    chars = text.astype(f"S{width}").view(np.uint8).reshape(len(times), width)
+    out = np.empty((len(times), width - skip + len(suffix)), dtype=np.uint8)
+    out[:, :width - skip] = chars[:, skip:]
+    out[:, 10 - skip] = ord(separator)
+    out[:, width - skip:] = np.frombuffer(suffix.encode(), dtype=np.uint8)
+    return out.view(f"S{out.shape[1]}").ravel().astype(str)
+
+def meal_probability(times):
+    """
+    Probability that a meter is cooking, peaking at breakfast (07:30) and dinner (19:00).
+    """
+    hours = (times - times.astype("datetime64[D]")).astype(np.int64) / 3.6e6
+    return (0.03 + 0.45 * np.exp(-((hours - 7.5) / 1.0) ** 2)
+            + 0.6 * np.exp(-((hours - 19.0) / 1.5) ** 2))
+
+def readings(rng, times):
+    """
+    Draws the readings of meters at 'times'.
+
+    Returns:
+    tuple: Voltage (V), current (A), power (W) and whether the load is ON.
+    """
+    rows = len(times)
+    on = rng.random(rows) < meal_probability(times)
+    current = np.where(on, rng.uniform(2, 6, rows), rng.uniform(0, 0.05, rows))
+    voltage = 230 + rng.normal(0, 6, rows) - on * rng.uniform(0, 15, rows)
+    power = voltage * current * rng.uniform(0.85, 1, rows)
+    return voltage, current, power, on
+
+def append_csv(df, path, first, fast = False):
+    """
+    Writes a chunk to a CSV, with the header if it is the first chunk. With 'fast' set
+    and pyarrow installed, the rows are written by pyarrow's CSV writer, which writes
+    whole-number floats without '.0' (read back the same) and never quotes.
+    """
+    if fast and HAS_ARROW:
+        with open(path, "wb" if first else "ab") as output:
+            if first: # pyarrow would quote the header
+                output.write((",".join(df.columns) + "\n").encode())
+            pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), output,
+                             pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+        return
+    df.to_csv(path, mode="w" if first else "a", header=first, index=False)
+
+def write_kosko(directory, meters = 10, months = 1, interval = 60, seed = 0, start = START,
+                days = 0):
+    """
+    Writes one Kosko export per meter, meter IDs counting up from '064'.
+
+    Parameters:
+    directory (str): The output directory, created if needed.
+    meters (int): The number of meters.
+    months (int): The months of data per meter.
+    interval (int): Seconds between two readings.
+    seed (int): Seed of the random readings.
+    start (str): The time of the first reading.
+    days (int): Days of data added to 'months'.
+
+    Returns:
+    int: The number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    count = sample_count(months, interval, start, days)
+    if count == 0:
+        return 0
+    last = sample_times(count - 1, 1, interval, start)[0]
+    for meter in range(meters):
+        path = os.path.join(directory, f"EM_{64 + meter:03d}_{str(last)[:10]}.csv")
+        kwh = 0.0
+        for chunk, first in enumerate(range(0, count, CHUNK_ROWS)):
+            rng = np.random.default_rng([seed, KOSKO_STREAM, meter, chunk])
+            chunk_times = sample_times(first, min(CHUNK_ROWS, count - first), interval, start)
+            voltage, current, power, on = readings(rng, chunk_times)
+            energy = kwh + np.cumsum(power) * interval / 3.6e6
+            kwh = energy[-1]
+            append_csv(pd.DataFrame({"TIME": time_text(chunk_times, "s", skip=2),
+                                     "VOLTAGE": voltage.round(3),
+                                     "CURRENT": current.round(3),
+                                     "WATT": power.round(3),
+                                     "KWH": energy.round(2),
+                                     "DEVICE STATUS": np.where(on, "ON", "OFF")}),
+                       path, first == 0, fast=True)
+    return meters * count
+
+def write_a2ei(directory, meters = 10, months = 1, interval = 60, seed = 0, start = START,
+               days = 0):
+    """
+    Writes an A2EI export ('A2EI.csv') of all meters, account IDs counting up from 1930.
+    A reading's upload ('createdOn') lags its measurement by a few seconds, and about one
+    in a hundred readings lacks its power.
+
+    Parameters: See write_kosko.
+
+    Returns:
+    int: The number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "A2EI.csv")
+    count = sample_count(months, interval, start, days)
+    if meters == 0 or count == 0:
+        append_csv(pd.DataFrame(columns=A2EI_COLUMNS), path, True)
+        return 0
+    steps = max(1, CHUNK_ROWS // max(meters, 1))
+    for chunk, first in enumerate(range(0, count, steps)):
+        rng = np.random.default_rng([seed, A2EI_STREAM, chunk])
+        chunk_times = np.repeat(sample_times(first, min(steps, count - first), interval, start),
+                                meters)
+        chunk_times = chunk_times + rng.integers(0, 1000, len(chunk_times)).astype("m8[ms]")
+        uploaded = chunk_times + rng.integers(1000, 5000, len(chunk_times)).astype("m8[ms]")
+        voltage, current, power, _ = readings(rng, chunk_times)
+        power[rng.random(len(power)) < 0.01] = np.nan
+        measured = time_text(chunk_times, "ms", separator="T", suffix="Z")
+        append_csv(pd.DataFrame({"measurementTime": measured,
+                                 "sourceCreatedAt": measured,
+                                 "createdOn": time_text(uploaded, "ms", separator="T",
+                                                        suffix="Z"),
+                                 "meteredVoltageA": voltage,
+                                 "currentA": current,
+                                 "frequency": 50 + rng.normal(0, 0.05, len(chunk_times)),
+                                 "meteredPower": power,
+                                 "powerFactorA": rng.uniform(0.85, 1, len(chunk_times)),
+                                 "account_id": np.tile(np.arange(1930, 1930 + meters),
+                                                       len(chunk_times) // meters)}),
+                   path, chunk == 0, fast=True)
+    return meters * count
+
+def community_names(communities):
+    """
+    Returns raw community names: the surveyed Kampala communities first, then made up
+    'village_<letters>' names (process_name drops digits).
+    """
+    names = COMMUNITIES[:communities]
+    for number in range(communities - len(names)):
+        names.append("village_" + "".join(chr(97 + number // 26**k % 26) for k in range(3)))
+    return names
+
+def select_one(rng, rows, choices, p = None, mask = None):
+    """
+    Draws the answers of a single choice question, missing where 'mask' is False.
+    """
+    answers = np.array(choices, dtype=object)[rng.choice(len(choices), rows, p=p)]
+    if mask is not None:
+        answers[~mask] = np.nan
+    return answers
+
+def select_multiple(rng, rows, name, options, rate, text = True, other = True,
+                    dtype = float, mask = None):
+    """
+    Draws the answers of a multiple choice question as the form exports them: the
+    space-separated choices in 'name' (if 'text'), one 0/1 column 'name/option' per
+    option, and a free text 'name_other' column (if 'other'), missing where 'mask' is False.
+
+    Returns:
+    dict: Column -> answers, in export order.
+    """
+    chosen = rng.random((rows, len(options))) < rate
+    columns = {}
+    if text:
+        joined = np.full(rows, "", dtype=object)
+        for i, option in enumerate(options):
+            joined = np.where(chosen[:, i], joined + " " + option, joined)
+        joined = np.array([answer.strip() or np.nan for answer in joined], dtype=object)
+        if mask is not None:
+            joined[~mask] = np.nan
+        columns[name] = joined
+    for i, option in enumerate(options):
+        values = chosen[:, i].astype(dtype)
+        if mask is not None:
+            values = np.where(mask, values, np.nan)
+        columns[f"{name}/{option}"] = values
+    if other:
+        columns[f"{name}_other"] = np.full(rows, np.nan)
+    return columns
+
+def survey_chunk(rng, first, rows, responses, names, times, meters):
+    """
+    Draws 'rows' survey responses, numbered from 'first', spread evenly over 'times'
+    (the first and last time of the survey).
+
+    Returns:
+    pd.DataFrame: The responses, with the columns of the survey export.
+    """
+    span = (times[1] - times[0]).astype(np.int64)
+    position = (first + np.arange(rows) + rng.random(rows)) / responses
+    started = times[0] + (position * span).astype("m8[ms]")
+    minutes = np.where(rng.random(rows) < 0.05, rng.integers(60, 7200, rows),
+                       rng.integers(5, 60, rows))
+    ended = started + (minutes * 60_000 + rng.integers(0, 60_000, rows)).astype("m8[ms]")
+    # Kampala local time, as the form records it
+    local = np.timedelta64(3, "h")
+    df = {"start": time_text(started + local, "ms", suffix="000+03:00"),
+          "end": time_text(ended + local, "ms", suffix="000+03:00"),
+          "community_name": select_one(rng, rows, names),
+          "date_time": time_text(started + local, "m", suffix=":00+03:00"),
+          "Participant_gender": select_one(rng, rows, ["female", "male"], p=[0.8, 0.2])}
+    df.update(select_multiple(rng, rows, "appliances", APPLIANCES, 0.25, text=False,
+                              other=False, dtype=int))
+    sensor = select_one(rng, rows, ["a2ei", "kosko"])
+    kosko_ids = np.array([f"EM-{64 + meter:03d}" for meter in range(max(meters, 1))])
+    df["Sensor_Type"] = sensor
+    df["Sensor_ID"] = np.where(sensor == "kosko", kosko_ids[rng.integers(0, len(kosko_ids),
+                                                                         rows)],
+                               "2.02086E+11")
+    df["Record_the_wiring_status_of_the_socket"] = select_one(
+        rng, rows, ["open_ground", "correct", "live_neu_reverse",
+                    "live_grd_reverse__missing_grd"], p=[0.5, 0.4, 0.05, 0.05],
+        mask=rng.random(rows) < 0.6)
+    df["rent_own"] = select_one(rng, rows, ["rent", "own"], p=[0.7, 0.3])
+    df["own_home"] = select_one(rng, rows, ["business_and_home", "home"])
+    df["tenancy_length"] = np.where(rng.random(rows) < 0.65,
+                                    rng.integers(1, 51, rows), np.nan)
+    df["How_many_people_live_e_including_yourself"] = rng.integers(1, 11, rows).astype(float)
+    df["income"] = rng.integers(1, 11, rows) * 100.0
+    yaka = rng.random(rows) < 0.4
+    df["yaka_connection"] = np.where(yaka, "yes", "no")
+    df["yaka_on_premises"] = select_one(rng, rows, ["yes"], mask=yaka)
+    df["yaka_shared"] = select_one(rng, rows, ["yes", "no"], mask=yaka)
+    df["yaka_shared_number"] = np.where(yaka & (df["yaka_shared"] == "yes"),
+                                        rng.integers(1, 26, rows), np.nan)
+    df.update(select_multiple(rng, rows, "reason_no_yaka", REASONS_NO_YAKA, 0.15,
+                              text=False, mask=~yaka))
+    df.update(select_multiple(rng, rows, "electricity_payment_to", PAYMENT_TO, 0.3))
+    df["connection_modality"] = select_one(rng, rows, ["e", "a", "d", "f"],
+                                           p=[0.5, 0.25, 0.17, 0.08],
+                                           mask=rng.random(rows) < 0.65)
+    df["cooking_with_electricity"] = "yes"
+    df["cooking_with_electricity_yes_no"] = 1.0
+    df.update(select_multiple(rng, rows, "cooking_fuel_sources", FUEL_SOURCES, 0.3))
+    df["electricity_used"] = np.nan
+    df.update(select_multiple(rng, rows, "electricity_fuel_likes", FUEL_LIKES, 0.15))
+    df.update(select_multiple(rng, rows, "electricity_fuel_dislikes", FUEL_DISLIKES, 0.15))
+    df["_id"] = 229001986 + first + np.arange(rows)
+    df["_index"] = first + 1 + np.arange(rows)
+    return pd.DataFrame(df)
+
+def write_survey(directory, responses = 100, communities = 10, months = 1, seed = 0,
+                 start = START, days = 0, meters = 10):
+    """
+    Writes a survey export ('Consumption Monitoring Survey_modified.csv') of 'responses'
+    responses from 'communities' communities, submitted over 'months' months and 'days'
+    days from 'start', in order of submission.
+
+    Parameters:
+    directory (str): The output directory, created if needed.
+    responses (int): The number of responses.
+    communities (int): The number of communities, the surveyed ones first.
+    months (int): The months the survey ran.
+    seed (int): Seed of the random answers.
+    start (str): When the survey started.
+    days (int): Days added to 'months'.
+    meters (int): The number of Kosko meters, which the responses' sensor IDs refer to.
+
+    Returns:
+    int: The number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SURVEY_FILE)
+    begin = pd.Timestamp(start)
+    end = begin + pd.DateOffset(months=months) + pd.Timedelta(days=days)
+    times = np.array([begin.to_datetime64(), end.to_datetime64()], dtype="datetime64[ms]")
+    names = community_names(communities)
+    # A hundred columns per response, chunks of a hundredth of the rows weigh the same
+    step = max(1, CHUNK_ROWS // 100)
+    for chunk, first in enumerate(range(0, max(responses, 1), step)):
+        rng = np.random.default_rng([seed, SURVEY_STREAM, chunk])
+        rows = min(step, responses - first)
+        append_csv(survey_chunk(rng, first, rows, responses, names, times, meters),
+                   path, chunk == 0)
+    return responses
+
+def generate(directory, meters = 10, months = 1, interval = 60, responses = 100, seed = 0,
+             sources = ("kosko", "a2ei", "survey")):
+    """
+    Writes a synthetic corpus laid out like 'data/': 'Kosko/', 'A2EI/' and 'Survey/'.
+
+    Returns:
+    dict: Source -> the number of rows written.
+    """
+    writers = {"kosko": lambda: write_kosko(os.path.join(directory, "Kosko"), meters, months,
+                                            interval, seed),
+               "a2ei": lambda: write_a2ei(os.path.join(directory, "A2EI"), meters, months,
+                                          interval, seed),
+               "survey": lambda: write_survey(os.path.join(directory, "Survey"), responses,
+                                              months=months, seed=seed, meters=meters)}
+    return {source: writers[source]() for source in sources}
+
+def main(argv = None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic Kosko, A2EI and survey data")
+    parser.add_argument("directory")
+    parser.add_argument("--meters", type=int, default=10)
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings")
+    parser.add_argument("--responses", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sources", nargs="+", choices=["kosko", "a2ei", "survey"],
+                        default=["kosko", "a2ei", "survey"])
+    args = parser.parse_args(argv)
+    written = generate(args.directory, args.meters, args.months, args.interval,
+                       args.responses, args.seed, args.sources)
+    for source, rows in written.items():
+        print(f"{source:8s} {rows:>14,} rows")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
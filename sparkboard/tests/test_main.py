@@ -4,16 +4,41 @@ and plotting scripts. Imports relevant packages, navigates to data directory for
 samples to embedd in tests. Performs basic image comparisons.
 """
 import os
+import json
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import pandas as pd
 import numpy as np
 from PIL import Image, ImageOps
 
 from ..plotting import plotting
+from ..plotting.downsample import reduce_points
 from ..process_survey import process_name, column_reduction, column_reduction_n
+from ..process_survey import normalize_communities
 from ..process_survey import remove_sparse_columns,process_data_survey
-from ..process_kosko import Kosko
-from ..process_a2ei import A2EI
+from ..process_kosko import Kosko, parse_time
+from ..process_a2ei import A2EI, reformat, reformat_column
+from ..storage import HAS_PARQUET, read_processed, data_version, write_processed
+from ..indexing import MeterIndex
+from ..figure_cache import FigureCache, figure_size
+from ..datastore import DataStore
+from .. import column_store
+from ..schema import compact
+from .. import schema
+from .. import rollup
+from ..events import detect, EventDetector, state_path, update_events
+from ..processing import kosko_events
+from .. import energy
+from .. import power_quality
+from .. import synthetic
+from .. import metrics
+from .. import profiling
 
 
 plotting_path = os.path.abspath(plotting.__file__)
@@ -108,6 +133,28 @@ def one_shot_column_reduction_n():
     m = vec.shape
     return m[0], int(vec.sum())
 
+def one_shot_column_reduction_communities():
+    """
+    Count entries over several communities, missing entries are not counted
+    """
+    data = pd.DataFrame({"community_name": ["Mengo", "Banda", "Mengo", "Mengo"],
+                         "rent_own": ["rent", np.nan, "own", "rent"]})
+    entries, counts = column_reduction(data, "rent_own")
+    return entries, counts.tolist()
+
+def edge_normalize_communities_chained():
+    """
+    Test a raw name formatting to another raw name, which is formatted in turn
+    """
+    return list(normalize_communities(pd.Series(["kibuye__", "Kibuye ", "banda"])))
+
+def edge_normalize_communities_formatted():
+    """
+    Test names already in dashboard format, alone and after a raw name formatting to them
+    """
+    return (list(normalize_communities(pd.Series(["Kisumu", "nairobi"]))),
+            list(normalize_communities(pd.Series(["village_abc", "Village Abc"]))))
+
 def one_shot_remove_sparsity():
     """
     Test empty data matrices (0) are being removed
@@ -132,6 +179,66 @@ def one_shot_final_dim():
     dim = len(df)
     return dim
 
+def survey_batches():
+    """
+    Split the survey by submission into three batches, the second with a new appliance
+    column and the third with a new community
+    """
+    times = pd.to_datetime(df_survey["end"], utc=True, format="ISO8601")
+    df = df_survey.iloc[np.argsort(times.to_numpy(), kind="stable")]
+    first, second, third = df.iloc[:20].copy(), df.iloc[20:40].copy(), df.iloc[40:].copy()
+    second["appliances/kettle"] = (np.arange(len(second)) % 3 == 0).astype(int)
+    third.loc[third.index[:3], "community_name"] = "new_town"
+    return first, second, third
+
+def one_shot_survey_append():
+    """
+    Append three batches of responses, compare with processing all of them at once
+    """
+    batches = survey_batches()
+    with tempfile.TemporaryDirectory() as directory:
+        for number, batch in enumerate(batches):
+            batch.to_csv(os.path.join(directory, f"batch_{number}.csv"), index=False)
+            appended = process_data_survey(write_csv = False, append = True, directory = directory,
+                                           path = os.path.join(directory, f"batch_{number}.csv"))
+    with tempfile.TemporaryDirectory() as directory:
+        pd.concat(batches).to_csv(os.path.join(directory, "all.csv"), index=False)
+        full = process_data_survey(write_csv = False, directory = directory,
+                                   path = os.path.join(directory, "all.csv"))
+    return (appended.to_csv(index=False) == full.to_csv(index=False),
+            "appliance/kettle" in full, "New Town" in list(full["community_name"]))
+
+def edge_survey_append_resubmitted():
+    """
+    Test appending a batch of responses a second time
+    """
+    first = survey_batches()[0]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "batch.csv")
+        first.to_csv(path, index=False)
+        before = process_data_survey(write_csv = False, append = True, directory = directory,
+                                     path = path)
+        after = process_data_survey(write_csv = False, append = True, directory = directory,
+                                    path = path)
+    return before.to_csv(index=False) == after.to_csv(index=False)
+
+def edge_survey_dry_run():
+    """
+    Test a run writing no output after an appended batch, the saved state is kept
+    """
+    first, second, _ = survey_batches()
+    with tempfile.TemporaryDirectory() as directory:
+        first.to_csv(os.path.join(directory, "first.csv"), index=False)
+        second.to_csv(os.path.join(directory, "second.csv"), index=False)
+        process_data_survey(write_csv = False, append = True, directory = directory,
+                            path = os.path.join(directory, "first.csv"))
+        with open(os.path.join(directory, "survey_state.json"), encoding="utf-8") as f:
+            saved = f.read()
+        process_data_survey(write_csv = False, directory = directory,
+                            path = os.path.join(directory, "second.csv"))
+        with open(os.path.join(directory, "survey_state.json"), encoding="utf-8") as f:
+            return f.read() == saved
+
 def smoke_kosko():
     """
     Smoke test to see if Kosko runs
@@ -154,6 +261,109 @@ def one_shot_kosko_output_data_types():
     query = kosko.df.values[0]
     return query
 
+def one_shot_kosko_incremental():
+    """
+    Build an incremental store from a few exports, add the rest, and compare against a
+    full rebuild. Returns the reported changes of both runs and whether the frames match.
+    """
+    files = sorted(f for f in os.listdir(kosko_directory) if f.startswith("EM"))[:4]
+    with tempfile.TemporaryDirectory() as directory:
+        for f in files[:2]:
+            shutil.copy(os.path.join(kosko_directory, f), directory)
+        first = Kosko(incremental=True, directory=directory).changes
+        for f in files[2:]:
+            shutil.copy(os.path.join(kosko_directory, f), directory)
+        kosko = Kosko(incremental=True, directory=directory)
+        full = Kosko(directory=directory)
+        match = kosko.df.reset_index(drop=True).equals(full.df.reset_index(drop=True))
+        return first, kosko.changes, match, files
+
+def one_shot_kosko_incremental_unchanged():
+    """
+    A second incremental run over untouched exports should report no changes
+    """
+    files = sorted(f for f in os.listdir(kosko_directory) if f.startswith("EM"))[:2]
+    with tempfile.TemporaryDirectory() as directory:
+        for f in files:
+            shutil.copy(os.path.join(kosko_directory, f), directory)
+        Kosko(incremental=True, directory=directory)
+        kosko = Kosko(incremental=True, directory=directory)
+        return kosko.changes, len(kosko.df)
+
+def one_shot_kosko_parallel():
+    """
+    Test the process pool loader produces the same frame as the serial loader
+    """
+    serial = Kosko(write_csv=False)
+    parallel = Kosko(write_csv=False, workers=2)
+    return serial.df.equals(parallel.df)
+
+def one_shot_kosko_compact():
+    """
+    Test the compact schema keeps the values and shrinks the footprint
+    """
+    kosko = Kosko(write_csv=False)
+    compact = Kosko(write_csv=False, compact=True)
+    error = np.nanmax(np.abs(kosko.df["KWH"].values - compact.df["KWH"].values.astype(float)))
+    dtypes = [str(compact.df[c].dtype) for c in ["TIME", "VOLTAGE", "DEVICE STATUS", "ID"]]
+    return dtypes, error, compact.memory_usage() < kosko.memory_usage()
+
+def one_shot_kosko_parquet():
+    """
+    Write the processed Kosko data as Parquet and read it back, compare against the frame
+    """
+    files = sorted(f for f in os.listdir(kosko_directory) if f.startswith("EM"))[:2]
+    with tempfile.TemporaryDirectory() as directory:
+        for f in files:
+            shutil.copy(os.path.join(kosko_directory, f), directory)
+        kosko = Kosko(directory=directory, write_parquet=True)
+        df = read_processed(os.path.join(directory, "Kosko_processed.csv"))
+        return df.equals(kosko.df.reset_index(drop=True)), str(df["TIME"].dtype)
+
+def edge_write_processed_failed():
+    """
+    A write failing halfway leaves the previous processed files in place, and no
+    temporary files behind
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "Kosko_processed.csv")
+        df = df_kosko.head(100)
+        write_processed(df, csv_path, write_csv=False, write_parquet=True)
+        # pyarrow cannot convert a column mixing numbers and text
+        broken = df.assign(VOLTAGE=[1.0, "x"] * 50)
+        try:
+            write_processed(broken, csv_path, write_csv=False, write_parquet=True)
+        except Exception: # pylint: disable=broad-except
+            pass
+        kept = read_processed(csv_path).equals(df)
+        return kept, sorted(os.listdir(directory))
+
+def one_shot_kosko_csv_ids():
+    """
+    Read the processed Kosko data back from its CSV, without a Parquet copy, the IDs
+    are the strings of the processed frame
+    """
+    files = sorted(f for f in os.listdir(kosko_directory) if f.startswith("EM"))[:2]
+    with tempfile.TemporaryDirectory() as directory:
+        for f in files:
+            shutil.copy(os.path.join(kosko_directory, f), directory)
+        kosko = Kosko(directory=directory, write_csv=True)
+        df = read_processed(os.path.join(directory, "Kosko_processed.csv"), "kosko")
+        return (sorted(df["ID"].unique()) == sorted(kosko.df["ID"].unique()),
+                sorted(df["ID"].unique())[0])
+
+def one_shot_kosko_parse_time():
+    """
+    Compare the vectorized timestamp parsing with prefixing '20' and parsing per entry,
+    including malformed, invalid and missing entries that are coerced to NaT
+    """
+    time = pd.Series(["23-05-24 00:01:44", "24-02-29 23:59:59", "23-02-29 00:00:00",
+                      "23-13-01 00:00:00", "23-5-24 00:01:44", "23-05-24 00:01:44 ",
+                      "23-05-24 24:00:00", "bad", np.nan])
+    expected = pd.to_datetime("20" + time.astype(str), format="%Y-%m-%d %H:%M:%S",
+                              errors="coerce")
+    return parse_time(time).equals(expected)
+
 def smoke_a2ei():
     """
     Smoke test to see if A2EI runs
@@ -176,6 +386,28 @@ def one_shot_a2ei_output_data_types():
     query = a2ei.df.values[0]
     return query
 
+def one_shot_a2ei_parallel():
+    """
+    Test the chunked process pool loader produces the same frame as the serial loader
+    """
+    serial = A2EI(write_csv=False)
+    parallel = A2EI(write_csv=False, workers=2, chunksize=1000)
+    return serial.df.equals(parallel.df)
+
+def one_shot_a2ei_compact():
+    """
+    Test the compact schema converts TIME to datetime64 and ID to a categorical
+    """
+    a2ei = A2EI(write_csv=False, compact=True)
+    return str(a2ei.df["TIME"].dtype), str(a2ei.df["ID"].dtype)
+
+def one_shot_a2ei_reformat_column():
+    """
+    Compare the vectorized time reformatting with 'reformat' per entry
+    """
+    column = pd.Series(["2023-01-01T00:00:00.123Z", "2023-01-01T00:00:00Z", "a.b.c", "", np.nan])
+    return reformat_column(column).equals(column.apply(reformat))
+
 def smoke_time_series_kosko_onoff():
     """
     Test to see if call to the plotting function runs on ON/OFF
@@ -184,7 +416,7 @@ def smoke_time_series_kosko_onoff():
     columns_to_exclude = ['ID', "TIME", "DEVICE STATUS"]
     kosko_status = "ONOFF"
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     return fig
 
@@ -197,7 +429,7 @@ def smoke_time_series_kosko_on():
     kosko_status = "ON"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     return fig
 
@@ -211,7 +443,7 @@ def smoke_time_series_kosko_off():
     kosko_status = "OFF"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     return fig
 
@@ -224,7 +456,7 @@ def one_shot_kosko_time_series_plotting_nominal_onoff():
     columns_to_exclude = ['ID', "TIME", "DEVICE STATUS"]
     kosko_status = "ONOFF"
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png"
@@ -241,7 +473,7 @@ def one_shot_kosko_time_series_plotting_nominal_on():
     kosko_status = "ON"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png"
@@ -258,7 +490,7 @@ def one_shot_kosko_time_series_plotting_nominal_off():
     kosko_status = "OFF"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{df_kosko['ID'][0]}_{kosko_status}.png"
@@ -276,7 +508,7 @@ def one_shot_kosko_time_series_plotting_abnormal_onoff():
     columns_to_exclude = ['ID', "TIME", "DEVICE STATUS"]
     kosko_status = "ONOFF"
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{id_}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{id_}_{kosko_status}.png"
@@ -295,7 +527,7 @@ def one_shot_kosko_time_series_plotting_abnormal_on():
     kosko_status = "ON"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{id_}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{id_}_{kosko_status}.png"
@@ -314,7 +546,7 @@ def one_shot_kosko_time_series_plotting_abnormal_off():
     kosko_status = "OFF"
     dff = dff[dff["DEVICE STATUS"] == kosko_status]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status)
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko",kosko_status,render_mode="svg")
     fig = subplot.dash_plot()
     fig.write_image(f"{package_root_path}/images/test_{id_}_{kosko_status}.png")
     path1 = f"{package_root_path}/images/test_{id_}_{kosko_status}.png"
@@ -329,7 +561,7 @@ def smoke_time_series_a2ei():
     dff = df_a2ei[df_a2ei['ID'] == 1935]
     columns_to_exclude = ['ID', "TIME"]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None)
+    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None,render_mode="svg")
     fig = subplot.dash_plot()
     return fig
 
@@ -341,7 +573,7 @@ def one_shot_a2ei_time_series_plotting_nominal():
     dff = df_a2ei[df_a2ei['ID'] == 1935]
     columns_to_exclude = ['ID', "TIME"]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None)
+    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None,render_mode="svg")
     fig = subplot.dash_plot()
 
     fig.write_image(f"{package_root_path}/images/test_A2EI_{1935}.png")
@@ -358,7 +590,7 @@ def one_shot_a2ei_time_series_plotting_abnominal():
     dff = df_a2ei[df_a2ei['ID'] == 1931]
     columns_to_exclude = ['ID', "TIME"]
     columns = [col for col in dff.columns if col not in columns_to_exclude]
-    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None)
+    subplot = plotting.PlotTimeSeries(dff,columns,"a2ei",None,render_mode="svg")
     fig = subplot.dash_plot()
 
     fig.write_image(f"{package_root_path}/images/test_A2EI_{1931}.png")
@@ -400,6 +632,234 @@ def one_shot_survey_plotting_abnormal():
     path2 = f"{package_root_path}/images/survey_Bwaise.png"
     return image_similarity(path1,path2)
 
+def one_shot_survey_figures():
+    """
+    Build a community's figure from the prebuilt column groups twice, the second
+    selection returns the figure of the first, identical to building it from scratch.
+    Unknown communities get an empty figure and are not kept
+    """
+    survey = plotting.SurveyFigures(df_survey_processed)
+    first = survey.figure("Makerere")
+    second = survey.figure("Makerere")
+    unknown = survey.figure("Not a community")
+    fresh = plotting.PlotSurvey(df_survey_processed, "Makerere").dash_plot()
+    return (first is second, first.to_json() == fresh.to_json(), len(unknown.data),
+            list(survey.figures))
+
+def edge_survey_groups():
+    """
+    Test grouping survey columns, entries keep their order and groups are sorted
+    """
+    return plotting.survey_groups(["community_name", "sensor/kosko", "gender/male",
+                                   "sensor/a2ei", "gender/female"])
+
+def one_shot_synthetic_corpus():
+    """
+    Generate two days of three meters and process every source of it
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic.write_kosko(f"{directory}/Kosko", 3, 0, 600, days=2)
+        synthetic.write_a2ei(f"{directory}/A2EI", 3, 0, 600, days=2)
+        synthetic.write_survey(f"{directory}/Survey", 40, days=2)
+        kosko = Kosko(directory=f"{directory}/Kosko").df
+        a2ei = A2EI(directory=f"{directory}/A2EI").df
+        survey = process_data_survey(write_csv=False, directory=f"{directory}/Survey")
+    return (kosko.shape, int(kosko["TIME"].isna().sum()), sorted(kosko["ID"].unique()),
+            a2ei.shape, len(survey))
+
+def edge_synthetic_seeded():
+    """
+    Test generating with chunks smaller than the data: the same seed gives the same
+    bytes, another seed other bytes
+    """
+    chunk_rows = synthetic.CHUNK_ROWS
+    synthetic.CHUNK_ROWS = 100
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            contents = []
+            for name, seed in [("a", 0), ("b", 0), ("c", 1)]:
+                synthetic.write_a2ei(f"{directory}/{name}", 2, 0, 3600, seed, days=5)
+                with open(f"{directory}/{name}/A2EI.csv", encoding="utf-8") as export:
+                    contents.append(export.read())
+    finally:
+        synthetic.CHUNK_ROWS = chunk_rows
+    return contents[0] == contents[1], contents[0] == contents[2], contents[0].count("\n")
+
+def edge_synthetic_chunk_times():
+    """
+    Test computing a timeline chunk by chunk, the chunks join up to the full timeline
+    """
+    count = synthetic.sample_count(0, 7, "2023-01-31 10:00:03", 3)
+    chunks = [synthetic.sample_times(first, min(1000, count - first), 7, "2023-01-31 10:00:03")
+              for first in range(0, count, 1000)]
+    times = np.concatenate(chunks)
+    return count, str(times[0]), str(times[-1]), bool((np.diff(times) == np.timedelta64(7, "s")).all())
+
+def one_shot_metrics():
+    """
+    Time a stage with metrics enabled, once returning rows and once raising, and render
+    the registry
+    """
+    enabled, registry = metrics.enabled, metrics.registry
+    metrics.enabled, metrics.registry = True, metrics.Registry()
+    try:
+        @metrics.timed("test.stage")
+        def stage(rows):
+            if rows < 0:
+                raise ValueError(rows)
+            return pd.DataFrame({"x": range(rows)})
+        stage(3)
+        try:
+            stage(-1)
+        except ValueError:
+            pass
+        text = metrics.registry.render()
+    finally:
+        metrics.enabled, metrics.registry = enabled, registry
+    lines = text.splitlines()
+    return ('sparkboard_stage_seconds_bucket{stage="test.stage",le="+Inf"} 2' in lines,
+            'sparkboard_stage_seconds_count{stage="test.stage"} 2' in lines,
+            'sparkboard_stage_rows_total{stage="test.stage"} 3' in lines,
+            'sparkboard_stage_errors_total{stage="test.stage"} 1' in lines)
+
+def edge_metrics_disabled():
+    """
+    Test disabled metrics leave functions undecorated and record nothing
+    """
+    enabled, registry = metrics.enabled, metrics.registry
+    metrics.enabled, metrics.registry = False, metrics.Registry()
+    try:
+        def stage():
+            return pd.DataFrame({"x": [1]})
+        timed = metrics.timed("test.stage")(stage)
+        timed()
+        text = metrics.registry.render()
+    finally:
+        metrics.enabled, metrics.registry = enabled, registry
+    return timed is stage, text
+
+def edge_metrics_buckets():
+    """
+    Test observations land in the first bucket whose bound they do not exceed, with
+    escaped labels
+    """
+    registry = metrics.Registry()
+    for value in [0.001, 0.002, 400.0]:
+        registry.observe("sparkboard_test_seconds", ("stage", 'a"b'), value)
+    lines = registry.render().splitlines()
+    return [line.split(" ")[-1] for line in lines
+            if 'le="0.001"' in line or 'le="0.0025"' in line or 'le="300.0"' in line
+            or 'le="+Inf"' in line] + [lines[2].split("{")[1].split(",")[0]]
+
+def one_shot_metrics_multiprocess():
+    """
+    Render the metrics of this process and of another worker's file in the
+    multiprocess mode, then again after this process records more
+    """
+    directory, registry = metrics.directory, metrics.registry
+    with tempfile.TemporaryDirectory() as metrics_directory:
+        metrics.directory, metrics.registry = metrics_directory, metrics.Registry()
+        try:
+            worker = metrics.Registry()
+            worker.observe("sparkboard_test_seconds", ("stage", "a"), 0.002)
+            worker.increment("sparkboard_test_rows_total", ("stage", "a"), 5)
+            with open(metrics.snapshot_path(1), "w", encoding="utf-8") as f:
+                json.dump(worker.snapshot(), f)
+            metrics.registry.observe("sparkboard_test_seconds", ("stage", "a"), 400.0)
+            metrics.registry.increment("sparkboard_test_rows_total", ("stage", "a"), 2)
+            first = metrics.collect().splitlines()
+            metrics.registry.increment("sparkboard_test_rows_total", ("stage", "a"), 1)
+            second = metrics.collect().splitlines()
+            files = sorted(os.listdir(metrics_directory))
+        finally:
+            metrics.directory, metrics.registry = directory, registry
+    return ('sparkboard_test_seconds_count{stage="a"} 2' in first,
+            'sparkboard_test_seconds_bucket{stage="a",le="0.0025"} 1' in first,
+            'sparkboard_test_rows_total{stage="a"} 7' in first,
+            'sparkboard_test_rows_total{stage="a"} 8' in second,
+            files == sorted(["metrics-1.json", f"metrics-{os.getpid()}.json"]))
+
+def one_shot_metrics_flush():
+    """
+    An idle worker's last observations reach its file from the flushing thread, and a
+    process's observations at exit from the exit handler
+    """
+    directory, registry, seconds = metrics.directory, metrics.registry, metrics.FLUSH_SECONDS
+    with tempfile.TemporaryDirectory() as metrics_directory:
+        metrics.directory, metrics.registry = metrics_directory, metrics.Registry()
+        metrics.FLUSH_SECONDS = 0.05
+        try:
+            metrics.start_flusher()
+            metrics.registry.increment("sparkboard_test_rows_total", ("stage", "a"), 3)
+            deadline = time.time() + 5
+            while metrics.registry.dirty and time.time() < deadline:
+                time.sleep(0.01)
+            with open(metrics.snapshot_path(), encoding="utf-8") as f:
+                idle = json.load(f)["counters"]
+        finally:
+            metrics.directory, metrics.registry = directory, registry
+            metrics.FLUSH_SECONDS = seconds
+        code = ("from sparkboard import metrics; "
+                "metrics.registry.increment('sparkboard_test_rows_total', ('stage', 'b'), 4)")
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=ecook,
+                       env=dict(os.environ, SPARKBOARD_METRICS_DIR=metrics_directory))
+        exited = [name for name in os.listdir(metrics_directory)
+                  if name != f"metrics-{os.getpid()}.json"]
+        with open(os.path.join(metrics_directory, exited[0]), encoding="utf-8") as f:
+            at_exit = json.load(f)["counters"]
+    return idle, at_exit
+
+def profile_calls(threshold, keep, calls):
+    """
+    Profile the calls of a stage calling another profiled stage with every call sampled,
+    returns the summaries of the kept profiles and the loadable profile files
+    """
+    saved = (profiling.enabled, profiling.sample, profiling.threshold,
+             profiling.directory, profiling.keep)
+    with tempfile.TemporaryDirectory() as directory:
+        (profiling.enabled, profiling.sample, profiling.threshold,
+         profiling.directory, profiling.keep) = True, 1.0, threshold, directory, keep
+        try:
+            @profiling.profiled("test.inner")
+            def inner(df):
+                return df["x"].sum()
+
+            @profiling.profiled("test.outer")
+            def outer(df, label = "meter"):
+                return inner(df)
+            for _ in range(calls):
+                outer(pd.DataFrame({"x": range(10)}), label="EM-064")
+            profiles = profiling.recent()
+            loadable = [pstats.Stats(os.path.join(directory, p["profile"])).total_calls > 0
+                        for p in profiles]
+        finally:
+            (profiling.enabled, profiling.sample, profiling.threshold,
+             profiling.directory, profiling.keep) = saved
+    return profiles, loadable
+
+def one_shot_profiling():
+    """
+    Profile three calls keeping two: the newest are kept, with their inputs
+    """
+    profiles, loadable = profile_calls(0, 2, 3)
+    return ([p["name"] for p in profiles], profiles[0]["inputs"], loadable,
+            profiles[0]["time"] > profiles[1]["time"], "inner" in profiles[0]["summary"])
+
+def edge_profiling_threshold():
+    """
+    Test calls below the threshold leave no profile and disabled profiling leaves
+    functions undecorated
+    """
+    profiles, _ = profile_calls(60, 10, 2)
+    def stage():
+        return 1
+    enabled, profiling.enabled = profiling.enabled, False
+    try:
+        decorated = profiling.profiled("test.stage")(stage)
+    finally:
+        profiling.enabled = enabled
+    return profiles, decorated is stage
+
 def one_shot_attribute_kosko():
     """
     Test atttribute call returning proper method Kosko
@@ -434,6 +894,461 @@ def edge_attribute_improper():
     method = getattr(subplot, "IMPROPER")
     return method
 
+def one_shot_meter_index():
+    """
+    Compare every meter slice of the index with a boolean mask over the whole frame
+    """
+    index = MeterIndex(df_kosko)
+    same = [index.rows(i).equals(df_kosko[df_kosko['ID'] == i]) for i in index.ids]
+    return all(same), index.ids == list(df_kosko['ID'].unique())
+
+def edge_meter_index_unsorted():
+    """
+    Test a frame where the rows of a meter are not contiguous, order within meters is kept
+    """
+    df = pd.DataFrame({"ID": [2, 1, 2, 1, 3], "TIME": [0, 1, 2, 3, 4]})
+    index = MeterIndex(df)
+    return index.ids, list(index.rows(2)["TIME"]), len(index.rows(4))
+
+def one_shot_meter_index_query():
+    """
+    Compare day windows of every meter, per device status and for a column subset, with
+    boolean masks over the whole frame
+    """
+    df = schema.parse_times(df_kosko.copy(), "kosko")
+    index = MeterIndex(df, time="TIME")
+    same = []
+    for i in index.ids:
+        times = index.rows(i)["TIME"].dropna()
+        start = times.iloc[len(times) // 2]
+        end = start + pd.Timedelta("1D")
+        for status in [None, "ON", "OFF"]:
+            mask = (df["ID"] == i) & (df["TIME"] >= start) & (df["TIME"] <= end)
+            if status is not None:
+                mask &= df["DEVICE STATUS"] == status
+            query = index.query(i, start, end, ["TIME", "WATT"], status)
+            same.append(query.equals(df.loc[mask, ["TIME", "WATT"]]))
+    view = index.query(index.ids[0], start, end)
+    return all(same), np.shares_memory(view["WATT"].to_numpy(), df["WATT"].to_numpy())
+
+def edge_meter_index_query():
+    """
+    Test a frame unsorted by time with missing times: rows are sorted by time within
+    meters, missing times last and outside of every window, buckets overlapping a window
+    are found by their span, several meters keep the order given
+    """
+    df = pd.DataFrame({"ID": [1, 1, 2, 1, 2],
+                       "TIME": ["2023-01-03", "2023-01-01", "2023-01-02", None, "2023-01-01"],
+                       "X": [3, 1, 22, 0, 21]})
+    index = MeterIndex(df, time="TIME")
+    window = index.query(1, "2023-01-01 12:00", "2023-01-03")["X"].tolist()
+    span = index.query(1, "2023-01-01 12:00", "2023-01-03", span=pd.Timedelta("1D"))["X"]
+    meters = index.query([2, 1, 5], end="2023-01-01")["X"].tolist()
+    try:
+        MeterIndex(df).query(1, "2023-01-01")
+        error = None
+    except ValueError:
+        error = "ValueError"
+    return (index.rows(1)["X"].tolist(), window, span.tolist(), meters,
+            len(index.query([], "2023-01-01")), error)
+
+def one_shot_render_mode(render_mode, webgl_threshold = 100000):
+    """
+    Plot a Kosko meter split by ON/OFF and return the trace types and count
+    """
+    dff = df_kosko[df_kosko['ID'] == df_kosko['ID'][0]]
+    columns_to_exclude = ['ID', "TIME", "DEVICE STATUS"]
+    columns = [col for col in dff.columns if col not in columns_to_exclude]
+    subplot = plotting.PlotTimeSeries(dff,columns,"kosko","ONOFF",render_mode=render_mode,
+                                      webgl_threshold=webgl_threshold)
+    fig = subplot.dash_plot()
+    return {trace.type for trace in fig.data}, len(fig.data) == 2 * len(columns)
+
+def one_shot_render_mode_defaults():
+    """
+    Count the points drawn by a Kosko meter with the dashboard's defaults, split by ON/OFF
+    and for one status, and whether 'auto' switches to WebGL
+    """
+    dff = df_kosko[df_kosko['ID'] == df_kosko['ID'][0]]
+    dff = pd.concat([dff] * 4, ignore_index=True)
+    columns = [col for col in dff.columns if col not in ['ID', "TIME", "DEVICE STATUS"]]
+    out = []
+    for status in ["ONOFF", "ON"]:
+        subplot = plotting.PlotTimeSeries(dff, columns, "kosko", status, max_points=2000)
+        drawn = sum(min(rows, 2000) for rows in subplot.trace_rows())
+        out.append((len(subplot.trace_rows()), drawn > subplot.webgl_threshold,
+                    subplot.webgl))
+    return out
+
+def edge_render_mode_improper():
+    """
+    Test an unknown render mode
+    """
+    return plotting.PlotTimeSeries(df_kosko,["VOLTAGE"],"kosko","ONOFF",render_mode="IMPROPER")
+
+def one_shot_downsample(method):
+    """
+    Downsample a noisy signal with a single spike, the spike and the cap must hold
+    """
+    rng = np.random.default_rng(0)
+    x = pd.Series(pd.date_range("2023-01-01", periods=100000, freq="s"))
+    y = pd.Series(rng.normal(size=100000))
+    y[54321] = 100.0
+    x_out, y_out = reduce_points(x, y, 1000, method)
+    return len(x_out) <= 1000, y_out.max() == 100.0, bool((np.diff(x_out) > np.timedelta64(0)).all())
+
+def edge_downsample_small():
+    """
+    Test a trace already under the cap is returned unchanged
+    """
+    x = pd.Series([1, 2, 3])
+    y = pd.Series([4.0, 5.0, 6.0])
+    x_out, y_out = reduce_points(x, y, 1000)
+    return x_out.equals(x) and y_out.equals(y)
+
+def edge_downsample_improper():
+    """
+    Test an unknown downsampling method
+    """
+    x = pd.Series(range(10))
+    return reduce_points(x, x, 5, "IMPROPER")
+
+def one_shot_rollup(source, df):
+    """
+    Build every rollup level, samples and energy must add up to the same totals
+    """
+    rollups = rollup.build_all(df, source)
+    samples = {len(r) and r["SAMPLES"].sum() for r in rollups.values()}
+    energy = [r["ENERGY"].sum() for r in rollups.values()]
+    ordered = all((r["VOLTAGE MIN"] <= r["VOLTAGE MEAN"] + 1e-9).all() and
+                  (r["VOLTAGE MEAN"] <= r["VOLTAGE MAX"] + 1e-9).all() for r in rollups.values())
+    return len(samples) == 1, bool(np.allclose(energy, energy[0])), ordered
+
+def one_shot_rollup_energy():
+    """
+    Test Kosko energy on a register that resets, the reading after a reset is consumption
+    """
+    df = pd.DataFrame({"TIME": ["2023-01-01 00:00:00", "2023-01-01 00:30:00",
+                                "2023-01-01 01:10:00", "2023-01-01 01:20:00"],
+                       "VOLTAGE": 230.0, "CURRENT": 1.0, "WATT": 230.0,
+                       "KWH": [1.0, 1.5, 0.2, 0.7], "DEVICE STATUS": "ON", "ID": 1})
+    hourly = rollup.build(df, "kosko", "1h")
+    return list(hourly["ENERGY"]), list(hourly["SAMPLES"])
+
+def one_shot_rollup_envelope():
+    """
+    Test the envelope keeps the extremes of every bucket with the raw columns
+    """
+    hourly = rollup.build(df_a2ei, "a2ei", "1h")
+    meter = hourly[hourly["ID"] == hourly["ID"].iloc[0]]
+    frame = rollup.envelope(meter, "a2ei", "1h")
+    return (len(frame) == 2 * len(meter), frame["POWER"].max() == meter["POWER MAX"].max(),
+            list(frame.columns) == list(df_a2ei.columns))
+
+def edge_rollup_improper():
+    """
+    Test an unknown rollup level
+    """
+    return rollup.build(df_kosko, "kosko", "IMPROPER")
+
+def one_shot_events():
+    """
+    Detect events in a hand made A2EI meter: a pause of 10 minutes is merged, one of
+    30 minutes splits events, and a single active minute is too short
+    """
+    power = [0, 800, 900, 0, 700, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+             0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 600, 0]
+    minutes = [0, 1, 2, 3, 13] + list(range(14, 41))
+    df = pd.DataFrame({"TIME": pd.Timestamp("2023-01-01") + pd.to_timedelta(minutes, "min"),
+                       "POWER": power, "ID": 1})
+    events = detect(df, "a2ei", min_duration=pd.Timedelta("2min"),
+                    merge_gap=pd.Timedelta("15min"))
+    return (len(events), events["DURATION"][0] == pd.Timedelta("13min"),
+            np.isclose(events["ENERGY"][0], (800 + 900 + 700) / 60 / 1000),
+            events["PEAK POWER"][0])
+
+def one_shot_events_incremental():
+    """
+    Feed the Kosko data to the detector in five batches, the events must equal one pass
+    """
+    df = df_kosko.copy()
+    df["TIME"] = pd.to_datetime(df["TIME"])
+    df = df.sort_values("TIME", kind="mergesort")
+    detector = EventDetector("kosko")
+    for batch in np.array_split(np.arange(len(df)), 5):
+        times = df["TIME"].iloc[batch]
+        detector.update(df[(df["TIME"] >= times.min()) & (df["TIME"] <= times.max())])
+    return detector.events.equals(detect(df_kosko, "kosko"))
+
+def one_shot_events_jobs():
+    """
+    Run two processing jobs back to back, the second one after new exports arrived and
+    a meter's export changed: its events must equal one run over all the data, and it
+    only detects the meters with new or changed exports
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic.write_kosko(directory, 3, 0, 300, days=2)
+        first = kosko_events(Kosko(directory=directory, incremental=True))
+        synthetic.write_kosko(directory, 2, 0, 300, start="2023-05-03", days=2)
+        synthetic.write_kosko(f"{directory}/changed", 3, 0, 300, seed=1, days=2)
+        changed = sorted(os.listdir(f"{directory}/changed"))[0]
+        shutil.copy(f"{directory}/changed/{changed}", f"{directory}/{changed}")
+        kosko = Kosko(directory=directory, incremental=True)
+        second = kosko_events(kosko)
+        events_path = os.path.join(directory, "Kosko_events.csv")
+        saved = pd.read_csv(events_path, dtype={"ID": str})
+        full = detect(Kosko(directory=directory).df, "kosko")
+        # Nothing new: the untouched meter's events come from the saved state alone
+        resumed = update_events(kosko.df[kosko.df["ID"] != "066"], "kosko", events_path, [])
+        has_state = os.path.exists(state_path(events_path))
+    return (len(first) > 0, second.equals(full), len(saved) == len(full), has_state,
+            resumed.equals(full), len(kosko.changes["new"]), kosko.changes["changed"] == [changed])
+
+def edge_events_improper():
+    """
+    Test event detection on an unknown data source
+    """
+    return detect(df_kosko, "IMPROPER")
+
+def one_shot_register_delta():
+    """
+    Test consumption from a register that rolls over, is reset and jitters
+    """
+    kwh = [99990.0, 99999.0, 3.0, 4.0, 1.0, 0.995]
+    return list(energy.register_delta(np.zeros(len(kwh)), kwh))
+
+def one_shot_daily_consumption():
+    """
+    Bridge a gap: 3 kWh used from noon on day one to noon on day three
+    """
+    df = pd.DataFrame({"ID": 1, "KWH": [10.0, 13.0],
+                       "TIME": ["2023-01-01 12:00:00", "2023-01-03 12:00:00"]})
+    days = energy.daily(df)
+    return list(days["ENERGY"]), list(days["ESTIMATED"])
+
+def one_shot_monthly_consumption():
+    """
+    Months must add up to the same energy as the days and the register
+    """
+    days = energy.daily(df_kosko)
+    months = energy.monthly(days)
+    return bool(np.isclose(days["ENERGY"].sum(), months["ENERGY"].sum()))
+
+def smoke_consumption_plot():
+    """
+    Test to see if call to the consumption plotting function runs for the fleet
+    """
+    days = energy.daily(df_kosko)
+    months = energy.monthly(days)
+    return plotting.PlotConsumption(energy.fleet(days, "DATE"), energy.fleet(months, "MONTH"),
+                                    "Fleet").dash_plot()
+
+def power_quality_meter():
+    """
+    Hand made A2EI meter with a sag, an interruption, a swell and a frequency excursion
+    """
+    return pd.DataFrame({
+        "TIME": pd.date_range("2023-01-01", periods=8, freq="min"),
+        "VOLTAGE": [240.0, 200.0, 190.0, 240.0, 10.0, 240.0, 270.0, 240.0],
+        "FREQUENCY": [50.0, 50.0, 50.0, 50.0, 50.0, 51.0, 50.0, 50.0],
+        "ID": 1})
+
+def one_shot_power_quality():
+    """
+    Detect the disturbances of the hand made meter
+    """
+    disturbances = power_quality.detect(power_quality_meter(), "a2ei")
+    return {kind: (samples, worst) for kind, samples, worst in
+            zip(disturbances["KIND"], disturbances["SAMPLES"], disturbances["WORST"])}
+
+def one_shot_power_quality_summary():
+    """
+    Summarize the disturbances of the hand made meter per day
+    """
+    summary = power_quality.summarize(power_quality.detect(power_quality_meter(), "a2ei"))
+    sag = summary[summary["KIND"] == "SAG"].iloc[0]
+    return len(summary), sag["COUNT"], sag["DURATION"], sag["WORST"]
+
+def one_shot_power_quality_rolling():
+    """
+    Rolling statistics over two minutes of the hand made meter
+    """
+    stats = power_quality.rolling_stats(power_quality_meter(), "a2ei", "2min")
+    return list(stats["VOLTAGE MEAN"][:3]), list(stats["VOLTAGE MIN"][:3])
+
+def one_shot_power_quality_kosko():
+    """
+    Share of the Kosko samples flagged as sags and swells against the nominal voltage
+    and against the meters' own trailing median
+    """
+    shares = []
+    for reference in ("nominal", "median"):
+        disturbances = power_quality.detect(df_kosko, "kosko", reference=reference)
+        samples = disturbances.groupby("KIND")["SAMPLES"].sum() / len(df_kosko)
+        shares.append((samples.get("SAG", 0.0), samples.get("SWELL", 0.0)))
+    return shares
+
+def one_shot_figure_cache():
+    """
+    Build the same survey figure twice through the cache, the second lookup is a hit
+    """
+    cache = FigureCache(2**30)
+    key = ("survey", "Makerere", None, 0)
+    first = cache.get(key, plotting.PlotSurvey(df_survey, "Makerere").dash_plot)
+    second = cache.get(key, plotting.PlotSurvey(df_survey, "Makerere").dash_plot)
+    stats = cache.stats()
+    return first is second, stats["hits"], stats["misses"]
+
+def one_shot_figure_cache_eviction():
+    """
+    Cache three Kosko figures in a budget for two, the least recently used is evicted
+    """
+    figs = [smoke_time_series_kosko_onoff() for _ in range(3)]
+    cache = FigureCache(2 * figure_size(figs[0]))
+    cache.get(("kosko", 1), lambda: figs[0])
+    cache.get(("kosko", 2), lambda: figs[1])
+    cache.get(("kosko", 1), lambda: figs[0])
+    cache.get(("kosko", 3), lambda: figs[2])
+    return list(cache.entries), cache.stats()["evictions"]
+
+def edge_figure_cache_invalidate():
+    """
+    Test invalidating the figures of one data source
+    """
+    cache = FigureCache(2**30)
+    for key in [("kosko", 1), ("a2ei", 1), ("kosko", 2)]:
+        cache.get(key, smoke_time_series_kosko_onoff)
+    cache.invalidate("kosko")
+    return list(cache.entries), cache.size == figure_size(cache.entries[("a2ei", 1)][0])
+
+def one_shot_column_store():
+    """
+    Store the compact Kosko data as a column store, map it back
+    """
+    df = compact(df_kosko.head(1000), "kosko")
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "Kosko_processed.csv")
+        df_kosko.head(1000).to_csv(csv_path, index=False)
+        mapped = column_store.load(csv_path, lambda: df)
+        memory = column_store.frame_memory(mapped)
+        again = column_store.load(csv_path, lambda: 1 / 0) # built already, not rebuilt
+        result = (mapped.equals(df), list(mapped.dtypes) == list(df.dtypes),
+                  memory["shared"] > memory["private"], again.equals(df),
+                  len(os.listdir(column_store.store_path(csv_path))))
+        del mapped, again
+    return result
+
+def one_shot_column_store_version():
+    """
+    Rewrite the processed data, the store of the old version is replaced once it is
+    older than the grace period
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "A2EI_processed.csv")
+        df_a2ei.head(10).to_csv(csv_path, index=False)
+        column_store.load(csv_path, lambda: df_a2ei.head(10))
+        old = os.path.join(column_store.store_path(csv_path),
+                           column_store.version_name(data_version(csv_path)))
+        built = time.time() - column_store.GRACE - 1
+        os.utime(old, (built, built))
+        df_a2ei.head(20).to_csv(csv_path, index=False)
+        mapped = column_store.load(csv_path, lambda: df_a2ei.head(20))
+        stores = os.listdir(column_store.store_path(csv_path))
+        result = len(mapped), stores == [column_store.version_name(data_version(csv_path))]
+        del mapped
+    return result
+
+def edge_column_store_grace():
+    """
+    Test a worker opening the store of the version it looked up just before another
+    worker built a newer one
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "A2EI_processed.csv")
+        df_a2ei.head(10).to_csv(csv_path, index=False)
+        version = data_version(csv_path)
+        column_store.load(csv_path, lambda: df_a2ei.head(10))
+        df_a2ei.head(20).to_csv(csv_path, index=False)
+        column_store.load(csv_path, lambda: df_a2ei.head(20))
+        mapped = column_store.load(csv_path, lambda: 1 / 0, version)
+        result = len(mapped), len(os.listdir(column_store.store_path(csv_path)))
+        del mapped
+    return result
+
+def edge_column_store_missing():
+    """
+    Test opening the column store of processed data that does not exist
+    """
+    column_store.load(os.path.join(kosko_directory, "missing_processed.csv"), lambda: df_kosko)
+
+def one_shot_datastore():
+    """
+    Register two datasets, get one of them from several threads at once
+    """
+    calls = []
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return df_survey
+    store = DataStore()
+    store.register("survey", load)
+    store.register("kosko", lambda: calls.append(2))
+    lazy = not store.loaded("survey") and not calls
+    threads = [threading.Thread(target=store.get, args=("survey",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return lazy, calls, store.get("survey") is df_survey, store.loaded("kosko")
+
+def one_shot_datastore_warm_up():
+    """
+    Warm up a store with one dataset loaded already
+    """
+    store = DataStore()
+    store.register("survey", lambda: df_survey)
+    store.register("kosko", lambda: df_survey)
+    store.get("survey")
+    seconds = store.warm_up()
+    return sorted(store.data), seconds["survey"]
+
+def one_shot_datastore_reload():
+    """
+    Change the version of a dataset with a derived dataset, refresh twice
+    """
+    version = [1]
+    swapped = []
+    store = DataStore()
+    store.listeners.append(swapped.append)
+    store.register("kosko", lambda: df_survey.copy(), lambda: version[0])
+    store.register("consumption", lambda: len(store.get("kosko")), lambda: version[0],
+                   depends=["kosko"])
+    store.register("survey", lambda: df_survey, lambda: version[0])
+    old = store.get("kosko")
+    store.get("consumption")
+    unchanged = store.refresh()
+    version[0] = 2
+    reloaded = store.refresh()
+    return (unchanged, reloaded, swapped, store.get("kosko") is not old,
+            store.version("consumption"), store.loaded("survey"))
+
+def edge_datastore_reload_failure():
+    """
+    Test a reload whose loader fails, the loaded version is kept
+    """
+    version = [1]
+    store = DataStore()
+    store.register("kosko", lambda: 1 / (2 - version[0]), lambda: version[0])
+    store.get("kosko")
+    version[0] = 2
+    return store.refresh(), store.get("kosko"), store.version("kosko")
+
+def edge_datastore_unknown():
+    """
+    Test getting a dataset that was never registered
+    """
+    DataStore().get("kosko")
+
 class SurveyProcessing(unittest.TestCase):
     """
     Performs unit testing for survey processing
@@ -464,6 +1379,20 @@ class SurveyProcessing(unittest.TestCase):
         """Verify correct column reduction in survey data."""
         self.assertEqual(one_shot_column_reduction(), ['3','2'])
 
+    def test_one_shot_column_reduction_communities(self):
+        """Verify entry counts per community, in order of first appearance."""
+        self.assertEqual(one_shot_column_reduction_communities(),
+                         (["rent", "own"], [["2", "1"], ["0", "0"]]))
+
+    def test_edge_normalize_communities_chained(self):
+        """Check names are formatted as by one replacement per unique name in turn."""
+        self.assertEqual(edge_normalize_communities_chained(), ["Kibuye", "Kibuye", "Banda"])
+
+    def test_edge_normalize_communities_formatted(self):
+        """Check names already in dashboard format keep their name."""
+        self.assertEqual(edge_normalize_communities_formatted(),
+                         (["Kisumu", "Nairobi"], ["Village Abc", "Village Abc"]))
+
     def test_one_shot_column_reduction_n(self):
         """Ensure matrix-to-vector reduction works correctly."""
         community = df_survey["community_name"].unique()[0]
@@ -482,6 +1411,18 @@ class SurveyProcessing(unittest.TestCase):
         data = pd.DataFrame({"community_name": community,"data": np.ones(5)})
         self.assertEqual(one_shot_remove_sparsity().values.all(), data.values.all())
 
+    def test_one_shot_survey_append(self):
+        """Check appended batches give the output of processing all responses at once."""
+        self.assertEqual(one_shot_survey_append(), (True, True, True))
+
+    def test_edge_survey_append_resubmitted(self):
+        """Check responses processed already are not counted again."""
+        self.assertTrue(edge_survey_append_resubmitted())
+
+    def test_edge_survey_dry_run(self):
+        """Check a run writing no output leaves the saved append state alone."""
+        self.assertTrue(edge_survey_dry_run())
+
     def test_one_shot_final_dim(self):
         """Test if final dimension of processed survey data is correct."""
         self.assertEqual(one_shot_final_dim(), len(df_survey["community_name"].unique()))
@@ -507,6 +1448,49 @@ class KoskoProcessing(unittest.TestCase):
         out = [isinstance(q,d) for q,d in zip(query,data_type)]
         self.assertEqual(sum(out), len(data_type))
 
+    def test_kosko_incremental(self):
+        """Check incremental ingestion only reports new files and matches a full rebuild."""
+        first, second, match, files = one_shot_kosko_incremental()
+        self.assertEqual(first["new"], files[:2])
+        self.assertEqual(second, {"new": files[2:], "changed": [], "removed": []})
+        self.assertTrue(match)
+
+    def test_kosko_incremental_unchanged(self):
+        """Check an incremental run over unchanged exports parses nothing."""
+        changes, length = one_shot_kosko_incremental_unchanged()
+        self.assertEqual(changes, {"new": [], "changed": [], "removed": []})
+        self.assertGreater(length, 0)
+
+    def test_kosko_parallel(self):
+        """Check the parallel loader matches the serial loader."""
+        self.assertTrue(one_shot_kosko_parallel())
+
+    def test_kosko_compact(self):
+        """Check the compact schema data types, precision and memory footprint."""
+        dtypes, error, smaller = one_shot_kosko_compact()
+        self.assertEqual(dtypes, ["datetime64[ns]", "float32", "category", "category"])
+        self.assertLess(error, 5e-4)
+        self.assertTrue(smaller)
+
+    @unittest.skipUnless(HAS_PARQUET, "pyarrow is not installed")
+    def test_kosko_parquet(self):
+        """Check the Parquet copy loads with the processed data types."""
+        self.assertEqual(one_shot_kosko_parquet(), (True, "datetime64[ns]"))
+
+    @unittest.skipUnless(HAS_PARQUET, "pyarrow is not installed")
+    def test_write_processed_failed(self):
+        """Check a failed write keeps the previous files and leaves no partial file."""
+        self.assertEqual(edge_write_processed_failed(),
+                         (True, ["Kosko_processed.parquet"]))
+
+    def test_kosko_csv_ids(self):
+        """Check Kosko IDs read from the CSV are the zero padded strings of the frame."""
+        self.assertEqual(one_shot_kosko_csv_ids(), (True, "064"))
+
+    def test_kosko_parse_time(self):
+        """Check the vectorized timestamp parsing matches parsing per entry."""
+        self.assertTrue(one_shot_kosko_parse_time())
+
 class A2EIProcessing(unittest.TestCase):
     """
     Performs unit testing for A2EI processing
@@ -528,6 +1512,243 @@ class A2EIProcessing(unittest.TestCase):
         out = [isinstance(q,d) for q,d in zip(query,data_type)]
         self.assertEqual(sum(out), len(data_type))
 
+    def test_a2ei_parallel(self):
+        """Check the parallel loader matches the serial loader."""
+        self.assertTrue(one_shot_a2ei_parallel())
+
+    def test_a2ei_compact(self):
+        """Check the compact schema data types for A2EI."""
+        self.assertEqual(one_shot_a2ei_compact(), ("datetime64[ns]", "category"))
+
+    def test_a2ei_reformat_column(self):
+        """Check the vectorized time reformatting matches reformatting per entry."""
+        self.assertTrue(one_shot_a2ei_reformat_column())
+
+class MeterIndexTesting(unittest.TestCase):
+    """Perform unit testing for the per-meter row index."""
+    def test_meter_index(self):
+        """Check meter slices match boolean masks and IDs keep their order."""
+        self.assertEqual(one_shot_meter_index(), (True, True))
+
+    def test_meter_index_unsorted(self):
+        """Check non contiguous meters are grouped and unknown meters are empty."""
+        self.assertEqual(edge_meter_index_unsorted(), ([2, 1, 3], [0, 2], 0))
+
+    def test_meter_index_query(self):
+        """Check time windows found by binary search match boolean masks, as views."""
+        self.assertEqual(one_shot_meter_index_query(), (True, True))
+
+    def test_meter_index_query_unsorted(self):
+        """Check windows over unsorted times, missing times, spans and several meters."""
+        self.assertEqual(edge_meter_index_query(),
+                         ([1, 3, 0], [3], [1, 3], [21, 1], 0, "ValueError"))
+
+class RollupTesting(unittest.TestCase):
+    """Perform unit testing for the multi-resolution rollups."""
+    def test_rollup_kosko(self):
+        """Check every Kosko level covers the same samples and energy."""
+        self.assertEqual(one_shot_rollup("kosko", df_kosko), (True, True, True))
+
+    def test_rollup_a2ei(self):
+        """Check every A2EI level covers the same samples and energy."""
+        self.assertEqual(one_shot_rollup("a2ei", df_a2ei), (True, True, True))
+
+    def test_rollup_energy(self):
+        """Check register resets count the new reading, not a negative delta."""
+        energy, samples = one_shot_rollup_energy()
+        self.assertEqual(samples, [2, 2])
+        self.assertTrue(np.allclose(energy, [0.5, 0.7]))
+
+    def test_rollup_envelope(self):
+        """Check the envelope has two rows per bucket, the extremes and the raw columns."""
+        self.assertEqual(one_shot_rollup_envelope(), (True, True, True))
+
+    def test_rollup_choose_level(self):
+        """Check the coarsest level with enough rows is chosen."""
+        rows = {"1min": 5000, "15min": 900, "1h": 300, "1D": 20}
+        self.assertEqual(rollup.choose_level(rows, 250), "1h")
+        self.assertEqual(rollup.choose_level(rows, 10000), None)
+
+    def test_rollup_improper(self):
+        """Check for ValueError on an unknown rollup level."""
+        with self.assertRaises(ValueError):
+            edge_rollup_improper()
+
+class EventsTesting(unittest.TestCase):
+    """Perform unit testing for cooking event detection."""
+    def test_events(self):
+        """Check gap merging, minimum duration, energy and peak power."""
+        self.assertEqual(one_shot_events(), (1, True, True, 900))
+
+    def test_events_incremental(self):
+        """Check incremental detection equals detection over all data."""
+        self.assertTrue(one_shot_events_incremental())
+
+    def test_events_jobs(self):
+        """Check two processing jobs resuming from the saved state equal one full run."""
+        self.assertEqual(one_shot_events_jobs(), (True, True, True, True, True, 2, True))
+
+    def test_events_improper(self):
+        """Check for ValueError on an unknown data source."""
+        with self.assertRaises(ValueError):
+            edge_events_improper()
+
+class EnergyTesting(unittest.TestCase):
+    """Perform unit testing for the consumption from the KWH register."""
+    def test_register_delta(self):
+        """Check rollovers, resets and jitter of the register."""
+        self.assertTrue(np.allclose(one_shot_register_delta(), [0, 9, 4, 1, 1, 0]))
+
+    def test_daily_consumption(self):
+        """Check a gap is bridged proportionally and the gap day is estimated."""
+        energy_used, estimated = one_shot_daily_consumption()
+        self.assertTrue(np.allclose(energy_used, [0.75, 1.5, 0.75]))
+        self.assertEqual(estimated, [False, True, False])
+
+    def test_monthly_consumption(self):
+        """Check monthly consumption adds up to daily consumption."""
+        self.assertTrue(one_shot_monthly_consumption())
+
+    def test_smoke_consumption_plot(self):
+        """Test plotting functionality for fleet consumption."""
+        _ = smoke_consumption_plot()
+
+class PowerQualityTesting(unittest.TestCase):
+    """Perform unit testing for the power-quality analytics."""
+    def test_power_quality(self):
+        """Check every kind of disturbance is found with its length and worst value."""
+        self.assertEqual(one_shot_power_quality(),
+                         {"SAG": (2, 190.0), "INTERRUPTION": (1, 10.0),
+                          "FREQUENCY": (1, 51.0), "SWELL": (1, 270.0)})
+
+    def test_power_quality_summary(self):
+        """Check the daily summary counts and measures the disturbances."""
+        self.assertEqual(one_shot_power_quality_summary(),
+                         (4, 1, pd.Timedelta("2min"), 190.0))
+
+    def test_power_quality_rolling(self):
+        """Check the trailing window statistics."""
+        self.assertEqual(one_shot_power_quality_rolling(),
+                         ([240.0, 220.0, 195.0], [240.0, 200.0, 190.0]))
+
+    def test_power_quality_kosko(self):
+        """Check Kosko sags and swells are measured against the meters' median voltage."""
+        (nominal_sag, _), (sag, swell) = one_shot_power_quality_kosko()
+        self.assertGreater(nominal_sag, 0.3)
+        self.assertLess(sag, 0.1)
+        self.assertLess(swell, 0.1)
+
+class FigureCacheTesting(unittest.TestCase):
+    """Perform unit testing for the figure cache."""
+    def test_figure_cache(self):
+        """Check a repeated lookup returns the cached figure and counts a hit."""
+        self.assertEqual(one_shot_figure_cache(), (True, 1, 1))
+
+    def test_figure_cache_eviction(self):
+        """Check the least recently used figure is evicted when over budget."""
+        self.assertEqual(one_shot_figure_cache_eviction(), ([("kosko", 1), ("kosko", 3)], 1))
+
+    def test_figure_cache_invalidate(self):
+        """Check invalidation drops the figures of one data source only."""
+        self.assertEqual(edge_figure_cache_invalidate(), ([("a2ei", 1)], True))
+
+class SyntheticTesting(unittest.TestCase):
+    """Perform unit testing for the synthetic data generator."""
+    def test_synthetic_corpus(self):
+        """Ensure the generated exports process like the real ones."""
+        self.assertEqual(one_shot_synthetic_corpus(),
+                         ((864, 7), 0, ["064", "065", "066"], (864, 7), 10))
+
+    def test_synthetic_seeded(self):
+        """Ensure the output only depends on the arguments and the seed."""
+        self.assertEqual(edge_synthetic_seeded(), (True, False, 241))
+
+    def test_synthetic_chunk_times(self):
+        """Ensure the chunks' sample times form one continuous timeline."""
+        self.assertEqual(edge_synthetic_chunk_times(),
+                         (37029, "2023-01-31T10:00:03.000", "2023-02-03T09:59:59.000", True))
+
+class MetricsTesting(unittest.TestCase):
+    """Perform unit testing for the latency metrics."""
+    def test_metrics(self):
+        """Ensure durations, rows and errors of a timed stage are rendered."""
+        self.assertEqual(one_shot_metrics(), (True, True, True, True))
+
+    def test_metrics_disabled(self):
+        """Ensure disabled metrics return the function itself and record nothing."""
+        self.assertEqual(edge_metrics_disabled(), (True, "\n"))
+
+    def test_metrics_buckets(self):
+        """Check cumulative bucket counts and label escaping."""
+        self.assertEqual(edge_metrics_buckets(), ["1", "2", "2", "3", 'stage="a\\"b"'])
+
+    def test_metrics_multiprocess(self):
+        """Check the scraped metrics add up the files of every worker."""
+        self.assertEqual(one_shot_metrics_multiprocess(), (True, True, True, True, True))
+
+    def test_metrics_flush(self):
+        """Check observations are written without a further request and at exit."""
+        self.assertEqual(one_shot_metrics_flush(),
+                         ([["sparkboard_test_rows_total", "stage", "a", 3]],
+                          [["sparkboard_test_rows_total", "stage", "b", 4]]))
+
+class ProfilingTesting(unittest.TestCase):
+    """Perform unit testing for the profiling of slow calls."""
+    def test_profiling(self):
+        """Ensure profiles are kept with their inputs, rotated and nested calls included."""
+        self.assertEqual(one_shot_profiling(),
+                         (["test.outer", "test.outer"],
+                          {"df": {"rows": 10, "columns": ["x"]}, "label": "EM-064"},
+                          [True, True], True, True))
+
+    def test_profiling_threshold(self):
+        """Ensure fast calls are not kept and disabled profiling costs nothing."""
+        self.assertEqual(edge_profiling_threshold(), ([], True))
+
+class ColumnStoreTesting(unittest.TestCase):
+    """Perform unit testing for the memory-mapped column store."""
+    def test_column_store(self):
+        """Check a mapped store equals the data, with the same types, shared and built once."""
+        self.assertEqual(one_shot_column_store(), (True, True, True, True, 1))
+
+    def test_column_store_version(self):
+        """Check new processed data replaces the store of the old version."""
+        self.assertEqual(one_shot_column_store_version(), (20, True))
+
+    def test_column_store_grace(self):
+        """Check the store of the previous version stays readable for a while."""
+        self.assertEqual(edge_column_store_grace(), (10, 2))
+
+    def test_column_store_missing(self):
+        """Check for FileNotFoundError without processed data."""
+        with self.assertRaises(FileNotFoundError):
+            edge_column_store_missing()
+
+class DataStoreTesting(unittest.TestCase):
+    """Perform unit testing for lazy dataset loading."""
+    def test_datastore(self):
+        """Check datasets load on first use, once under concurrent first requests."""
+        self.assertEqual(one_shot_datastore(), (True, [1], True, False))
+
+    def test_datastore_warm_up(self):
+        """Check warm-up loads every dataset and skips loaded ones."""
+        self.assertEqual(one_shot_datastore_warm_up(), (["kosko", "survey"], 0.0))
+
+    def test_datastore_reload(self):
+        """Check changed datasets and their derived datasets are swapped, once."""
+        self.assertEqual(one_shot_datastore_reload(),
+                         ([], ["kosko", "consumption"], ["kosko", "consumption"], True, 2,
+                          False))
+
+    def test_datastore_reload_failure(self):
+        """Check a failed reload keeps serving the loaded version."""
+        self.assertEqual(edge_datastore_reload_failure(), ([], 1.0, 1))
+
+    def test_datastore_unknown(self):
+        """Check for KeyError on a dataset without a loader."""
+        with self.assertRaises(KeyError):
+            edge_datastore_unknown()
+
 class PlotTimeSeriesTesting(unittest.TestCase):
     """Perform unit testing for time series plotting."""
     def test_smoke_time_series_kosko_onoff(self):
@@ -591,6 +1812,41 @@ class PlotTimeSeriesTesting(unittest.TestCase):
         with self.assertRaises(AttributeError):
             edge_attribute_improper()
 
+    def test_render_mode_webgl(self):
+        """Check forced WebGL keeps the ON/OFF split traces."""
+        self.assertEqual(one_shot_render_mode("webgl"), ({"scattergl"}, True))
+
+    def test_render_mode_auto(self):
+        """Check 'auto' switches to WebGL above the point threshold only."""
+        self.assertEqual(one_shot_render_mode("auto"), ({"scatter"}, True))
+        self.assertEqual(one_shot_render_mode("auto", 10), ({"scattergl"}, True))
+
+    def test_render_mode_auto_defaults(self):
+        """Ensure 'auto' counts every trace drawn and reaches WebGL with default max points."""
+        self.assertEqual(one_shot_render_mode_defaults(), [(8, True, True), (4, False, False)])
+
+    def test_render_mode_improper(self):
+        """Check for ValueError on an unknown render mode."""
+        with self.assertRaises(ValueError):
+            edge_render_mode_improper()
+
+    def test_downsample_minmax(self):
+        """Check min/max downsampling keeps spikes under the point cap."""
+        self.assertEqual(one_shot_downsample("minmax"), (True, True, True))
+
+    def test_downsample_lttb(self):
+        """Check LTTB downsampling keeps spikes under the point cap."""
+        self.assertEqual(one_shot_downsample("lttb"), (True, True, True))
+
+    def test_downsample_small(self):
+        """Check traces under the point cap are not downsampled."""
+        self.assertTrue(edge_downsample_small())
+
+    def test_downsample_improper(self):
+        """Check for ValueError on an unknown downsampling method."""
+        with self.assertRaises(ValueError):
+            edge_downsample_improper()
+
 class PlotSurveyTesting(unittest.TestCase):
     """Perform unit testing for survey plotting."""
     def test_smoke_survey(self):
@@ -605,5 +1861,15 @@ class PlotSurveyTesting(unittest.TestCase):
         """Test for differences in expected and actual survey plots."""
         self.assertEqual(not np.isclose(one_shot_survey_plotting_abnormal(),0.0),1)
 
+    def test_survey_figures(self):
+        """Ensure a community's figure is built once and unknown ones are not kept."""
+        self.assertEqual(one_shot_survey_figures(), (True, True, 0, ["Makerere"]))
+
+    def test_survey_groups(self):
+        """Ensure survey columns are grouped by the part before '/'."""
+        self.assertEqual(edge_survey_groups(),
+                         {"gender": ["gender/male", "gender/female"],
+                          "sensor": ["sensor/kosko", "sensor/a2ei"]})
+
 if __name__ == "__main__":
     unittest.main()